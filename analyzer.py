@@ -0,0 +1,930 @@
+"""Building Gemini requests and turning their responses into result rows."""
+
+import asyncio
+import logging
+from math import ceil
+
+from google.genai import errors, types
+
+from cache import make_cache_key
+from images import load_image
+from metrics import retry_callback, time_stage
+from parser import make_row, parse_with_tier, process_response, split_json_objects
+from scheduler import estimate_request_tokens, is_retryable
+
+logger = logging.getLogger(__name__)
+
+
+def create_gemini_content(instructions, prompt, image_data, mime_type="image/png"):
+    """
+    Creates the content structure for the Gemini API request.
+
+    Args:
+        instructions (str): The instructions for the model.
+        prompt (str): The prompt for the model.
+        image_data (bytes): The raw image bytes.
+        mime_type (str): The MIME type of the image.
+
+    Returns:
+        list: A list of types.Content objects ready for the Gemini API.
+    """
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part(text=instructions),
+                types.Part(text=prompt),
+                types.Part(
+                    inline_data=types.Blob(mime_type=mime_type, data=image_data)
+                ),
+            ],
+        )
+    ]
+    return contents
+
+
+MULTI_IMAGE_INSTRUCTIONS = (
+    "You will be given {count} images, each preceded by its Image ID. Answer the "
+    "questions for every image. Respond with a JSON array holding one answer "
+    'object per image, in the order given, with "Image ID" set to the ID that '
+    "precedes the image."
+)
+
+# Output token ceiling of a request, whatever the number of images it carries.
+MAX_OUTPUT_TOKENS = 65535
+
+
+def create_multi_image_content(instructions, prompt, images):
+    """
+    Creates the content of a request that carries several labeled images.
+
+    The instructions and prompt come first, as in `create_gemini_content`, so
+    the context cache prefix is the same for both kinds of request.
+
+    Args:
+        images (list[tuple[str, bytes, str]]): The label, bytes and MIME type
+            of each image.
+
+    Returns:
+        list: A list of types.Content objects ready for the Gemini API.
+    """
+    parts = [
+        types.Part(text=instructions),
+        types.Part(text=prompt),
+        types.Part(text=MULTI_IMAGE_INSTRUCTIONS.format(count=len(images))),
+    ]
+    for label, image_data, mime_type in images:
+        parts.append(types.Part(text=f"Image ID: {label}"))
+        parts.append(
+            types.Part(inline_data=types.Blob(mime_type=mime_type, data=image_data))
+        )
+    return [types.Content(role="user", parts=parts)]
+
+
+SAFETY_SETTINGS = [
+    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
+]
+
+
+def create_generate_content_config(
+    temperature=0,
+    top_p=0.95,
+    max_output_tokens=8192,
+    response_modalities=["TEXT"],
+    response_schema=None,
+):
+    """
+    Creates and returns a GenerateContentConfig object with predefined settings.
+
+    Args:
+        response_schema (types.Schema | None): Schema the response must match,
+            see `schema.build_response_schema`. The response is then plain JSON.
+
+    Returns:
+        types.GenerateContentConfig: A configured GenerateContentConfig object.
+    """
+    generate_content_config = types.GenerateContentConfig(
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=max_output_tokens,
+        response_modalities=response_modalities,
+        safety_settings=SAFETY_SETTINGS,
+        response_mime_type="application/json" if response_schema else None,
+        response_schema=response_schema,
+    )
+    return generate_content_config
+
+
+def build_request(
+    image_path, instructions, prompt, preprocessor=None, response_schema=None
+):
+    """
+    Loads an image and builds the request contents and config for it.
+
+    Args:
+        preprocessor (ImagePreprocessor | None): Shrinks the image before it is
+            sent.
+        response_schema (types.Schema | None): Schema of the response.
+
+    Returns:
+        tuple | None: The image bytes, the contents and the config, or None if
+        the image could not be loaded.
+    """
+    image = load_image(image_path)
+    if image is None:
+        return None
+    if preprocessor is not None:
+        image = preprocessor.process(*image)
+
+    contents = create_gemini_content(instructions, prompt, *image)
+
+    generate_content_config = create_generate_content_config(
+        response_schema=response_schema
+    )
+    return image[0], contents, generate_content_config
+
+
+def build_result(response_text, image_id, record=None):
+    """
+    Parses a response into a result row keyed by `image_id`.
+
+    The parse tier is noted in `record`, an `ImageMetrics`, if given.
+    """
+    _result, tier = parse_with_tier(response_text, image_id)
+    if record is not None:
+        record.update(parse_tier=tier)
+    if _result:
+        return make_row(_result, image_id)
+    else:
+        logger.error("Error loading image %s", image_id)
+        return None
+
+
+def load_images(work_items, preprocessor=None):
+    """
+    Loads the images of several work items for one multi-image request.
+
+    Returns:
+        list[tuple[str, bytes, str]]: The image id, bytes and MIME type of each
+        image that could be loaded.
+    """
+    images = []
+    for image_id, image_path in work_items:
+        image = load_image(image_path)
+        if image is None:
+            continue
+        if preprocessor is not None:
+            image = preprocessor.process(*image)
+        images.append((image_id, *image))
+    return images
+
+
+def build_multi_image_request(images, instructions, prompt, response_schema=None):
+    """
+    Builds the request for several loaded images.
+
+    Returns:
+        tuple: The bytes the response cache key is derived from, the contents
+        and the config.
+    """
+    labels = [str(image_id) for image_id, _, _ in images]
+    contents = create_multi_image_content(
+        instructions,
+        prompt,
+        [(label, data, mime) for label, (_, data, mime) in zip(labels, images)],
+    )
+    config = create_generate_content_config(
+        max_output_tokens=min(MAX_OUTPUT_TOKENS, 8192 * len(images)),
+        response_schema=(
+            types.Schema(type=types.Type.ARRAY, items=response_schema)
+            if response_schema
+            else None
+        ),
+    )
+    key_data = b"".join(
+        label.encode("utf-8") + b"\0" + data
+        for label, (_, data, _) in zip(labels, images)
+    )
+    return key_data, contents, config
+
+
+def is_truncated(response):
+    """Returns True if the model stopped because it ran out of output tokens."""
+    candidates = getattr(response, "candidates", None)
+    return bool(candidates) and (
+        candidates[0].finish_reason == types.FinishReason.MAX_TOKENS
+    )
+
+
+def match_rows(response_text, image_ids):
+    """
+    Parses a multi-image response into the result rows of `image_ids`.
+
+    Each answer object is matched by its "Image ID". Answers without a known
+    ID are matched by position, but only when the response has exactly one
+    answer per image.
+
+    Returns:
+        dict: The result row of each image id that could be matched.
+    """
+    by_label = {str(image_id): image_id for image_id in image_ids}
+    objects = split_json_objects(response_text or "")
+    positional = len(objects) == len(image_ids)
+    rows = {}
+    for position, text in enumerate(objects):
+        answers = process_response(text)
+        if answers is None:
+            continue
+        image_id = by_label.get(str(answers.get("Image ID")))
+        if image_id is None or image_id in rows:
+            image_id = image_ids[position] if positional else None
+        if image_id is None or image_id in rows:
+            continue
+        rows[image_id] = make_row(answers, image_id)
+    return rows
+
+
+def _halves(images):
+    half = ceil(len(images) / 2)
+    return [part for part in (images[:half], images[half:]) if part]
+
+
+def use_cached_content(contents, config, cached_content):
+    """
+    Rewrites a request to reference a cached instructions and prompt prefix.
+
+    Returns:
+        tuple: The contents without the instructions and prompt parts, and a
+        copy of the config pointing at `cached_content`.
+    """
+    # The instructions and prompt are always the first two parts; anything
+    # after them (images, and the labels of multi-image requests) is sent.
+    parts = contents[0].parts[2:]
+    return (
+        [types.Content(role=contents[0].role, parts=parts)],
+        config.model_copy(update={"cached_content": cached_content}),
+    )
+
+
+def _send(fn, model, contents, config, scheduler, tokens, on_retry=None):
+    request = {"model": model, "contents": contents, "config": config}
+    if scheduler is not None:
+        return scheduler.call(fn, tokens=tokens, on_retry=on_retry, **request)
+    return fn(**request)
+
+
+async def _send_async(fn, model, contents, config, scheduler, tokens, on_retry=None):
+    request = {"model": model, "contents": contents, "config": config}
+    if scheduler is not None:
+        return await scheduler.call_async(
+            fn, tokens=tokens, on_retry=on_retry, **request
+        )
+    return await fn(**request)
+
+
+# Errors of a request that references a cached content which expired, was
+# deleted, or no longer matches the model.
+CACHED_CONTENT_STATUSES = ("NOT_FOUND", "FAILED_PRECONDITION")
+
+
+def _cached_content_failed(prompt_cache, cached_content, error):
+    """
+    Decides whether a failure is caused by the context cache.
+
+    Other errors, such as a rejected image, are raised as they are, so they
+    do not replace a cache that is still valid.
+    """
+    if not isinstance(error, errors.APIError) or is_retryable(error):
+        return False
+    if error.code != 404 and error.status not in CACHED_CONTENT_STATUSES:
+        return False
+    prompt_cache.invalidate(cached_content)
+    logger.warning(
+        "Request using context cache %s failed, retrying with the full prompt: %s",
+        cached_content,
+        error,
+    )
+    return True
+
+
+def generate(
+    client,
+    model,
+    contents,
+    config,
+    scheduler=None,
+    prompt_cache=None,
+    tokens=0,
+    on_retry=None,
+):
+    """
+    Calls `generate_content`, through the scheduler and context cache if given.
+
+    A request that uses the context cache and fails with a non-retryable error
+    is sent once more with the full prompt, so an expired or unsupported cache
+    never costs a row. `on_retry` is called with the error of each retried
+    attempt.
+    """
+    fn = client.models.generate_content
+    cached_content = prompt_cache.get_name() if prompt_cache is not None else None
+    if cached_content:
+        try:
+            response = _send(
+                fn,
+                model,
+                *use_cached_content(contents, config, cached_content),
+                scheduler,
+                tokens,
+                on_retry,
+            )
+            prompt_cache.record_usage(response.usage_metadata)
+            return response
+        except Exception as e:
+            if not _cached_content_failed(prompt_cache, cached_content, e):
+                raise
+
+    response = _send(fn, model, contents, config, scheduler, tokens, on_retry)
+    if prompt_cache is not None:
+        prompt_cache.record_usage(response.usage_metadata)
+    return response
+
+
+async def generate_async(
+    client,
+    model,
+    contents,
+    config,
+    scheduler=None,
+    prompt_cache=None,
+    tokens=0,
+    on_retry=None,
+):
+    """Asynchronous counterpart of `generate` using `client.aio`."""
+    fn = client.aio.models.generate_content
+    cached_content = None
+    if prompt_cache is not None:
+        cached_content = await asyncio.to_thread(prompt_cache.get_name)
+    if cached_content:
+        try:
+            response = await _send_async(
+                fn,
+                model,
+                *use_cached_content(contents, config, cached_content),
+                scheduler,
+                tokens,
+                on_retry,
+            )
+            prompt_cache.record_usage(response.usage_metadata)
+            return response
+        except Exception as e:
+            if not _cached_content_failed(prompt_cache, cached_content, e):
+                raise
+
+    response = await _send_async(
+        fn, model, contents, config, scheduler, tokens, on_retry
+    )
+    if prompt_cache is not None:
+        prompt_cache.record_usage(response.usage_metadata)
+    return response
+
+
+def _prompt_cache_for(prompt_cache, model):
+    """Returns the context cache if it was created for `model`, else None."""
+    if prompt_cache is not None and prompt_cache.model == model:
+        return prompt_cache
+    return None
+
+
+def _fetch_text(
+    client,
+    model,
+    image_data,
+    contents,
+    config,
+    instructions,
+    prompt,
+    cache,
+    scheduler,
+    prompt_cache,
+    record,
+):
+    """
+    Returns the response text of a request, from the response cache if it
+    has one, and the usage metadata of the response (None on a cache hit).
+    """
+    if cache is not None:
+        with time_stage(record, "cache"):
+            cache_key = make_cache_key(image_data, instructions, prompt, model, config)
+            response_text = cache.get(cache_key)
+        if record is not None:
+            record.update(cache_hit=response_text is not None)
+        if response_text is not None:
+            return response_text, None
+
+    with time_stage(record, "request"):
+        response = generate(
+            client,
+            model,
+            contents,
+            config,
+            scheduler=scheduler,
+            prompt_cache=prompt_cache,
+            tokens=estimate_request_tokens(instructions, prompt),
+            on_retry=retry_callback(record),
+        )
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if record is not None:
+        record.record_usage(usage_metadata, model)
+    if cache is not None and response.text:
+        cache.put(cache_key, response.text)
+    return response.text, usage_metadata
+
+
+async def _fetch_text_async(
+    client,
+    model,
+    image_data,
+    contents,
+    config,
+    instructions,
+    prompt,
+    cache,
+    scheduler,
+    prompt_cache,
+    record,
+):
+    """Asynchronous counterpart of `_fetch_text`."""
+    if cache is not None:
+        with time_stage(record, "cache"):
+            cache_key = make_cache_key(image_data, instructions, prompt, model, config)
+            response_text = await asyncio.to_thread(cache.get, cache_key)
+        if record is not None:
+            record.update(cache_hit=response_text is not None)
+        if response_text is not None:
+            return response_text, None
+
+    with time_stage(record, "request"):
+        response = await generate_async(
+            client,
+            model,
+            contents,
+            config,
+            scheduler=scheduler,
+            prompt_cache=prompt_cache,
+            tokens=estimate_request_tokens(instructions, prompt),
+            on_retry=retry_callback(record),
+        )
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if record is not None:
+        record.record_usage(usage_metadata, model)
+    if cache is not None and response.text:
+        await asyncio.to_thread(cache.put, cache_key, response.text)
+    return response.text, usage_metadata
+
+
+def analyze_image(
+    client,
+    model,
+    image_path,
+    instructions,
+    prompt,
+    cache=None,
+    image_id=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    metrics=None,
+    cascade=None,
+):
+    """
+    Analyzes a single image and returns the result.
+
+    Args:
+        client (genai.Client): The Gemini API client.
+        model (str): The Gemini model identifier.
+        image_path (Path): Path of the image to analyze.
+        instructions (str): The instructions for the model.
+        prompt (str): The prompt for the model.
+        cache (ResponseCache | None): Cache checked before calling the API.
+        image_id (str | None): Value of the "id" column. Defaults to the file name.
+        scheduler (RequestScheduler | None): Rate limits and retries the API call.
+        prompt_cache (PromptCache | None): Context cache of the instructions and
+            prompt referenced instead of sending them.
+        preprocessor (ImagePreprocessor | None): Shrinks the image before it is
+            sent.
+        response_schema (types.Schema | None): Schema the response must match.
+        metrics (RunMetrics | None): Collects the stage timings and token
+            counts of the request.
+        cascade (ModelCascade | None): Models tried in turn instead of
+            `model`, see `cascade.ModelCascade`.
+
+    Returns:
+        dict | None: The parsed answers, or None if the image could not be analyzed.
+    """
+    if image_id is None:
+        image_id = image_path.name
+
+    record = metrics.start(image_id, model) if metrics is not None else None
+    result = None
+    try:
+        logger.info("Processing image %s", image_path)
+        with time_stage(record, "load"):
+            prepared = build_request(
+                image_path, instructions, prompt, preprocessor, response_schema
+            )
+        if prepared is None:
+            return None
+        image_data, contents, generate_content_config = prepared
+
+        def attempt(model):
+            try:
+                response_text, usage_metadata = _fetch_text(
+                    client,
+                    model,
+                    image_data,
+                    contents,
+                    generate_content_config,
+                    instructions,
+                    prompt,
+                    cache,
+                    scheduler,
+                    _prompt_cache_for(prompt_cache, model),
+                    record,
+                )
+            # Any failure counts as no answer, and a cascade asks the next model.
+            except Exception as e:  # noqa: BLE001
+                logger.error(
+                    "Error processing image %s with %s: %s", image_id, model, e
+                )
+                return None, None
+            with time_stage(record, "parse"):
+                return build_result(response_text, image_id, record), usage_metadata
+
+        if cascade is None:
+            result, _ = attempt(model)
+        else:
+            result, model = cascade.route(attempt)
+            if record is not None:
+                record.update(model=model)
+        return result
+
+    except Exception as e:
+        logger.error("Error processing image %s: %s", image_id, e)
+        return None
+    finally:
+        if record is not None:
+            metrics.finish(record, result is not None)
+
+
+async def analyze_image_async(
+    client,
+    model,
+    image_path,
+    instructions,
+    prompt,
+    cache=None,
+    image_id=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    metrics=None,
+    cascade=None,
+):
+    """
+    Asynchronous counterpart of `analyze_image` using `client.aio`.
+
+    Loading the image and the cache lookups run in a worker thread so that
+    they do not block the event loop.
+    """
+    if image_id is None:
+        image_id = image_path.name
+
+    record = metrics.start(image_id, model) if metrics is not None else None
+    result = None
+    try:
+        logger.info("Processing image %s", image_path)
+        with time_stage(record, "load"):
+            prepared = await asyncio.to_thread(
+                build_request,
+                image_path,
+                instructions,
+                prompt,
+                preprocessor,
+                response_schema,
+            )
+        if prepared is None:
+            return None
+        image_data, contents, generate_content_config = prepared
+
+        async def attempt(model):
+            try:
+                response_text, usage_metadata = await _fetch_text_async(
+                    client,
+                    model,
+                    image_data,
+                    contents,
+                    generate_content_config,
+                    instructions,
+                    prompt,
+                    cache,
+                    scheduler,
+                    _prompt_cache_for(prompt_cache, model),
+                    record,
+                )
+            # Any failure counts as no answer, and a cascade asks the next model.
+            except Exception as e:  # noqa: BLE001
+                logger.error(
+                    "Error processing image %s with %s: %s", image_id, model, e
+                )
+                return None, None
+            with time_stage(record, "parse"):
+                return build_result(response_text, image_id, record), usage_metadata
+
+        if cascade is None:
+            result, _ = await attempt(model)
+        else:
+            result, model = await cascade.route_async(attempt)
+            if record is not None:
+                record.update(model=model)
+        return result
+
+    except Exception as e:
+        logger.error("Error processing image %s: %s", image_id, e)
+        return None
+    finally:
+        if record is not None:
+            metrics.finish(record, result is not None)
+
+
+def _analyze_images(
+    client,
+    model,
+    images,
+    instructions,
+    prompt,
+    cache,
+    scheduler,
+    prompt_cache,
+    response_schema,
+    metrics,
+    record=None,
+):
+    image_ids = [image_id for image_id, _, _ in images]
+    if record is None and metrics is not None:
+        record = metrics.start(image_ids[0], model, len(images))
+    rows = {}
+    try:
+        key_data, contents, config = build_multi_image_request(
+            images, instructions, prompt, response_schema
+        )
+        cache_key = response_text = None
+        if cache is not None:
+            with time_stage(record, "cache"):
+                cache_key = make_cache_key(
+                    key_data, instructions, prompt, model, config
+                )
+                response_text = cache.get(cache_key)
+            if record is not None:
+                record.update(cache_hit=response_text is not None)
+        if response_text is None:
+            with time_stage(record, "request"):
+                response = generate(
+                    client,
+                    model,
+                    contents,
+                    config,
+                    scheduler=scheduler,
+                    prompt_cache=prompt_cache,
+                    tokens=estimate_request_tokens(instructions, prompt, len(images)),
+                    on_retry=retry_callback(record),
+                )
+            if record is not None:
+                record.record_usage(response.usage_metadata)
+            response_text = None if is_truncated(response) else response.text
+            with time_stage(record, "parse"):
+                rows = match_rows(response_text, image_ids)
+            # Only complete responses are cached, or the retry would replay them.
+            if cache is not None and len(rows) == len(images):
+                cache.put(cache_key, response_text)
+        else:
+            with time_stage(record, "parse"):
+                rows = match_rows(response_text, image_ids)
+    # Whatever failed, the images are left missing and retried in halves.
+    except Exception as e:  # noqa: BLE001
+        logger.error(
+            "Error processing images %s: %s", ", ".join(map(str, image_ids)), e
+        )
+    if record is not None:
+        metrics.finish(record, len(rows) == len(images))
+
+    missing = [image for image in images if image[0] not in rows]
+    if len(missing) == 1 and len(images) == 1:
+        logger.error("Error loading image %s", missing[0][0])
+    elif missing:
+        logger.warning(
+            "%d of %d images missing from a multi-image response, retrying in halves",
+            len(missing),
+            len(images),
+        )
+        for part in _halves(missing):
+            rows.update(
+                _analyze_images(
+                    client,
+                    model,
+                    part,
+                    instructions,
+                    prompt,
+                    cache,
+                    scheduler,
+                    prompt_cache,
+                    response_schema=response_schema,
+                    metrics=metrics,
+                )
+            )
+    return rows
+
+
+def analyze_images(
+    client,
+    model,
+    work_items,
+    instructions,
+    prompt,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    metrics=None,
+):
+    """
+    Analyzes several images with a single request.
+
+    The images are sent together, each labeled with its id, and the model
+    answers with a JSON array. When the response is truncated, fails, or
+    does not answer for every image, the images left over are split in halves
+    and sent again, down to one image per request.
+
+    Args:
+        work_items (list[tuple[str, Path]]): The (image_id, image_path) pairs,
+            see `engines.split_work_item`.
+
+    Other arguments are as for `analyze_image`.
+
+    Returns:
+        list[dict]: The result rows of the images that could be analyzed.
+    """
+    record = None
+    if metrics is not None and work_items:
+        record = metrics.start(work_items[0][0], model, len(work_items))
+    with time_stage(record, "load"):
+        images = load_images(work_items, preprocessor)
+    if not images:
+        if record is not None:
+            metrics.finish(record, False)
+        return []
+    rows = _analyze_images(
+        client,
+        model,
+        images,
+        instructions,
+        prompt,
+        cache,
+        scheduler,
+        prompt_cache,
+        response_schema,
+        metrics,
+        record,
+    )
+    return [rows[image_id] for image_id, _, _ in images if image_id in rows]
+
+
+async def _analyze_images_async(
+    client,
+    model,
+    images,
+    instructions,
+    prompt,
+    cache,
+    scheduler,
+    prompt_cache,
+    response_schema,
+    metrics,
+    record=None,
+):
+    image_ids = [image_id for image_id, _, _ in images]
+    if record is None and metrics is not None:
+        record = metrics.start(image_ids[0], model, len(images))
+    rows = {}
+    try:
+        key_data, contents, config = build_multi_image_request(
+            images, instructions, prompt, response_schema
+        )
+        cache_key = response_text = None
+        if cache is not None:
+            with time_stage(record, "cache"):
+                cache_key = make_cache_key(
+                    key_data, instructions, prompt, model, config
+                )
+                response_text = await asyncio.to_thread(cache.get, cache_key)
+            if record is not None:
+                record.update(cache_hit=response_text is not None)
+        if response_text is None:
+            with time_stage(record, "request"):
+                response = await generate_async(
+                    client,
+                    model,
+                    contents,
+                    config,
+                    scheduler=scheduler,
+                    prompt_cache=prompt_cache,
+                    tokens=estimate_request_tokens(instructions, prompt, len(images)),
+                    on_retry=retry_callback(record),
+                )
+            if record is not None:
+                record.record_usage(response.usage_metadata)
+            response_text = None if is_truncated(response) else response.text
+            with time_stage(record, "parse"):
+                rows = match_rows(response_text, image_ids)
+            if cache is not None and len(rows) == len(images):
+                await asyncio.to_thread(cache.put, cache_key, response_text)
+        else:
+            with time_stage(record, "parse"):
+                rows = match_rows(response_text, image_ids)
+    # Whatever failed, the images are left missing and retried in halves.
+    except Exception as e:  # noqa: BLE001
+        logger.error(
+            "Error processing images %s: %s", ", ".join(map(str, image_ids)), e
+        )
+    if record is not None:
+        metrics.finish(record, len(rows) == len(images))
+
+    missing = [image for image in images if image[0] not in rows]
+    if len(missing) == 1 and len(images) == 1:
+        logger.error("Error loading image %s", missing[0][0])
+    elif missing:
+        logger.warning(
+            "%d of %d images missing from a multi-image response, retrying in halves",
+            len(missing),
+            len(images),
+        )
+        for part in _halves(missing):
+            rows.update(
+                await _analyze_images_async(
+                    client,
+                    model,
+                    part,
+                    instructions,
+                    prompt,
+                    cache,
+                    scheduler,
+                    prompt_cache,
+                    response_schema=response_schema,
+                    metrics=metrics,
+                )
+            )
+    return rows
+
+
+async def analyze_images_async(
+    client,
+    model,
+    work_items,
+    instructions,
+    prompt,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    metrics=None,
+):
+    """Asynchronous counterpart of `analyze_images` using `client.aio`."""
+    record = None
+    if metrics is not None and work_items:
+        record = metrics.start(work_items[0][0], model, len(work_items))
+    with time_stage(record, "load"):
+        images = await asyncio.to_thread(load_images, work_items, preprocessor)
+    if not images:
+        if record is not None:
+            metrics.finish(record, False)
+        return []
+    rows = await _analyze_images_async(
+        client,
+        model,
+        images,
+        instructions,
+        prompt,
+        cache,
+        scheduler,
+        prompt_cache,
+        response_schema,
+        metrics,
+        record,
+    )
+    return [rows[image_id] for image_id, _, _ in images if image_id in rows]
@@ -0,0 +1,256 @@
+"""Whole-corpus analysis through Vertex AI batch prediction."""
+
+import base64
+import hashlib
+import json
+import logging
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from tqdm import tqdm
+
+from analyzer import build_request, build_result
+
+logger = logging.getLogger(__name__)
+
+# Config fields that are top-level request fields rather than generationConfig.
+REQUEST_LEVEL_FIELDS = ("safetySettings", "systemInstruction", "cachedContent")
+
+FINISHED_STATES = (
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+)
+SUCCEEDED_STATES = ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED")
+
+
+def image_digest(image_data):
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def create_batch_request(contents, config):
+    """
+    Serializes `generate_content` arguments into a batch GenerateContentRequest.
+
+    Args:
+        contents (list[types.Content]): As built by `create_gemini_content`.
+        config (types.GenerateContentConfig): As built by
+            `create_generate_content_config`.
+
+    Returns:
+        dict: The JSON request for one line of the batch input.
+    """
+    generation_config = config.model_dump(mode="json", exclude_none=True, by_alias=True)
+    request = {
+        "contents": [
+            content.model_dump(mode="json", exclude_none=True, by_alias=True)
+            for content in contents
+        ]
+    }
+    for field in REQUEST_LEVEL_FIELDS:
+        if field in generation_config:
+            request[field] = generation_config.pop(field)
+    request["generationConfig"] = generation_config
+    return request
+
+
+def write_batch_input(
+    image_files,
+    instructions,
+    prompt,
+    requests_file,
+    image_uri=None,
+    response_schema=None,
+):
+    """
+    Writes one batch request per image to a JSONL file.
+
+    Vertex echoes each request next to its response, so output lines are
+    matched back to images by the image URI or by a digest of the inline bytes.
+
+    Args:
+        image_files (Iterable[tuple[str, Path]]): The id and path of each image.
+        requests_file (Path): The JSONL file to write.
+        image_uri (callable | None): Maps an image path to a `gs://` URI. When
+            given, requests reference the image instead of inlining its bytes.
+
+    Returns:
+        dict[str, list[str]]: The image ids of each image URI or digest.
+    """
+    keys = defaultdict(list)
+    with open(requests_file, "w", encoding="utf-8") as f:
+        for image_id, image_path in tqdm(image_files, desc="Writing batch requests"):
+            prepared = build_request(
+                image_path, instructions, prompt, response_schema=response_schema
+            )
+            if prepared is None:
+                continue
+            image_data, contents, config = prepared
+            request = create_batch_request(contents, config)
+            if image_uri is not None:
+                key = image_uri(image_path)
+                image_part = request["contents"][0]["parts"][-1]
+                inline_data = image_part.pop("inlineData")
+                image_part["fileData"] = {
+                    "fileUri": key,
+                    "mimeType": inline_data["mimeType"],
+                }
+            else:
+                key = image_digest(image_data)
+            # Identical images share one request and its response.
+            if key not in keys:
+                f.write(json.dumps({"request": request}) + "\n")
+            keys[key].append(image_id)
+    return keys
+
+
+def get_response_text(line):
+    """Returns the text of the first candidate of a batch output line."""
+    response = line.get("response") or {}
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts if not part.get("thought"))
+
+
+def get_line_key(line):
+    """Returns the image URI or digest of the request echoed in an output line."""
+    try:
+        image_part = line["request"]["contents"][0]["parts"][-1]
+    except (KeyError, IndexError, TypeError):
+        return None
+    if "fileData" in image_part:
+        return image_part["fileData"].get("fileUri")
+    if "inlineData" in image_part:
+        return image_digest(base64.b64decode(image_part["inlineData"]["data"]))
+    return None
+
+
+class VertexBatchBackend:
+    """
+    Submits batch prediction jobs to Vertex AI through `client.batches`.
+
+    Input files are uploaded to, and outputs read from, `gcs_prefix` with the
+    optional google-cloud-storage package.
+    """
+
+    def __init__(self, client, gcs_prefix):
+        self.client = client
+        self.gcs_prefix = gcs_prefix.rstrip("/")
+
+    @staticmethod
+    def _storage_client():
+        try:
+            from google.cloud import storage
+        except ImportError as e:
+            raise ImportError(
+                "Batch mode needs google-cloud-storage: uv add google-cloud-storage"
+            ) from e
+        return storage.Client()
+
+    @staticmethod
+    def _split_uri(uri):
+        bucket, _, path = uri.removeprefix("gs://").partition("/")
+        return bucket, path
+
+    def submit(self, model, requests_file):
+        run_prefix = f"{self.gcs_prefix}/{Path(requests_file).stem}-{int(time.time())}"
+        input_uri = f"{run_prefix}/input.jsonl"
+        bucket, path = self._split_uri(input_uri)
+        self._storage_client().bucket(bucket).blob(path).upload_from_filename(
+            str(requests_file)
+        )
+        job = self.client.batches.create(
+            model=model,
+            src=input_uri,
+            config={"dest": f"{run_prefix}/output"},
+        )
+        logger.info("Submitted batch job %s", job.name)
+        return job.name
+
+    def poll(self, job_name):
+        job = self.client.batches.get(name=job_name)
+        return str(job.state.value if hasattr(job.state, "value") else job.state)
+
+    def results(self, job_name):
+        job = self.client.batches.get(name=job_name)
+        bucket, prefix = self._split_uri(job.dest.gcs_uri)
+        for blob in self._storage_client().list_blobs(bucket, prefix=prefix):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            with blob.open("r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def run_batch(
+    backend,
+    model,
+    image_files,
+    instructions,
+    prompt,
+    on_result,
+    requests_file,
+    image_uri=None,
+    poll_interval=60,
+    response_schema=None,
+):
+    """
+    Analyzes images with a single batch prediction job.
+
+    Args:
+        backend: Object with `submit(model, requests_file) -> job`,
+            `poll(job) -> state` and `results(job) -> Iterable[dict]`.
+        image_files (Iterable[tuple[str, Path]]): The id and path of each image.
+        on_result (callable): Called with each parsed result row.
+        requests_file (Path): Where the batch input JSONL is written.
+        image_uri (callable | None): See `write_batch_input`.
+        poll_interval (float): Seconds between job status checks.
+        response_schema (types.Schema | None): See `write_batch_input`.
+
+    Returns:
+        tuple[int, int]: The number of images analyzed and the number submitted.
+    """
+    keys = write_batch_input(
+        image_files,
+        instructions,
+        prompt,
+        requests_file,
+        image_uri=image_uri,
+        response_schema=response_schema,
+    )
+    total = sum(map(len, keys.values()))
+    if not total:
+        return 0, 0
+
+    job = backend.submit(model, requests_file)
+    while (state := backend.poll(job)) not in FINISHED_STATES:
+        logger.info("Batch job %s is %s", job, state)
+        time.sleep(poll_interval)
+    if state not in SUCCEEDED_STATES:
+        logger.error("Batch job %s finished as %s", job, state)
+        return 0, total
+
+    analyzed = 0
+    for line in backend.results(job):
+        image_ids = keys.get(get_line_key(line))
+        if not image_ids:
+            logger.error("Could not match a batch output line to an image")
+            continue
+        response_text = get_response_text(line)
+        if not response_text:
+            logger.error(
+                "No response for image %s: %s", image_ids[0], line.get("status")
+            )
+            continue
+        for image_id in image_ids:
+            result = build_result(response_text, image_id)
+            if result:
+                on_result(result)
+                analyzed += 1
+    return analyzed, total
@@ -0,0 +1,737 @@
+"""Benchmarks for the analysis pipeline that run without spending API quota."""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import re
+import resource
+import sqlite3
+import tempfile
+import time
+from contextlib import redirect_stderr
+from functools import reduce
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from google import genai
+from google.genai import types
+from json_repair import repair_json
+from PIL import Image
+
+from engines import ENGINES, run_async, run_serial, run_threaded
+from fake_client import FakeClient, ReplayResponder, default_response, image_labels
+from index import (
+    Index,
+    assign_post_id,
+    get_group_counters,
+    group_mapping,
+    image_file_extensions,
+    iter_image_files,
+)
+from parser import convert_dicts_to_dataframe, parse_json_like_output, parse_stats
+from pipeline import run_pipeline
+from preprocess import ImagePreprocessor
+from scheduler import RequestScheduler, estimate_request_tokens
+
+# Some modules configure logging on import; keep the benchmark output quiet.
+logging.basicConfig(
+    level=logging.WARNING, format="%(levelname)s: %(message)s", force=True
+)
+
+# The smallest valid PNG: a single transparent pixel.
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+STUB_RESPONSE = json.dumps(
+    {"Image ID": "image.png", **{str(i): "Yes" for i in range(1, 18)}}
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every generateContent call with a fixed response after a delay."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        body = json.dumps(
+            {
+                "candidates": [
+                    {
+                        "content": {
+                            "role": "model",
+                            "parts": [{"text": STUB_RESPONSE}],
+                        },
+                        "finishReason": "STOP",
+                    }
+                ],
+                "usageMetadata": {
+                    "promptTokenCount": 2500,
+                    "candidatesTokenCount": 300,
+                    "totalTokenCount": 2800,
+                },
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve_stub(latency, ports):
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    server.latency = latency
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def start_stub_server(latency):
+    """
+    Starts a local Gemini stub server in a separate process.
+
+    Running it out of process keeps its threads from competing for the GIL
+    with the engine being measured.
+    """
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve_stub, args=(latency, ports), daemon=True
+    )
+    server.start()
+    server.server_port = ports.get()
+    return server
+
+
+def stub_client(server):
+    """
+    Returns a real `genai.Client` whose requests go to the stub server.
+
+    The async client binds its connections to the running event loop, so a
+    new client is needed for each `asyncio.run`.
+    """
+    return genai.Client(
+        api_key="stub",
+        http_options=types.HttpOptions(
+            base_url=f"http://127.0.0.1:{server.server_port}"
+        ),
+    )
+
+
+def screenshot_png(side, seed=0):
+    """Returns a noisy `side` x `side` PNG, costly to decode and re-encode."""
+    pixels = np.random.default_rng(seed).integers(0, 256, (side, side, 3), np.uint8)
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def make_corpus(directory, size, groups=10, image=TINY_PNG):
+    """Writes `size` copies of a screenshot spread over `groups` folders."""
+    directory = Path(directory)
+    for i in range(size):
+        group = directory / f"group_{i % groups}"
+        group.mkdir(parents=True, exist_ok=True)
+        (group / f"image_{i:06d}.png").write_bytes(image)
+    return directory
+
+
+def bench_engines(args):
+    """Compares the engines against the stub server."""
+    server = start_stub_server(args.latency)
+    instructions, prompt = "instructions " * 100, "prompt " * 2000
+    image = screenshot_png(args.image_side) if args.image_side else TINY_PNG
+    print(f"{'engine':<8} {'images':>8} {'seconds':>9} {'images/s':>9}")
+    try:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                corpus = make_corpus(tmp, size, image=image)
+                for engine in args.engines:
+                    client = stub_client(server)
+                    options = {
+                        "scheduler": RequestScheduler(max_workers=args.max_workers),
+                        "preprocessor": (
+                            ImagePreprocessor() if args.preprocess else None
+                        ),
+                    }
+                    results = []
+                    start = time.perf_counter()
+                    if engine == "async":
+                        run = run_async
+                    elif engine == "pipeline":
+                        run = run_pipeline
+                    else:
+                        run = run_threaded
+                    try:
+                        run(
+                            client,
+                            "gemini-stub",
+                            list(iter_image_files(corpus)),
+                            instructions,
+                            prompt,
+                            results.append,
+                            **options,
+                        )
+                    finally:
+                        if options["preprocessor"] is not None:
+                            options["preprocessor"].close()
+                    elapsed = time.perf_counter() - start
+                    assert len(results) == size, f"{engine} lost rows"
+                    print(
+                        f"{engine:<8} {size:>8} {elapsed:>9.2f} {size / elapsed:>9.1f}"
+                    )
+    finally:
+        server.terminate()
+
+
+def bench_multi(args):
+    """Compares packing several images per request against one image each."""
+    instructions, prompt = "instructions " * 100, "prompt " * 2000
+
+    def respond(contents):
+        # Decoding and answering cost grows with the images in the request.
+        time.sleep(args.image_latency * max(1, len(image_labels(contents))))
+        return default_response(contents)
+
+    print(
+        f"{'images/req':>10} {'images':>8} {'requests':>9} {'seconds':>9} "
+        f"{'images/s':>9} {'in tok/img':>10}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = make_corpus(tmp, args.size)
+        for images_per_request in args.images_per_request:
+            client = FakeClient(respond=respond, latency=args.latency)
+            results = []
+            start = time.perf_counter()
+            run_threaded(
+                client,
+                "model",
+                [(f"{f.parent.name}/{f.name}", f) for f in iter_image_files(corpus)],
+                instructions,
+                prompt,
+                results.append,
+                scheduler=RequestScheduler(max_workers=args.max_workers),
+                images_per_request=images_per_request,
+            )
+            elapsed = time.perf_counter() - start
+            assert len(results) == args.size, "packed requests lost rows"
+            tokens = estimate_request_tokens(instructions, prompt, images_per_request)
+            print(
+                f"{images_per_request:>10} {args.size:>8} {client.calls:>9} "
+                f"{elapsed:>9.2f} {args.size / elapsed:>9.1f} "
+                f"{tokens / images_per_request:>10.0f}"
+            )
+
+
+def synthetic_rows(size, questions=17, seed=0):
+    """Builds result rows with the ragged key sets the model produces."""
+    rng = random.Random(seed)
+    for i in range(size):
+        row = {str(q): f"answer {q}" for q in range(1, questions + 1)}
+        if rng.random() < 0.1:
+            del row[str(rng.randint(1, questions))]
+        if rng.random() < 0.05:
+            row[str(questions + 1)] = "extra"
+        row["id"] = f"image_{i:07d}.png"
+        yield row
+
+
+def concat_rows(rows):
+    """The previous one-DataFrame-per-row implementation, for comparison."""
+    dfs = [pd.DataFrame({k: [v] for k, v in d.items()}) for d in rows]
+    return reduce(lambda x, y: pd.concat([x, y], axis=0, ignore_index=True), dfs)
+
+
+def bench_convert(args):
+    """Times convert_dicts_to_dataframe, optionally against the old concat fold."""
+    print(f"{'method':<8} {'rows':>8} {'seconds':>9} {'us/row':>8}")
+    for size in args.sizes:
+        rows = list(synthetic_rows(size))
+        methods = [("columnar", convert_dicts_to_dataframe)]
+        if size <= args.concat_limit:
+            methods.append(("concat", concat_rows))
+        for name, method in methods:
+            start = time.perf_counter()
+            method(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<8} {size:>8} {elapsed:>9.2f} {elapsed / size * 1e6:>8.1f}")
+
+
+def synthetic_filenames(size):
+    """Yields file names spread over the groups of the default mapping."""
+    groups = list(group_mapping)
+    for i in range(size):
+        yield f"{groups[i % len(groups)]}/image_{i:07d}.png"
+
+
+def allocate_ids(filenames, counted=True):
+    """Builds an index from scratch, allocating one post ID per file."""
+    index = {}
+    counters = get_group_counters(index) if counted else None
+    for filename in filenames:
+        index[filename] = assign_post_id(filename, index, group_mapping, counters)
+    return index
+
+
+def bench_index(args):
+    """Times post ID allocation with group counters, optionally against the scan."""
+    print(f"{'method':<8} {'entries':>8} {'seconds':>9} {'us/entry':>9}")
+    for size in args.sizes:
+        filenames = list(synthetic_filenames(size))
+        methods = [("counters", True)]
+        if size <= args.scan_limit:
+            methods.append(("scan", False))
+        indexes = []
+        for name, counted in methods:
+            start = time.perf_counter()
+            indexes.append(allocate_ids(filenames, counted=counted))
+            elapsed = time.perf_counter() - start
+            print(f"{name:<8} {size:>8} {elapsed:>9.2f} {elapsed / size * 1e6:>9.1f}")
+        assert all(index == indexes[0] for index in indexes), "post IDs differ"
+
+
+def rglob_images(directory):
+    """The previous full scan of `Index.process_directory`, for comparison."""
+    return [
+        f
+        for f in sorted(Path(directory).rglob("*"))
+        if f.is_file() and f.suffix.lower() in image_file_extensions
+    ]
+
+
+def bench_scan(args):
+    """Times re-indexing a large share after a few screenshots were added."""
+    print(f"{'method':<12} {'files':>8} {'seconds':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = Path(tmp) / "assets"
+        for i, filename in enumerate(synthetic_filenames(args.size)):
+            path = corpus / filename
+            if i < len(group_mapping):
+                path.parent.mkdir(parents=True)
+            path.touch()
+        index_file = Path(tmp) / "file_index.json"
+        # Backdate the directories so the scan trusts their mtimes, as it
+        # would for a share copied on a previous day.
+        for directory in [corpus, *corpus.iterdir()]:
+            stat = directory.stat()
+            os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**10))
+
+        start = time.perf_counter()
+        Index(corpus, index_file)
+        print(f"{'first index':<12} {args.size:>8} {time.perf_counter() - start:>9.3f}")
+
+        group = corpus / next(iter(group_mapping))
+        for i in range(args.new):
+            (group / f"new_{i:04d}.png").touch()
+
+        start = time.perf_counter()
+        rglob_images(corpus)
+        print(f"{'rglob only':<12} {args.size:>8} {time.perf_counter() - start:>9.3f}")
+
+        start = time.perf_counter()
+        index = Index(corpus, index_file)
+        elapsed = time.perf_counter() - start
+        assert len(index) == args.size + args.new, "scan lost files"
+        print(f"{'incremental':<12} {args.size:>8} {elapsed:>9.3f}")
+
+
+def legacy_parse(output_text):
+    """The previous `parse_json_like_output`, which always ran `repair_json`."""
+    output_text = output_text.strip()
+    if output_text.startswith("```json") and output_text.endswith("```"):
+        output_text = output_text[7:-3].strip()
+    elif not output_text.startswith("{") or not output_text.endswith("}"):
+        match = re.search(r"\{.*\}", output_text, re.DOTALL)
+        if not match:
+            return None
+        output_text = match.group(0)
+    try:
+        return json.loads(repair_json(output_text.replace("'", '"')))
+    except json.JSONDecodeError:
+        return None
+
+
+def synthetic_responses(size, seed=0):
+    """Yields responses in the shapes the model returns, mostly well formed."""
+    rng = random.Random(seed)
+    for i in range(size):
+        answers = {"Image ID": f"image_{i}.png"}
+        for question in range(1, 18):
+            answers[str(question)] = rng.choice(
+                [
+                    "Yes",
+                    "No",
+                    "Cannot determine from image",
+                    "We can't let them ruin the ocean's views. " * rng.randint(1, 8),
+                ]
+            )
+        text = json.dumps(answers, indent=4, ensure_ascii=False)
+        shape = rng.random()
+        if shape < 0.6:
+            yield f"```json\n{text}\n```"
+        elif shape < 0.85:
+            yield text
+        elif shape < 0.95:
+            yield f"Here is the analysis:\n{text}\nLet me know if you need more."
+        else:
+            yield text.replace('"\n}', '",\n}')
+
+
+def load_responses(corpus):
+    """Reads the raw responses stored in a response cache database."""
+    with sqlite3.connect(corpus) as connection:
+        return [row[0] for row in connection.execute("SELECT response FROM responses")]
+
+
+def bench_parse(args):
+    """Times parsing model responses with the tiered parser and the old one."""
+    if args.corpus is not None:
+        responses = load_responses(args.corpus)
+    else:
+        responses = list(synthetic_responses(args.size))
+    # The logs of unparseable responses would swamp the timings.
+    logging.getLogger("parser").setLevel(logging.CRITICAL)
+
+    print(f"{'method':<8} {'responses':>9} {'seconds':>9} {'us/resp':>9}")
+    parse_stats.reset()
+    for name, parse in [("tiered", parse_json_like_output), ("legacy", legacy_parse)]:
+        start = time.perf_counter()
+        for response in responses:
+            parse(response)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<8} {len(responses):>9} {elapsed:>9.3f} "
+            f"{elapsed / max(len(responses), 1) * 1e6:>9.1f}"
+        )
+    print("tiers:", ", ".join(f"{k}={v}" for k, v in parse_stats.report().items()))
+
+
+REPLAY_ENGINES = {
+    "serial": run_serial,
+    "threads": run_threaded,
+    "async": run_async,
+    "pipeline": run_pipeline,
+}
+
+
+def replay_run(engine, corpus, options, results):
+    """
+    Runs one engine over a corpus against a replaying `FakeClient`.
+
+    Runs in its own process, so that the CPU time and peak RSS it reports
+    belong to this engine alone; the pipeline's worker processes count as
+    children.
+    """
+    # Keep the progress bars and logs of the engine out of the table.
+    with open(os.devnull, "w") as devnull, redirect_stderr(devnull):
+        logging.disable(logging.CRITICAL)
+        respond = (
+            ReplayResponder(options["fixtures"])
+            if options["fixtures"]
+            else lambda contents: STUB_RESPONSE
+        )
+        client = FakeClient(
+            respond=respond,
+            latency=options["latency"],
+            throttle_rate=options["throttle_rate"],
+            error_rate=options["error_rate"],
+            malformed_rate=options["malformed_rate"],
+            seed=0,
+        )
+        # Short backoffs, so injected errors cost retries rather than sleeps.
+        scheduler = RequestScheduler(
+            max_workers=options["max_workers"], base_delay=0.01, max_delay=0.5
+        )
+        start = time.perf_counter()
+        analyzed, total = REPLAY_ENGINES[engine](
+            client,
+            "gemini-replay",
+            iter_image_files(corpus),
+            "instructions " * 100,
+            "prompt " * 2000,
+            lambda result: None,
+            scheduler=scheduler,
+        )
+        elapsed = time.perf_counter() - start
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        results.put(
+            {
+                "analyzed": analyzed,
+                "total": total,
+                "seconds": elapsed,
+                "cpu": own.ru_utime
+                + own.ru_stime
+                + children.ru_utime
+                + children.ru_stime,
+                # Kilobytes on Linux.
+                "peak_rss": max(own.ru_maxrss, children.ru_maxrss) / 1024,
+            }
+        )
+
+
+def _replay_stats(process, results):
+    """Waits for the stats of a `replay_run`, or None if its process died."""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The process may have put its stats just before exiting.
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            return None
+
+
+def bench_replay(args):
+    """Runs each engine over synthetic corpora against replayed responses."""
+    options = {
+        "fixtures": args.fixtures,
+        "latency": args.latency,
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+        "max_workers": args.max_workers,
+    }
+    context = multiprocessing.get_context("spawn")
+    print(
+        f"{'engine':<8} {'images':>8} {'analyzed':>8} {'seconds':>9} "
+        f"{'images/s':>9} {'cpu s':>7} {'peak MB':>8}"
+    )
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            corpus = make_corpus(tmp, size)
+            for engine in args.engines:
+                results = context.Queue()
+                process = context.Process(
+                    target=replay_run, args=(engine, corpus, options, results)
+                )
+                process.start()
+                stats = _replay_stats(process, results)
+                process.join()
+                if stats is None:
+                    print(f"{engine:<8} failed with exit code {process.exitcode}")
+                    continue
+                print(
+                    f"{engine:<8} {stats['total']:>8} {stats['analyzed']:>8} "
+                    f"{stats['seconds']:>9.2f} "
+                    f"{stats['total'] / stats['seconds']:>9.1f} "
+                    f"{stats['cpu']:>7.1f} {stats['peak_rss']:>8.0f}"
+                )
+
+
+def main():
+    epilog = """Example:
+    uv run bench.py engines --sizes 1000 10000 100000 --max-workers 64
+    uv run bench.py engines --sizes 2000 --image-side 1500 --preprocess
+    uv run bench.py convert --sizes 1000 10000 100000 1000000
+    uv run bench.py index --sizes 1000 10000 100000
+    uv run bench.py scan --size 100000 --new 50
+    uv run bench.py parse --corpus .cache/responses.sqlite3
+    uv run bench.py multi --images-per-request 1 4 8 16
+    uv run bench.py replay --sizes 1000 10000 100000 --latency lognormal:0.5,0.6
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the analysis pipeline offline.", epilog=epilog
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    engines_parser = subparsers.add_parser(
+        "engines", help="Compare the engines on a stub server."
+    )
+    engines_parser.add_argument(
+        "--sizes", default=[1000], help="Corpus sizes to run.", nargs="+", type=int
+    )
+    engines_parser.add_argument(
+        "--engines",
+        default=list(ENGINES),
+        help="Engines to compare.",
+        nargs="+",
+        choices=ENGINES,
+    )
+    engines_parser.add_argument(
+        "--max-workers", default=32, help="Concurrent requests per engine.", type=int
+    )
+    engines_parser.add_argument(
+        "--latency", default=0.05, help="Stub server latency in seconds.", type=float
+    )
+    engines_parser.add_argument(
+        "--preprocess",
+        action="store_true",
+        help="Preprocess the images, as with --preprocess in main-t.py.",
+    )
+    engines_parser.add_argument(
+        "--image-side",
+        default=0,
+        help="Side of the noisy screenshots to analyze. Defaults to a 1 pixel PNG.",
+        type=int,
+    )
+    engines_parser.set_defaults(run=bench_engines)
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="Time building the results DataFrame from result rows."
+    )
+    convert_parser.add_argument(
+        "--sizes",
+        default=[1000, 10000, 100000, 1000000],
+        help="Numbers of rows to convert.",
+        nargs="+",
+        type=int,
+    )
+    convert_parser.add_argument(
+        "--concat-limit",
+        default=5000,
+        help="Also time the old concat fold up to this many rows.",
+        type=int,
+    )
+    convert_parser.set_defaults(run=bench_convert)
+
+    index_parser = subparsers.add_parser(
+        "index", help="Time allocating post IDs for a growing index."
+    )
+    index_parser.add_argument(
+        "--sizes",
+        default=[1000, 10000, 100000],
+        help="Numbers of index entries to allocate.",
+        nargs="+",
+        type=int,
+    )
+    index_parser.add_argument(
+        "--scan-limit",
+        default=10000,
+        help="Also time the full-index scan up to this many entries.",
+        type=int,
+    )
+    index_parser.set_defaults(run=bench_index)
+
+    scan_parser = subparsers.add_parser(
+        "scan", help="Time re-indexing a share after new screenshots arrive."
+    )
+    scan_parser.add_argument(
+        "--size", default=100000, help="Files already indexed.", type=int
+    )
+    scan_parser.add_argument(
+        "--new", default=50, help="Screenshots added before re-indexing.", type=int
+    )
+    scan_parser.set_defaults(run=bench_scan)
+
+    parse_parser = subparsers.add_parser(
+        "parse", help="Time parsing model responses into answer dictionaries."
+    )
+    parse_parser.add_argument(
+        "--corpus",
+        default=None,
+        help=(
+            "Response cache database whose stored responses are parsed. "
+            "Defaults to a synthetic corpus."
+        ),
+        type=Path,
+    )
+    parse_parser.add_argument(
+        "--size", default=10000, help="Size of the synthetic corpus.", type=int
+    )
+    parse_parser.set_defaults(run=bench_parse)
+
+    multi_parser = subparsers.add_parser(
+        "multi", help="Time packing several images into each request."
+    )
+    multi_parser.add_argument(
+        "--images-per-request",
+        default=[1, 4, 8, 16],
+        help="Images per request to compare.",
+        nargs="+",
+        type=int,
+    )
+    multi_parser.add_argument(
+        "--size", default=2000, help="Images to analyze.", type=int
+    )
+    multi_parser.add_argument(
+        "--latency",
+        default=0.2,
+        help="Fixed seconds each request takes.",
+        type=float,
+    )
+    multi_parser.add_argument(
+        "--image-latency",
+        default=0.02,
+        help="Additional seconds per image in a request.",
+        type=float,
+    )
+    multi_parser.add_argument(
+        "--max-workers", default=32, help="Concurrent requests.", type=int
+    )
+    multi_parser.set_defaults(run=bench_multi)
+
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help=(
+            "Run each engine against replayed responses and report images/s, "
+            "CPU time and peak RSS."
+        ),
+    )
+    replay_parser.add_argument(
+        "--sizes", default=[1000], help="Corpus sizes to run.", nargs="+", type=int
+    )
+    replay_parser.add_argument(
+        "--engines",
+        default=list(REPLAY_ENGINES),
+        help="Engines to run.",
+        nargs="+",
+        choices=list(REPLAY_ENGINES),
+    )
+    replay_parser.add_argument(
+        "--fixtures",
+        default=None,
+        help=(
+            "Directory of responses recorded with --record. Defaults to a fixed "
+            "well-formed response."
+        ),
+        type=Path,
+    )
+    replay_parser.add_argument(
+        "--latency",
+        default="lognormal:0.05,0.5",
+        help="Request latency in seconds or as a distribution, see --replay-latency.",
+    )
+    replay_parser.add_argument(
+        "--throttle-rate", default=0.0, help="Share of 429 responses.", type=float
+    )
+    replay_parser.add_argument(
+        "--error-rate", default=0.0, help="Share of 503 responses.", type=float
+    )
+    replay_parser.add_argument(
+        "--malformed-rate",
+        default=0.0,
+        help="Share of damaged JSON responses.",
+        type=float,
+    )
+    replay_parser.add_argument(
+        "--max-workers", default=32, help="Concurrent requests.", type=int
+    )
+    replay_parser.set_defaults(run=bench_replay)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""On-disk cache of raw Gemini responses keyed by the content of each request."""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(".cache")
+CACHE_FILE_NAME = "responses.sqlite3"
+
+# Run eviction after this many insertions.
+EVICTION_INTERVAL = 500
+
+
+def make_cache_key(image_data, instructions, prompt, model, config=None):
+    """
+    Builds a content-addressed cache key for a request.
+
+    Args:
+        image_data (bytes): The raw image bytes sent to the model.
+        instructions (str): The instructions for the model.
+        prompt (str): The prompt for the model.
+        model (str): The Gemini model identifier.
+        config (types.GenerateContentConfig | None): The generation config.
+
+    Returns:
+        str: A hex SHA-256 digest identifying the request.
+    """
+    # The context cache only changes how the prompt is sent, not the answer.
+    config_json = (
+        config.model_dump_json(exclude_none=True, exclude={"cached_content"})
+        if config
+        else ""
+    )
+    digest = hashlib.sha256()
+    for part in (
+        image_data,
+        instructions.encode("utf-8"),
+        prompt.encode("utf-8"),
+        str(model).encode("utf-8"),
+        config_json.encode("utf-8"),
+    ):
+        # Length-prefix each part so that different splits never collide.
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed store of raw `response.text` values.
+
+    Entries older than `max_age` seconds are ignored and evicted. When the
+    stored text exceeds `max_size` bytes, the least recently used entries are
+    evicted first. The cache is safe to share between threads.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=None, max_age=None):
+        self.path = Path(cache_dir) / CACHE_FILE_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.evict()
+
+    def get(self, key):
+        """Returns the cached response text for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response_text):
+        """Stores the response text for `key`."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response_text, len(response_text.encode("utf-8")), now, now),
+            )
+            self._puts += 1
+            evict = self._puts % EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Removes expired entries, then least recently used ones over the size cap."""
+        with self._lock:
+            if self.max_age:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE created_at < ?",
+                    (time.time() - self.max_age,),
+                )
+            if self.max_size:
+                (total,) = self._connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                if total > self.max_size:
+                    rows = self._connection.execute(
+                        "SELECT key, size FROM responses ORDER BY accessed_at"
+                    ).fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_size:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._connection.executemany(
+                        "DELETE FROM responses WHERE key = ?", stale
+                    )
+                    logger.info("Evicted %d cached responses", len(stale))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+        logger.info("Response cache: %d hits, %d misses", self.hits, self.misses)
+
+
+def add_cache_arguments(parser):
+    """Adds the response cache options to an argparse parser."""
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory of the response cache. Defaults to '{DEFAULT_CACHE_DIR}'.",
+        type=Path,
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the API and do not store responses.",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        default=None,
+        help="Evict least recently used responses above this size in MB.",
+        type=float,
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        default=None,
+        help="Ignore and evict responses older than this many days.",
+        type=float,
+    )
+
+
+def cache_from_args(args):
+    """Opens the response cache configured on the command line, if enabled."""
+    if args.no_cache:
+        return None
+    return ResponseCache(
+        args.cache_dir,
+        max_size=args.cache_max_size * 1024**2 if args.cache_max_size else None,
+        max_age=args.cache_max_age * 86400 if args.cache_max_age else None,
+    )
@@ -0,0 +1,245 @@
+"""Routing each image through a cascade of models, cheapest first."""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from gemini import GeminiModel, estimate_cost
+from metrics import TOKEN_FIELDS, percentiles
+from schema import CANNOT_DETERMINE, extract_questions
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_REASONS = ("parse", "missing_keys", "undetermined")
+
+# Share of "Cannot determine from image" answers above which a stronger model
+# is asked.
+DEFAULT_MAX_UNDETERMINED = 0.5
+
+
+def escalation_reason(row, required_keys=(), max_undetermined=DEFAULT_MAX_UNDETERMINED):
+    """
+    Decides whether the answer of a model should be escalated.
+
+    Args:
+        row (dict | None): The result row, or None if the request failed or
+            its response could not be parsed.
+        required_keys (Iterable[str]): Keys every answer must have, such as
+            the question numbers.
+        max_undetermined (float): Largest acceptable share of answers that are
+            "Cannot determine from image".
+
+    Returns:
+        str | None: One of `ESCALATION_REASONS`, or None to accept the row.
+    """
+    if row is None:
+        return "parse"
+    if any(key not in row for key in required_keys):
+        return "missing_keys"
+    answers = [value for key, value in row.items() if key != "id"]
+    undetermined = sum(
+        isinstance(value, str) and value.strip() == CANNOT_DETERMINE
+        for value in answers
+    )
+    if answers and undetermined / len(answers) > max_undetermined:
+        return "undetermined"
+    return None
+
+
+class _TierStats:
+    def __init__(self):
+        self.requests = 0
+        self.accepted = 0
+        self.escalated = defaultdict(int)
+        self.latencies = []
+        self.tokens = dict.fromkeys(TOKEN_FIELDS, 0)
+
+
+class ModelCascade:
+    """
+    Sends each image to the cheapest model first and escalates to the next
+    one only when the answer is unusable.
+
+    An answer is escalated when the request fails or its response cannot be
+    parsed (both counted as "parse"), when it misses one of the required
+    keys, or when it has too many "Cannot determine from image" answers, see
+    `escalation_reason`. The last model's answer is kept whatever it is,
+    unless there is none and an earlier model gave one. The requests, hits,
+    escalations, latency and tokens of each tier are counted for `report`.
+    The class is safe to share between threads.
+
+    Args:
+        models (list[str]): The models to try, cheapest first.
+        required_keys (Iterable[str]): Keys every answer must have.
+        max_undetermined (float): Largest acceptable share of undetermined
+            answers.
+    """
+
+    def __init__(
+        self, models, required_keys=(), max_undetermined=DEFAULT_MAX_UNDETERMINED
+    ):
+        if not models:
+            raise ValueError("A cascade needs at least one model")
+        self.models = [str(model) for model in models]
+        self.required_keys = tuple(required_keys)
+        self.max_undetermined = max_undetermined
+        self._stats = {model: _TierStats() for model in self.models}
+        self._lock = threading.Lock()
+
+    def _record(self, model, seconds, reason, usage_metadata):
+        with self._lock:
+            stats = self._stats[model]
+            stats.requests += 1
+            stats.latencies.append(seconds)
+            if reason is None:
+                stats.accepted += 1
+            else:
+                stats.escalated[reason] += 1
+            for field, attribute in TOKEN_FIELDS.items():
+                stats.tokens[field] += getattr(usage_metadata, attribute, None) or 0
+
+    def _judge(self, tier, model, started, row, usage_metadata):
+        """Records an attempt and returns whether to try the next model."""
+        reason = escalation_reason(row, self.required_keys, self.max_undetermined)
+        last = tier == len(self.models) - 1
+        self._record(
+            model,
+            time.perf_counter() - started,
+            None if last and row is not None else reason,
+            usage_metadata,
+        )
+        if reason is not None and not last:
+            logger.info("Escalating from %s (%s)", model, reason)
+        return reason is not None and not last
+
+    def route(self, attempt):
+        """
+        Runs `attempt` on each model in turn until an answer is accepted.
+
+        Args:
+            attempt (callable): Takes a model and returns the result row, or
+                None, and the usage metadata of the response.
+
+        Returns:
+            tuple[dict | None, str]: The result row and the model it came from.
+        """
+        best = None
+        for tier, model in enumerate(self.models):
+            started = time.perf_counter()
+            row, usage_metadata = attempt(model)
+            if row is not None:
+                best = row, model
+            if not self._judge(tier, model, started, row, usage_metadata):
+                break
+        return best or (None, model)
+
+    async def route_async(self, attempt):
+        """Asynchronous counterpart of `route`, awaiting `attempt`."""
+        best = None
+        for tier, model in enumerate(self.models):
+            started = time.perf_counter()
+            row, usage_metadata = await attempt(model)
+            if row is not None:
+                best = row, model
+            if not self._judge(tier, model, started, row, usage_metadata):
+                break
+        return best or (None, model)
+
+    def report(self):
+        """
+        Returns the counts, hit rate, latency percentiles and cost of each
+        tier. The hit rate is the share of the tier's requests whose answer
+        was kept.
+        """
+        with self._lock:
+            report = {}
+            for model, stats in self._stats.items():
+                p50, p95, p99 = percentiles(stats.latencies)
+                report[model] = {
+                    "requests": stats.requests,
+                    "accepted": stats.accepted,
+                    "hit_rate": stats.accepted / stats.requests
+                    if stats.requests
+                    else 0.0,
+                    "escalated": dict(stats.escalated),
+                    "latency": {"p50": p50, "p95": p95, "p99": p99},
+                    "tokens": dict(stats.tokens),
+                    "cost": estimate_cost(
+                        model,
+                        stats.tokens["prompt_tokens"],
+                        stats.tokens["output_tokens"] + stats.tokens["thoughts_tokens"],
+                        stats.tokens["cached_tokens"],
+                    ),
+                }
+            return report
+
+    def log_report(self):
+        """Logs the report of each tier and returns it."""
+        report = self.report()
+        for model, tier in report.items():
+            escalated = ", ".join(
+                f"{reason} {count}" for reason, count in tier["escalated"].items()
+            )
+            cost = f"${tier['cost']:.4f}" if tier["cost"] is not None else "unknown"
+            logger.info(
+                "Cascade tier %s: %d requests, %d answered (%.1f%%), escalated: %s; "
+                "latency p50 %.2fs p95 %.2fs; cost %s",
+                model,
+                tier["requests"],
+                tier["accepted"],
+                100 * tier["hit_rate"],
+                escalated or "none",
+                tier["latency"]["p50"],
+                tier["latency"]["p95"],
+                cost,
+            )
+        return report
+
+
+def add_cascade_arguments(parser):
+    """Adds the options of model cascading to an argparse parser."""
+    model_choices = [model.value for model in GeminiModel]
+    parser.add_argument(
+        "--cascade",
+        default=None,
+        nargs="+",
+        choices=model_choices,
+        metavar="MODEL_IDENTIFIER",
+        help=(
+            "Send each image to the first of these models and escalate to the "
+            "next one only if the answer cannot be parsed, misses questions, or "
+            "cannot determine too many of them. Overrides --model, e.g. "
+            f"--cascade {GeminiModel.FLASH_LITE_2_0} {GeminiModel.PRO_2_5_PREVIEW}."
+        ),
+    )
+    parser.add_argument(
+        "--max-undetermined",
+        default=DEFAULT_MAX_UNDETERMINED,
+        help=(
+            f'Largest share of "{CANNOT_DETERMINE}" answers a cascade tier may '
+            f"give before escalating. Defaults to {DEFAULT_MAX_UNDETERMINED}."
+        ),
+        type=float,
+    )
+
+
+def cascade_from_args(args, prompt):
+    """
+    Returns the model cascade configured on the command line, or None.
+
+    The question numbers of the prompt's question list are the keys every
+    answer must have.
+
+    Raises:
+        ValueError: If the options are invalid.
+    """
+    if not args.cascade:
+        return None
+    if not 0 <= args.max_undetermined <= 1:
+        raise ValueError("--max-undetermined must be between 0 and 1")
+    required_keys = [str(question["number"]) for question in extract_questions(prompt)]
+    if not required_keys:
+        logger.warning("The prompt has no question list; no keys are required")
+    logger.info("Cascading through %s", " -> ".join(args.cascade))
+    return ModelCascade(args.cascade, required_keys, args.max_undetermined)
@@ -0,0 +1,174 @@
+"""Append-only JSONL checkpoints of result rows and their compilation to CSV."""
+
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def default_checkpoint_path(output_file):
+    """Returns the checkpoint path used for `output_file` when none is given."""
+    if output_file is None:
+        return Path("results.jsonl")
+    return Path(output_file).with_suffix(".jsonl")
+
+
+def _drop_partial_line(path):
+    """Truncates a trailing line left incomplete by a crash mid-write."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line.
+        position = size - 1
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        f.truncate(position)
+        logger.warning("Dropped an incomplete last row from %s", path)
+
+
+class CheckpointWriter:
+    """
+    Appends result rows to a JSONL file as they complete.
+
+    Every row is flushed as soon as it is written so a crash loses at most the
+    row in progress. With `resume=False` an existing checkpoint is truncated.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists():
+            _drop_partial_line(self.path)
+        # Stays open until close().
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")  # noqa: SIM115
+        self._lock = threading.Lock()
+        self.rows = 0
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.rows += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_checkpoint(path):
+    """Yields the rows of a checkpoint, skipping lines that cannot be parsed."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Skipping unreadable line %d of %s", line_number, path)
+
+
+def read_done_ids(*paths):
+    """Returns the ids of the rows already present in the given checkpoints."""
+    done = set()
+    for path in paths:
+        if Path(path).exists():
+            done.update(str(row.get("id")) for row in iter_checkpoint(path))
+    return done
+
+
+def compile_checkpoint(checkpoint_paths, output_file):
+    """
+    Writes the rows of one or more checkpoints to a CSV file.
+
+    The id column comes first, the remaining columns follow in the order they
+    first appear, and only the first row of each id is kept. Repeated rows are
+    logged, separately from rows whose answers disagree with the kept one.
+    Rows are streamed twice (once for the columns, once to write them) and
+    never held in memory together.
+
+    Returns:
+        int: The number of rows written.
+    """
+    if isinstance(checkpoint_paths, (str, Path)):
+        checkpoint_paths = [checkpoint_paths]
+
+    columns = {"id": None}
+    for path in checkpoint_paths:
+        for row in iter_checkpoint(path):
+            columns.update(dict.fromkeys(row))
+
+    # Digest of the row kept for each id, to tell repeats from conflicts.
+    seen = {}
+    duplicates = conflicts = 0
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(columns), restval="")
+        writer.writeheader()
+        for path in checkpoint_paths:
+            for row in iter_checkpoint(path):
+                row_id = str(row.get("id"))
+                digest = hashlib.blake2b(
+                    json.dumps(row, sort_keys=True, default=str).encode("utf-8"),
+                    digest_size=8,
+                ).digest()
+                if row_id in seen:
+                    if seen[row_id] == digest:
+                        duplicates += 1
+                    else:
+                        conflicts += 1
+                        logger.debug("Conflicting rows for id %s in %s", row_id, path)
+                    continue
+                seen[row_id] = digest
+                writer.writerow(row)
+
+    if duplicates:
+        logger.info("Skipped %d repeated rows", duplicates)
+    if conflicts:
+        logger.warning(
+            "Dropped %d rows whose id was already written with different "
+            "answers; key rows by post ID (--index-file) if file names repeat "
+            "across groups",
+            conflicts,
+        )
+    logger.info("Wrote %d rows to %s", len(seen), output_file)
+    return len(seen)
+
+
+def add_checkpoint_arguments(parser):
+    """Adds the checkpoint options to an argparse parser."""
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help=(
+            "JSONL file rows are appended to as they complete. "
+            "Defaults to the output path with a .jsonl suffix."
+        ),
+        type=Path,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip images whose id is already in the checkpoint.",
+    )
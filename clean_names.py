@@ -1,11 +1,20 @@
 """Convert `file names with spaces.ext` to `file_names_with_spaces.ext`"""
 
 import argparse
+import json
 import logging
+import os
 import re
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import NamedTuple
 
-logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+from index import read_index
+from index_store import IndexStore, is_store_file
+
+logger = logging.getLogger(__name__)
 
 
 def replace_space_like(text, replacement="_"):
@@ -13,40 +22,333 @@ def replace_space_like(text, replacement="_"):
     return re.sub(r"\s", replacement, text)
 
 
-def rename_spaces(directory):
-    """Renames files and directories in the specified directory (or the current directory if none is provided) and its subdirectories, replacing spaces with underscores."""
+class Rename(NamedTuple):
+    """A rename, with both paths relative to the cleaned directory."""
 
-    directory_path = Path(directory)
-    if not directory_path.exists():
-        logging.error("Directory '%s' not found.", directory_path)
-        return
+    source: str
+    target: str
+
+
+def list_tree(directory):
+    """
+    Lists the entry names of every directory under `directory`.
+
+    Only the directory listings are read, without a stat call per entry, and
+    symbolic links to directories are not followed.
+
+    Returns:
+        dict[str, list[str]]: The entry names of each directory, keyed by its
+        path relative to `directory` ("" for `directory` itself).
+    """
+    tree = {}
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        names = []
+        try:
+            with os.scandir(os.path.join(directory, relative_dir)) as entries:
+                for entry in entries:
+                    names.append(entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(os.path.join(relative_dir, entry.name))
+        except OSError as e:
+            logger.error("Could not list '%s': %s", relative_dir, e)
+        tree[relative_dir] = names
+    return tree
+
+
+class RenamePlan:
+    """
+    The renames that remove the whitespace from the names under a directory.
+
+    Renames are grouped by depth, deepest first, so every source path is the
+    path the entry has before any rename and renaming a directory never
+    invalidates a path still to be renamed. Within a level the renames are
+    independent and can run in parallel. Entries whose name has no
+    whitespace are left out, as are renames whose target already exists or
+    is the target of another rename in the same directory.
+
+    Args:
+        directory (str | Path): The directory to clean.
+        tree (dict[str, list[str]] | None): Its listing, see `list_tree`.
+    """
+
+    def __init__(self, directory, tree=None):
+        self.directory = Path(directory)
+        if tree is None:
+            tree = list_tree(self.directory)
+        self.entries = sum(len(names) for names in tree.values())
+        self.collisions = []
+        levels = {}
+        for relative_dir, names in tree.items():
+            targets = {name: replace_space_like(name) for name in names}
+            counts = Counter(targets.values())
+            existing = set(names)
+            for name, target in sorted(targets.items()):
+                if target == name:
+                    continue
+                source = os.path.join(relative_dir, name)
+                target = os.path.join(relative_dir, target)
+                if counts[targets[name]] > 1 or targets[name] in existing:
+                    self.collisions.append(Rename(source, target))
+                    continue
+                depth = source.count(os.sep)
+                levels.setdefault(depth, []).append(Rename(source, target))
+        self.levels = [levels[depth] for depth in sorted(levels, reverse=True)]
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def __iter__(self):
+        for level in self.levels:
+            yield from level
+
+
+def rename_paths(renames):
+    """
+    Returns a function mapping the paths under a directory to their renamed
+    paths, given the renames applied to it in order.
+    """
+    names = {}
+    translate = _translator(names)
+    for source, target in renames:
+        names[translate(source)] = os.path.basename(target)
+    return translate
+
+
+def _translator(names):
+    """Returns a function renaming each path component found in `names`."""
+
+    def translate(path):
+        parts = path.split(os.sep)
+        return os.sep.join(
+            names.get(os.sep.join(parts[: i + 1]), part) for i, part in enumerate(parts)
+        )
+
+    return translate
+
+
+def update_index_keys(index_file, translate):
+    """
+    Renames the files of a JSON or SQLite index, keeping their post IDs.
+
+    Keys are paths relative to the indexed directory, as `index.py` writes
+    them. A key whose new name is already in the index is left unchanged.
+
+    Returns:
+        int: The number of keys renamed.
+    """
+    index = read_index(index_file)
+    renames = []
+    for key in index:
+        new_key = translate(key)
+        if new_key == key:
+            continue
+        if new_key in index:
+            logger.warning("Not renaming '%s' in the index: '%s' exists", key, new_key)
+            continue
+        renames.append((key, new_key))
+    if not renames:
+        return 0
+
+    if is_store_file(index_file):
+        with IndexStore(index_file) as store:
+            return store.rename_files(renames)
+
+    new_keys = dict(renames)
+    index = OrderedDict((new_keys.get(key, key), value) for key, value in index.items())
+    index_file = Path(index_file)
+    tmp_file = index_file.with_name(index_file.name + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(index, f, indent=4)
+    os.replace(tmp_file, index_file)
+    return len(renames)
+
+
+def apply_plan(plan, journal_file=None, max_workers=None):
+    """
+    Applies a rename plan, one depth level at a time.
+
+    The renames of a level run on a thread pool. Each rename that succeeds is
+    written to `journal_file` as a JSON line, so `undo_renames` can revert
+    them even if the run is interrupted.
+
+    Returns:
+        list[Rename]: The renames applied, in order.
+    """
+
+    def rename(entry):
+        try:
+            os.rename(plan.directory / entry.source, plan.directory / entry.target)
+            logger.debug("Renamed '%s' to '%s'", entry.source, entry.target)
+            return entry
+        except OSError as e:
+            logger.error("Error renaming '%s': %s", entry.source, e)
+            return None
+
+    applied = []
+    with (
+        (
+            open(journal_file, "w") if journal_file is not None else nullcontext()
+        ) as journal,
+        ThreadPoolExecutor(max_workers=max_workers) as executor,
+    ):
+        for level in plan.levels:
+            for entry in executor.map(rename, level):
+                if entry is None:
+                    continue
+                applied.append(entry)
+                if journal is not None:
+                    journal.write(json.dumps(entry._asdict()) + "\n")
+            if journal is not None:
+                journal.flush()
+    return applied
+
+
+def read_journal(journal_file):
+    """Returns the renames recorded by `apply_plan`, in the order applied."""
+    with open(journal_file, "r") as f:
+        return [Rename(**json.loads(line)) for line in f if line.strip()]
 
-    for path in directory_path.rglob("*"):
-        new_name = replace_space_like(path.name)
-        new_path = path.with_name(new_name)
+
+def undo_renames(directory, journal_file, index_file=None):
+    """
+    Reverts the renames recorded in a journal, last first.
+
+    Args:
+        directory (str | Path): The directory the journal was written for.
+        journal_file (str | Path): The journal written by `apply_plan`.
+        index_file (str | Path | None): An index whose keys are renamed back.
+
+    Returns:
+        int: The number of renames reverted.
+    """
+    directory = Path(directory)
+    renames = read_journal(journal_file)
+    forward = rename_paths(renames)
+    names = {}
+    reverted = []
+    for entry in reversed(renames):
         try:
-            path.rename(new_path)
-            logging.debug("Renamed %s to '%s'", path, new_path)
+            os.rename(directory / entry.target, directory / entry.source)
         except OSError as e:
-            logging.error("Error renaming '%s': %s", path, e)
+            logger.error("Error restoring '%s': %s", entry.source, e)
+            continue
+        names[forward(entry.source)] = os.path.basename(entry.source)
+        reverted.append(entry)
+    logger.info("Reverted %d of %d renames", len(reverted), len(renames))
+    if index_file is not None:
+        renamed = update_index_keys(index_file, _translator(names))
+        logger.info("Renamed %d files in %s", renamed, index_file)
+    return len(reverted)
+
+
+def rename_spaces(
+    directory, dry_run=False, journal_file=None, index_file=None, max_workers=None
+):
+    """Renames files and directories in the specified directory (or the current directory if none is provided) and its subdirectories, replacing spaces with underscores.
+
+    The whole tree is listed and planned first, see `RenamePlan`, then
+    renamed bottom-up.
+
+    Args:
+        dry_run (bool): Log the plan without renaming anything.
+        journal_file (str | Path | None): Records the renames for `undo_renames`.
+        index_file (str | Path | None): A JSON or SQLite index of `directory`
+            whose keys are updated to the new paths.
+        max_workers (int | None): Threads renaming the entries of a level.
+
+    Returns:
+        RenamePlan | None: The plan, or None if `directory` does not exist.
+    """
+
+    directory_path = Path(directory)
+    if not directory_path.exists():
+        logger.error("Directory '%s' not found.", directory_path)
+        return None
+
+    plan = RenamePlan(directory_path)
+    for source, target in plan.collisions:
+        logger.warning("Not renaming '%s': '%s' would collide", source, target)
+    logger.info(
+        "Planned %d renames of %d entries (%d collisions skipped)",
+        len(plan),
+        plan.entries,
+        len(plan.collisions),
+    )
+    if dry_run:
+        for source, target in plan:
+            logger.info("Would rename '%s' to '%s'", source, target)
+        return plan
+
+    applied = apply_plan(plan, journal_file, max_workers)
+    logger.info("Renamed %d entries", len(applied))
+    if index_file is not None:
+        renamed = update_index_keys(index_file, rename_paths(applied))
+        logger.info("Renamed %d files in %s", renamed, index_file)
+    return plan
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
     epilog = """
     Example:
-    uv run clean_names.py mydirectory/
+    uv run clean_names.py mydirectory/ --dry-run
+    uv run clean_names.py mydirectory/ --journal renames.jsonl --index-file file_index.json
+    uv run clean_names.py mydirectory/ --undo renames.jsonl --index-file file_index.json
     """
     parser = argparse.ArgumentParser(
         description="Rename files and directories, replacing spaces with underscores.",
         epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument(
         "directory",
         help="Directory to process (default: current directory)",
     )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the planned renames without applying them.",
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="Record the renames in this JSON lines file, for --undo.",
+    )
+    parser.add_argument(
+        "--undo",
+        default=None,
+        help="Revert the renames recorded in this journal instead.",
+    )
+    parser.add_argument(
+        "--index-file",
+        default=None,
+        help=(
+            "JSON or SQLite index of the directory, written by index.py, "
+            "whose file names are updated in place."
+        ),
+    )
+    parser.add_argument(
+        "--max-workers",
+        default=None,
+        help="Threads renaming the entries at each depth.",
+        type=int,
+    )
     args = parser.parse_args()
+    if args.undo and (args.dry_run or args.journal):
+        parser.error("--undo cannot be combined with --dry-run or --journal")
 
-    rename_spaces(args.directory)
+    if args.undo:
+        undo_renames(args.directory, args.undo, args.index_file)
+        return
+    rename_spaces(
+        args.directory,
+        dry_run=args.dry_run,
+        journal_file=args.journal,
+        index_file=args.index_file,
+        max_workers=args.max_workers,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""
+Creating the Gemini client of a run: the real API, or an offline replay of it.
+
+Everything that sends requests only relies on this part of `genai.Client`:
+
+- `models.generate_content(model=..., contents=..., config=...)`
+- `aio.models.generate_content(...)`, the same call awaited
+- `caches.create/update/delete`, for `context_cache.PromptCache`
+
+so any object providing them can be passed where a client is expected.
+`fake_client.FakeClient` is one, and `RecordingClient` wraps another to save
+its responses for later replay.
+"""
+
+import logging
+from pathlib import Path
+from types import SimpleNamespace
+
+from google import genai
+
+from fake_client import FakeClient, ReplayResponder, image_key
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingClient:
+    """
+    Wraps a client and saves each response text to a fixture directory.
+
+    Responses are written to `<image_key>.txt`, the layout
+    `fake_client.ReplayResponder` reads.
+
+    Args:
+        client (genai.Client): The client whose responses are recorded.
+        fixture_dir (Path): Directory the responses are written to.
+    """
+
+    def __init__(self, client, fixture_dir):
+        self._client = client
+        self.fixture_dir = Path(fixture_dir)
+        self.fixture_dir.mkdir(parents=True, exist_ok=True)
+        self.models = SimpleNamespace(generate_content=self._generate)
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self._generate_async)
+        )
+        self.caches = client.caches
+
+    def _record(self, contents, response):
+        if response.text:
+            path = self.fixture_dir / f"{image_key(contents)}.txt"
+            path.write_text(response.text, encoding="utf-8")
+        return response
+
+    def _generate(self, model, contents, config=None):
+        response = self._client.models.generate_content(
+            model=model, contents=contents, config=config
+        )
+        return self._record(contents, response)
+
+    async def _generate_async(self, model, contents, config=None):
+        response = await self._client.aio.models.generate_content(
+            model=model, contents=contents, config=config
+        )
+        return self._record(contents, response)
+
+
+def add_client_arguments(parser):
+    """Adds the options of offline replay and recording to an argparse parser."""
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help=(
+            "Answer requests offline with the responses recorded in this "
+            "directory instead of calling the API."
+        ),
+        type=Path,
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Save each API response to this directory for --replay.",
+        type=Path,
+    )
+    parser.add_argument(
+        "--replay-latency",
+        default="0",
+        help=(
+            "Seconds each replayed request takes, or a distribution such as "
+            "uniform:0.5,2 or lognormal:1,0.5 (median, sigma). Defaults to 0."
+        ),
+    )
+    parser.add_argument(
+        "--replay-throttle-rate",
+        default=0.0,
+        help="Share of replayed requests that fail with a 429.",
+        type=float,
+    )
+    parser.add_argument(
+        "--replay-error-rate",
+        default=0.0,
+        help="Share of replayed requests that fail with a 503.",
+        type=float,
+    )
+    parser.add_argument(
+        "--replay-malformed-rate",
+        default=0.0,
+        help="Share of replayed responses that are damaged JSON.",
+        type=float,
+    )
+
+
+def client_from_args(args):
+    """
+    Creates the client configured on the command line.
+
+    Raises:
+        ValueError: If the replay options are invalid.
+    """
+    if args.replay is not None:
+        if args.record is not None:
+            raise ValueError("--replay and --record cannot be combined")
+        logger.info("Replaying the responses recorded in %s", args.replay)
+        return FakeClient(
+            respond=ReplayResponder(args.replay),
+            latency=args.replay_latency,
+            throttle_rate=args.replay_throttle_rate,
+            error_rate=args.replay_error_rate,
+            malformed_rate=args.replay_malformed_rate,
+        )
+    client = genai.Client(vertexai=True, project=args.project, location=args.location)
+    if args.record is not None:
+        logger.info("Recording responses to %s", args.record)
+        return RecordingClient(client, args.record)
+    return client
@@ -0,0 +1,168 @@
+"""Explicit context caching of the instructions and prompt shared by every request."""
+
+import logging
+import threading
+import time
+
+import httpx
+from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600
+# Refresh the cache when it has less than this many seconds left.
+REFRESH_MARGIN = 300
+# Errors of a cache call: refused by the API, or never answered.
+CACHE_ERRORS = (errors.APIError, httpx.HTTPError)
+
+
+class PromptCache:
+    """
+    Cached content holding the instructions and prompt for one run.
+
+    The cache is created on first use, its TTL is extended shortly before it
+    expires, and it is deleted by `close`. If the model or project does not
+    support caching, `get_name` returns None and requests carry the full
+    prompt as before. The class is safe to share between threads.
+
+    Args:
+        client (genai.Client): The Gemini API client.
+        model (str): The Gemini model identifier.
+        instructions (str): The instructions for the model.
+        prompt (str): The prompt for the model.
+        ttl (int): Lifetime of the cache in seconds.
+    """
+
+    def __init__(self, client, model, instructions, prompt, ttl=DEFAULT_TTL):
+        self.client = client
+        self.model = model
+        self.instructions = instructions
+        self.prompt = prompt
+        self.ttl = ttl
+        self.name = None
+        self.expires_at = 0.0
+        self.disabled = False
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        cached_content = self.client.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                contents=[
+                    types.Content(
+                        role="user",
+                        parts=[
+                            types.Part(text=self.instructions),
+                            types.Part(text=self.prompt),
+                        ],
+                    )
+                ],
+                ttl=f"{self.ttl}s",
+                display_name="cdl-wind-prompt",
+            ),
+        )
+        self.name = cached_content.name
+        self.expires_at = time.monotonic() + self.ttl
+        logger.info("Created context cache %s for model %s", self.name, self.model)
+
+    def _refresh(self):
+        try:
+            self.client.caches.update(
+                name=self.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"),
+            )
+            self.expires_at = time.monotonic() + self.ttl
+            logger.info("Extended context cache %s", self.name)
+        except CACHE_ERRORS as e:
+            logger.warning("Could not extend context cache %s: %s", self.name, e)
+            self._create()
+
+    def get_name(self):
+        """Returns the name of a live cached content, or None if caching is off."""
+        with self._lock:
+            if self.disabled:
+                return None
+            try:
+                if self.name is None:
+                    self._create()
+                elif self.expires_at - time.monotonic() < min(
+                    REFRESH_MARGIN, self.ttl / 4
+                ):
+                    self._refresh()
+            except CACHE_ERRORS as e:
+                logger.warning(
+                    "Context caching unavailable for %s, sending the full prompt: %s",
+                    self.model,
+                    e,
+                )
+                self.disabled = True
+                self.name = None
+            return self.name
+
+    def invalidate(self, name):
+        """
+        Forgets a cached content the API rejected, deleting it in case it
+        still exists so its storage is no longer billed.
+        """
+        with self._lock:
+            if self.name != name:
+                return
+            self.name = None
+        try:
+            self.client.caches.delete(name=name)
+        except CACHE_ERRORS as e:
+            logger.debug("Could not delete context cache %s: %s", name, e)
+
+    def record_usage(self, usage_metadata):
+        """Adds the token counts of one response to the savings report."""
+        if usage_metadata is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage_metadata.prompt_token_count or 0
+            self.cached_tokens += usage_metadata.cached_content_token_count or 0
+
+    def close(self):
+        """Deletes the cached content and logs the input tokens it served."""
+        with self._lock:
+            if self.name is not None:
+                try:
+                    self.client.caches.delete(name=self.name)
+                except CACHE_ERRORS as e:
+                    logger.warning(
+                        "Could not delete context cache %s: %s", self.name, e
+                    )
+                self.name = None
+        if self.prompt_tokens:
+            logger.info(
+                "Context cache served %d of %d input tokens (%.1f%%) over %d requests",
+                self.cached_tokens,
+                self.prompt_tokens,
+                100 * self.cached_tokens / self.prompt_tokens,
+                self.requests,
+            )
+
+
+def add_context_cache_arguments(parser):
+    """Adds the context caching options to an argparse parser."""
+    parser.add_argument(
+        "--no-context-cache",
+        action="store_true",
+        help="Send the instructions and prompt with every request.",
+    )
+    parser.add_argument(
+        "--context-cache-ttl",
+        default=DEFAULT_TTL,
+        help=f"Lifetime of the context cache in seconds. Defaults to {DEFAULT_TTL}.",
+        type=int,
+    )
+
+
+def prompt_cache_from_args(args, client, model, instructions, prompt):
+    """Creates the prompt cache configured on the command line, if enabled."""
+    if args.no_context_cache:
+        return None
+    return PromptCache(client, model, instructions, prompt, ttl=args.context_cache_ttl)
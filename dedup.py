@@ -0,0 +1,381 @@
+"""Finding re-screenshots of the same post so that each is analyzed only once."""
+
+import argparse
+import csv
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import batched
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from images import load_image
+from index import iter_image_files
+from preprocess import IMAGE_ERRORS, trim_borders
+
+logger = logging.getLogger(__name__)
+
+# Side of the downsampled image the DCT of pHash runs on, and of the
+# low-frequency block kept from it: 8 x 8 = 64 bits per hash.
+PHASH_SIDE = 32
+HASH_SIDE = 8
+
+# Largest pHash Hamming distance between two screenshots of the same post.
+# dHash must agree within DHASH_SLACK more bits to confirm a match.
+DEFAULT_THRESHOLD = 8
+DHASH_SLACK = 4
+
+# Images hashed by a worker process per task.
+CHUNK_SIZE = 64
+
+
+def _dct_matrix(n):
+    """Returns the orthonormal DCT-II matrix of size n."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT = _dct_matrix(PHASH_SIDE)
+
+
+def _pack(bits):
+    """Packs an (n, 64) boolean array into n 64-bit integers."""
+    return [int.from_bytes(row) for row in np.packbits(bits, axis=1)]
+
+
+def phash_batch(pixels):
+    """
+    Computes the pHash of a stack of grayscale images.
+
+    Args:
+        pixels (np.ndarray): Array of shape (n, PHASH_SIDE, PHASH_SIDE).
+
+    Returns:
+        list[int]: The 64-bit hash of each image.
+    """
+    coefficients = DCT @ pixels @ DCT.T
+    low = coefficients[:, :HASH_SIDE, :HASH_SIDE].reshape(len(pixels), -1)
+    # The DC term only reflects overall brightness; leave it out of the median.
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack(low > median)
+
+
+def dhash_batch(pixels):
+    """
+    Computes the dHash of a stack of grayscale images.
+
+    Args:
+        pixels (np.ndarray): Array of shape (n, HASH_SIDE, HASH_SIDE + 1).
+
+    Returns:
+        list[int]: The 64-bit hash of each image.
+    """
+    bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    return _pack(bits.reshape(len(pixels), -1))
+
+
+def hash_pixels(image_path):
+    """Loads an image and returns its downsampled pixels for both hashes."""
+    image = load_image(image_path)
+    if image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image[0])) as img:
+            img = trim_borders(img.convert("L"))
+        return (
+            np.asarray(img.resize((PHASH_SIDE, PHASH_SIDE), Image.Resampling.BOX)),
+            np.asarray(img.resize((HASH_SIDE + 1, HASH_SIDE), Image.Resampling.BOX)),
+        )
+    except IMAGE_ERRORS as e:
+        logger.warning("Could not hash %s: %s", image_path, e)
+        return None
+
+
+def hash_images(image_paths):
+    """
+    Computes the (pHash, dHash) of each image, or None if it cannot be read.
+
+    Runs in a worker process on a chunk of images, so that the hashes of the
+    whole chunk are computed with a few array operations.
+    """
+    pixels = [hash_pixels(image_path) for image_path in image_paths]
+    loaded = [p for p in pixels if p is not None]
+    if not loaded:
+        return [None] * len(pixels)
+    phashes = phash_batch(np.stack([p for p, _ in loaded]).astype(np.float64))
+    dhashes = dhash_batch(np.stack([d for _, d in loaded]).astype(np.int16))
+    hashes = iter(zip(phashes, dhashes))
+    return [None if p is None else next(hashes) for p in pixels]
+
+
+def compute_hashes(image_paths, max_workers=None):
+    """
+    Hashes images on a process pool.
+
+    Returns:
+        list[tuple[int, int] | None]: The (pHash, dHash) of each image, in order.
+    """
+    image_paths = list(image_paths)
+    chunks = [list(chunk) for chunk in batched(image_paths, CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        return hash_images(image_paths)
+    # Spawned for the same reason as the preprocessing pool.
+    with ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        return [h for hashes in executor.map(hash_images, chunks) for h in hashes]
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of 64-bit hashes under the Hamming distance.
+
+    A lookup within distance d only descends into the children whose edge
+    distance is within d of the query's distance to the node, so it visits a
+    small part of the tree for the small thresholds used here.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """Adds `item` under the hash `value`."""
+        self.size += 1
+        node = (value, item, {})
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, max_distance):
+        """
+        Returns the (distance, item) pairs within `max_distance` of `value`,
+        nearest first.
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.append((distance, item))
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(found, key=lambda pair: pair[0])
+
+    def __len__(self):
+        return self.size
+
+
+def find_duplicates(work_items, threshold=DEFAULT_THRESHOLD, max_workers=None):
+    """
+    Groups work items whose screenshots are near-duplicates.
+
+    Items are visited in order and the first of each cluster is its canonical
+    image: a later item joins the nearest canonical whose pHash is within
+    `threshold` bits and whose dHash is within `threshold + DHASH_SLACK`.
+    Items that cannot be hashed are kept as their own canonical image.
+
+    Args:
+        work_items (Iterable[Path | tuple[str, Path]]): The images, as paths
+            keyed by their file name or (image_id, image_path) pairs.
+        threshold (int): Largest pHash Hamming distance of a duplicate.
+        max_workers (int | None): Hashing processes. Defaults to the CPU count.
+
+    Returns:
+        tuple[list, dict]: The canonical work items, and the duplicates of each
+        canonical image id as (image_id, image_path, distance) triples.
+    """
+    work_items = [
+        item if isinstance(item, tuple) else (Path(item).name, item)
+        for item in work_items
+    ]
+    hashes = compute_hashes((path for _, path in work_items), max_workers)
+
+    tree = BKTree()
+    canonical, duplicates = [], {}
+    for (image_id, image_path), image_hash in zip(work_items, hashes):
+        if image_hash is not None:
+            phash, dhash = image_hash
+            for distance, (canonical_id, canonical_dhash) in tree.search(
+                phash, threshold
+            ):
+                if hamming(dhash, canonical_dhash) <= threshold + DHASH_SLACK:
+                    duplicates[canonical_id].append((image_id, image_path, distance))
+                    break
+            else:
+                tree.add(phash, (image_id, dhash))
+                duplicates[image_id] = []
+                canonical.append((image_id, image_path))
+        else:
+            canonical.append((image_id, image_path))
+
+    duplicates = {key: value for key, value in duplicates.items() if value}
+    logger.info(
+        "Found %d near-duplicate images in %d clusters; analyzing %d of %d images",
+        sum(map(len, duplicates.values())),
+        len(duplicates),
+        len(canonical),
+        len(work_items),
+    )
+    return canonical, duplicates
+
+
+def write_cluster_report(report_file, canonical, duplicates):
+    """
+    Writes one CSV row per image of each cluster of near-duplicates.
+
+    The canonical image comes first with distance 0, followed by its
+    duplicates and their pHash distance to it.
+    """
+    with open(report_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["cluster", "id", "canonical_id", "distance", "path"])
+        for image_id, image_path in canonical:
+            if image_id not in duplicates:
+                continue
+            writer.writerow([image_id, image_id, image_id, 0, image_path])
+            for duplicate_id, duplicate_path, distance in duplicates[image_id]:
+                writer.writerow(
+                    [image_id, duplicate_id, image_id, distance, duplicate_path]
+                )
+    logger.info("Wrote the near-duplicate clusters to %s", report_file)
+
+
+def copy_to_duplicates(on_result, duplicates):
+    """
+    Wraps a result callback so that duplicates reuse their canonical's result.
+
+    Each row of a canonical image is passed on, followed by a copy for each
+    of its duplicates with their own id and a "duplicate_of" column.
+    """
+
+    def write(result):
+        on_result(result)
+        for duplicate_id, _, _ in duplicates.get(result["id"], ()):
+            on_result({**result, "id": duplicate_id, "duplicate_of": result["id"]})
+
+    return write
+
+
+@dataclass(frozen=True)
+class DedupOptions:
+    """
+    How near-duplicate screenshots are found.
+
+    Args:
+        threshold (int): Largest pHash Hamming distance of a duplicate.
+        report_file (Path | None): CSV file the clusters are written to.
+        max_workers (int | None): Hashing processes.
+    """
+
+    threshold: int = DEFAULT_THRESHOLD
+    report_file: Path | None = None
+    max_workers: int | None = None
+
+
+def dedup_work_items(work_items, on_result, options):
+    """
+    Drops near-duplicates from a work list before it is analyzed.
+
+    Returns:
+        tuple: The canonical work items, and a result callback that also
+        writes the rows of their duplicates.
+    """
+    canonical, duplicates = find_duplicates(
+        work_items, options.threshold, options.max_workers
+    )
+    if options.report_file is not None:
+        write_cluster_report(options.report_file, canonical, duplicates)
+    return canonical, copy_to_duplicates(on_result, duplicates)
+
+
+def add_dedup_arguments(parser):
+    """Adds the near-duplicate detection options to an argparse parser."""
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help=(
+            "Analyze only one screenshot of each cluster of near-duplicates and "
+            "copy its answers to the others."
+        ),
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        default=DEFAULT_THRESHOLD,
+        help=(
+            "Largest perceptual hash distance, in bits out of 64, between "
+            f"near-duplicates. Defaults to {DEFAULT_THRESHOLD}."
+        ),
+        type=int,
+    )
+    parser.add_argument(
+        "--dedup-report",
+        default=None,
+        help="Write the near-duplicate clusters to this CSV file.",
+        type=Path,
+    )
+
+
+def dedup_options_from_args(args):
+    """Returns the near-duplicate detection configured on the command line, if enabled."""
+    if not args.dedup:
+        return None
+    return DedupOptions(threshold=args.dedup_threshold, report_file=args.dedup_report)
+
+
+def main():
+    epilog = """Example:
+    uv run dedup.py --image-folder assets --report clusters.csv
+    """
+    parser = argparse.ArgumentParser(
+        description="Report clusters of near-duplicate screenshots.", epilog=epilog
+    )
+    parser.add_argument(
+        "--image-folder",
+        default="assets",
+        help="Path to the folder containing images.",
+        type=Path,
+    )
+    parser.add_argument(
+        "--report", help="The CSV file to write.", required=True, type=Path
+    )
+    parser.add_argument(
+        "--threshold",
+        default=DEFAULT_THRESHOLD,
+        help=f"Largest pHash distance of near-duplicates. Defaults to {DEFAULT_THRESHOLD}.",
+        type=int,
+    )
+    args = parser.parse_args()
+
+    image_files = sorted(iter_image_files(args.image_folder))
+    work_items = [(f.relative_to(args.image_folder).as_posix(), f) for f in image_files]
+    canonical, duplicates = find_duplicates(work_items, args.threshold)
+    write_cluster_report(args.report, canonical, duplicates)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    main()
@@ -0,0 +1,337 @@
+"""Engines that run `analyze_image` over many images concurrently."""
+
+import asyncio
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import batched, islice
+from pathlib import Path
+
+from tqdm import tqdm
+
+from analyzer import (
+    analyze_image,
+    analyze_image_async,
+    analyze_images,
+    analyze_images_async,
+)
+from scheduler import RequestScheduler
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("threads", "async", "pipeline")
+
+# Marks the end of the result stream of the async engine.
+_DONE = object()
+
+
+def split_work_item(item):
+    """
+    Returns the (image_id, image_path) of a work item.
+
+    Items are either paths, keyed by their file name, or (image_id, path)
+    pairs such as those of `worklist.iter_work_items`.
+    """
+    if isinstance(item, tuple):
+        return item
+    return Path(item).name, item
+
+
+def _log_batch_error(batch, error):
+    """Logs a multi-image request that failed; its images are not analyzed."""
+    image_ids = ", ".join(str(image_id) for image_id, _ in batch)
+    logger.error("Error processing images %s: %s", image_ids, error)
+
+
+def run_serial(
+    client,
+    model,
+    image_files,
+    instructions,
+    prompt,
+    on_result,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    metrics=None,
+    cascade=None,
+):
+    """
+    Analyzes images one at a time, as `main.py` does.
+
+    Returns:
+        tuple[int, int]: The number of images analyzed and the number submitted.
+    """
+    analyzed = submitted = 0
+    for image_id, image_path in tqdm(
+        map(split_work_item, image_files), desc="Processing images"
+    ):
+        submitted += 1
+        result = analyze_image(
+            client,
+            model,
+            image_path,
+            instructions,
+            prompt,
+            cache=cache,
+            image_id=image_id,
+            scheduler=scheduler,
+            prompt_cache=prompt_cache,
+            preprocessor=preprocessor,
+            response_schema=response_schema,
+            metrics=metrics,
+            cascade=cascade,
+        )
+        if result:
+            on_result(result)
+            analyzed += 1
+    return analyzed, submitted
+
+
+def run_threaded(
+    client,
+    model,
+    image_files,
+    instructions,
+    prompt,
+    on_result,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    images_per_request=1,
+    metrics=None,
+    window=None,
+    cascade=None,
+):
+    """
+    Analyzes images on a thread pool sized by the scheduler.
+
+    Work items are pulled from `image_files` as requests complete, keeping at
+    most `window` requests submitted at once, so the work list can be a lazy
+    generator of any length and the first results arrive right away.
+
+    Args:
+        image_files (Iterable[Path | tuple[str, Path]]): The images to analyze,
+            see `split_work_item`.
+        on_result (callable): Called with each result row as it completes.
+        images_per_request (int): Images sent together in one request, see
+            `analyzer.analyze_images`.
+        metrics (RunMetrics | None): Collects per-request timings and tokens.
+        window (int | None): Requests submitted at once. Defaults to twice the
+            scheduler's concurrency ceiling, so no thread waits for work.
+        cascade (ModelCascade | None): Models tried in turn for each image
+            instead of `model`. Only used with one image per request.
+
+    Returns:
+        tuple[int, int]: The number of images analyzed and the number submitted.
+    """
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    max_workers = scheduler.concurrency.max_workers
+    window = window or 2 * max_workers
+    options = {
+        "cache": cache,
+        "scheduler": scheduler,
+        "prompt_cache": prompt_cache,
+        "preprocessor": preprocessor,
+        "response_schema": response_schema,
+        "metrics": metrics,
+    }
+
+    def analyze(batch):
+        if images_per_request > 1:
+            try:
+                return analyze_images(
+                    client, model, batch, instructions, prompt, **options
+                )
+            # Like analyze_image for one image, a failed batch must not end
+            # the run, whatever the error.
+            except Exception as e:  # noqa: BLE001
+                _log_batch_error(batch, e)
+                return []
+        ((image_id, image_path),) = batch
+        result = analyze_image(
+            client,
+            model,
+            image_path,
+            instructions,
+            prompt,
+            image_id=image_id,
+            cascade=cascade,
+            **options,
+        )
+        return [result] if result else []
+
+    batches = batched(map(split_work_item, image_files), images_per_request)
+    analyzed = submitted = 0
+
+    # The scheduler bounds concurrent requests; threads beyond its current
+    # limit wait for a slot.
+    with (
+        ThreadPoolExecutor(max_workers=max_workers) as executor,
+        tqdm(desc="Processing images") as progress,
+    ):
+        futures = {}
+
+        def submit(count):
+            nonlocal submitted
+            for batch in islice(batches, count):
+                futures[executor.submit(analyze, batch)] = len(batch)
+                submitted += len(batch)
+
+        submit(window)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                results = future.result()
+                for result in results:
+                    on_result(result)
+                analyzed += len(results)
+                progress.update(futures.pop(future))
+            submit(len(done))
+
+    return analyzed, submitted
+
+
+async def analyze_stream(
+    client,
+    model,
+    image_files,
+    instructions,
+    prompt,
+    on_result,
+    max_concurrency=32,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    images_per_request=1,
+    metrics=None,
+    cascade=None,
+):
+    """
+    Analyzes a lazily produced stream of images with `client.aio`.
+
+    A producer pulls paths from `image_files` only when one of the
+    `max_concurrency` slots is free, so neither the work list nor pending
+    requests are ever held in memory in full. A single consumer hands result
+    rows to `on_result` as they arrive. With `images_per_request` above one,
+    each slot sends that many images in one request. Within the slots, the
+    scheduler holds the requests in flight to its adaptive limit, which
+    drops when the service throttles.
+
+    Returns:
+        tuple[int, int]: The number of images analyzed and the number submitted.
+    """
+    semaphore = asyncio.BoundedSemaphore(max_concurrency)
+    results = asyncio.Queue(maxsize=max_concurrency)
+    submitted = 0
+
+    options = {
+        "cache": cache,
+        "scheduler": scheduler,
+        "prompt_cache": prompt_cache,
+        "preprocessor": preprocessor,
+        "response_schema": response_schema,
+        "metrics": metrics,
+    }
+
+    async def analyze(batch):
+        try:
+            if images_per_request > 1:
+                try:
+                    rows = await analyze_images_async(
+                        client, model, batch, instructions, prompt, **options
+                    )
+                # As in run_threaded, a failed batch must not end the run.
+                except Exception as e:  # noqa: BLE001
+                    _log_batch_error(batch, e)
+                    rows = []
+            else:
+                ((image_id, image_path),) = batch
+                result = await analyze_image_async(
+                    client,
+                    model,
+                    image_path,
+                    instructions,
+                    prompt,
+                    image_id=image_id,
+                    cascade=cascade,
+                    **options,
+                )
+                rows = [result] if result else []
+            await results.put((len(batch), rows))
+        finally:
+            semaphore.release()
+
+    async def produce():
+        nonlocal submitted
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                work_items = map(split_work_item, image_files)
+                for batch in batched(work_items, images_per_request):
+                    await semaphore.acquire()
+                    tasks.create_task(analyze(batch))
+                    submitted += len(batch)
+        finally:
+            await results.put(_DONE)
+
+    async def consume():
+        analyzed = 0
+        with tqdm(desc="Processing images") as progress:
+            while (item := await results.get()) is not _DONE:
+                images, rows = item
+                progress.update(images)
+                for result in rows:
+                    on_result(result)
+                analyzed += len(rows)
+        return analyzed
+
+    producer = asyncio.create_task(produce())
+    analyzed = await consume()
+    await producer
+    return analyzed, submitted
+
+
+def run_async(
+    client,
+    model,
+    image_files,
+    instructions,
+    prompt,
+    on_result,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    images_per_request=1,
+    metrics=None,
+    cascade=None,
+):
+    """Runs `analyze_stream` to completion, bounded by the scheduler's ceiling."""
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    return asyncio.run(
+        analyze_stream(
+            client,
+            model,
+            image_files,
+            instructions,
+            prompt,
+            on_result,
+            max_concurrency=scheduler.concurrency.max_workers,
+            cache=cache,
+            scheduler=scheduler,
+            prompt_cache=prompt_cache,
+            preprocessor=preprocessor,
+            response_schema=response_schema,
+            images_per_request=images_per_request,
+            metrics=metrics,
+            cascade=cascade,
+        )
+    )
@@ -0,0 +1,384 @@
+"""A local stand-in for `genai.Client` used to exercise the analyzers offline."""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+from google.genai import errors
+
+from parser import strip_code_fence
+
+
+def image_labels(contents):
+    """Returns the image labels of a multi-image request, in order."""
+    return [
+        part.text.removeprefix("Image ID: ")
+        for content in contents
+        for part in getattr(content, "parts", None) or ()
+        if getattr(part, "text", None) and part.text.startswith("Image ID: ")
+    ]
+
+
+def default_response(contents):
+    """
+    Returns a well-formed answer for any request.
+
+    Multi-image requests get an array with one answer per labeled image.
+    """
+    labels = image_labels(contents)
+    if labels:
+        return json.dumps(
+            [{"Image ID": label, "1": "Yes", "2": "No"} for label in labels]
+        )
+    return json.dumps({"Image ID": "image", "1": "Yes", "2": "No"})
+
+
+def throttle_error(retry_after=None):
+    """Builds the error the API raises when a quota is exhausted."""
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    return errors.ClientError(
+        429,
+        {
+            "error": {
+                "code": 429,
+                "message": "Resource exhausted. Please try again later.",
+                "status": "RESOURCE_EXHAUSTED",
+            }
+        },
+        httpx.Response(429, headers=headers),
+    )
+
+
+def server_error():
+    """Builds the error the API raises when it is briefly unavailable."""
+    return errors.ServerError(
+        503,
+        {
+            "error": {
+                "code": 503,
+                "message": "The service is currently unavailable.",
+                "status": "UNAVAILABLE",
+            }
+        },
+    )
+
+
+LATENCY_DISTRIBUTIONS = ("uniform", "normal", "lognormal")
+
+
+def parse_latency(spec):
+    """
+    Parses a latency such as "0.5", "uniform:0.2,1.5", "normal:0.8,0.2" or
+    "lognormal:0.8,0.5" (median and sigma).
+
+    Returns:
+        float | callable: Seconds, or a function drawing them from a
+        `random.Random`.
+    """
+    name, _, params = str(spec).partition(":")
+    if not params:
+        return float(name)
+    a, b = (float(p) for p in params.split(","))
+    if name == "uniform":
+        return lambda rng: rng.uniform(a, b)
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(a, b))
+    if name == "lognormal":
+        mu = math.log(a)
+        return lambda rng: rng.lognormvariate(mu, b)
+    raise ValueError(
+        f"Unknown latency distribution {name!r}; use one of {LATENCY_DISTRIBUTIONS}"
+    )
+
+
+def malform(text, rng):
+    """
+    Damages a JSON response the way models sometimes do: prose around a code
+    block, a trailing comma, single quotes, or output cut off mid-object.
+    """
+    kind = rng.randrange(4)
+    if kind == 0:
+        return f"Here are the answers:\n```json\n{text}\n```\nLet me know!"
+    if kind == 1:
+        end = text.rfind("}")
+        return text[:end] + ",}" + text[end + 1 :] if end > 0 else text
+    if kind == 2:
+        return text.replace('"', "'")
+    return text[: max(1, len(text) * 2 // 3)]
+
+
+def image_key(contents):
+    """Returns a key derived from the image bytes of a request."""
+    digest = hashlib.blake2b(digest_size=16)
+    for content in contents:
+        for part in getattr(content, "parts", None) or ():
+            blob = getattr(part, "inline_data", None)
+            if blob is not None and blob.data:
+                digest.update(blob.data)
+    return digest.hexdigest()
+
+
+class ReplayResponder:
+    """
+    Answers requests with response texts recorded in a fixture directory.
+
+    Each `*.txt` file holds one response, named after the `image_key` of the
+    request it answered, as written by `clients.RecordingClient`. A request
+    whose images were recorded gets that response back. Multi-image requests
+    whose images were recorded one at a time get an array of their answers.
+    Any other request gets a recorded response picked by its image key, so
+    synthetic corpora can be replayed too and the same image always gets the
+    same answer.
+
+    Args:
+        fixture_dir (Path): Directory of recorded responses.
+    """
+
+    def __init__(self, fixture_dir):
+        self.responses = {
+            path.stem: path.read_text(encoding="utf-8")
+            for path in sorted(Path(fixture_dir).glob("*.txt"))
+        }
+        if not self.responses:
+            raise ValueError(f"No recorded responses in {fixture_dir}")
+        self._texts = list(self.responses.values())
+
+    def lookup(self, key):
+        """Returns the response recorded for `key`, or a stand-in for it."""
+        if key in self.responses:
+            return self.responses[key]
+        return self._texts[int(key, 16) % len(self._texts)]
+
+    def __call__(self, contents):
+        key = image_key(contents)
+        if key in self.responses or not image_labels(contents):
+            return self.lookup(key)
+        # One recorded answer per image, by position in the request.
+        answers = [
+            strip_code_fence(self.lookup(image_key([SimpleNamespace(parts=[part])])))
+            for content in contents
+            for part in content.parts
+            if getattr(part, "inline_data", None) is not None
+        ]
+        return "[" + ",".join(answers) + "]"
+
+
+class FakeModels:
+    """Implements `client.models.generate_content` with injectable throttling."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        return self._client._generate(model, contents, config)
+
+
+class FakeAsyncModels:
+    """Implements `client.aio.models.generate_content`."""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model, contents, config=None):
+        client = self._client
+        client._check_cached_content(config)
+        error = client._start_call()
+        if error is not None:
+            raise error
+        try:
+            if delay := client._delay():
+                await asyncio.sleep(delay)
+            return client._response(contents)
+        finally:
+            client._end_call()
+
+
+class FakeCaches:
+    """Implements the `client.caches` calls used by `PromptCache`."""
+
+    def __init__(self, supported=True):
+        self.supported = supported
+        self.contents = {}
+        self.created = 0
+
+    def create(self, model, config):
+        if not self.supported:
+            raise errors.ClientError(
+                400,
+                {"error": {"code": 400, "message": "Caching is not supported."}},
+            )
+        self.created += 1
+        name = f"cachedContents/{self.created}"
+        self.contents[name] = config.contents
+        return SimpleNamespace(name=name)
+
+    def update(self, name, config):
+        return SimpleNamespace(name=name)
+
+    def delete(self, name):
+        self.contents.pop(name, None)
+
+
+class FakeClient:
+    """
+    Offline replacement for `genai.Client`.
+
+    Args:
+        respond (callable): Maps the request contents to the response text,
+            e.g. a `ReplayResponder`.
+        latency (float | str | callable): Seconds each call takes, a
+            distribution spec for `parse_latency`, or a function drawing them
+            from a `random.Random`.
+        throttle_rate (float): Probability that a call fails with a 429.
+        error_rate (float): Probability that a call fails with a 503.
+        malformed_rate (float): Probability that a response is damaged by
+            `malform`.
+        max_concurrency (int | None): Calls beyond this many in flight fail
+            with a 429, like a quota shared by all workers.
+        retry_after (float | None): Value of the Retry-After header on 429s.
+        seed (int | None): Seed of the random latencies, errors and damage.
+        caching (bool): Whether `client.caches.create` succeeds.
+        usage_metadata (object | None): Token counts attached to each response.
+    """
+
+    def __init__(
+        self,
+        respond=default_response,
+        latency=0.0,
+        throttle_rate=0.0,
+        error_rate=0.0,
+        malformed_rate=0.0,
+        max_concurrency=None,
+        retry_after=None,
+        seed=None,
+        caching=True,
+        usage_metadata=None,
+    ):
+        self.respond = respond
+        self.latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.usage_metadata = usage_metadata
+        self.calls = 0
+        self.throttled = 0
+        self.errors = 0
+        self.malformed = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.models = FakeModels(self)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(self))
+        self.caches = FakeCaches(supported=caching)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _start_call(self):
+        """Counts a call and returns the error it fails with, if any."""
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            throttled = self._random.random() < self.throttle_rate or (
+                self.max_concurrency is not None
+                and self.in_flight > self.max_concurrency
+            )
+            if throttled:
+                self.throttled += 1
+                self.in_flight -= 1
+                return throttle_error(self.retry_after)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                self.in_flight -= 1
+                return server_error()
+            return None
+
+    def _delay(self):
+        if callable(self.latency):
+            with self._lock:
+                return self.latency(self._random)
+        return self.latency
+
+    def _end_call(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _check_cached_content(self, config):
+        name = getattr(config, "cached_content", None)
+        if name is not None and name not in self.caches.contents:
+            raise errors.ClientError(
+                404,
+                {"error": {"code": 404, "message": f"{name} not found."}},
+            )
+
+    def _response(self, contents):
+        text = self.respond(contents)
+        if self.malformed_rate:
+            with self._lock:
+                if self._random.random() < self.malformed_rate:
+                    self.malformed += 1
+                    text = malform(text, self._random)
+        return SimpleNamespace(text=text, usage_metadata=self.usage_metadata)
+
+    def _generate(self, model, contents, config):
+        self._check_cached_content(config)
+        error = self._start_call()
+        if error is not None:
+            raise error
+        try:
+            if delay := self._delay():
+                time.sleep(delay)
+            return self._response(contents)
+        finally:
+            self._end_call()
+
+
+class FakeBatchBackend:
+    """
+    Offline replacement for `batch.VertexBatchBackend`.
+
+    Jobs finish after `polls_until_done` status checks, and each output line
+    echoes its request like Vertex batch prediction does.
+    """
+
+    def __init__(self, respond=default_response, polls_until_done=1):
+        self.respond = respond
+        self.polls_until_done = polls_until_done
+        self.jobs = {}
+
+    def submit(self, model, requests_file):
+        job_name = f"batchPredictionJobs/{len(self.jobs) + 1}"
+        with open(requests_file, "r", encoding="utf-8") as f:
+            self.jobs[job_name] = {
+                "lines": [json.loads(line) for line in f],
+                "polls": 0,
+            }
+        return job_name
+
+    def poll(self, job_name):
+        job = self.jobs[job_name]
+        job["polls"] += 1
+        if job["polls"] < self.polls_until_done:
+            return "JOB_STATE_RUNNING"
+        return "JOB_STATE_SUCCEEDED"
+
+    def results(self, job_name):
+        for line in self.jobs[job_name]["lines"]:
+            text = self.respond(line["request"]["contents"])
+            yield {
+                "status": "",
+                "request": line["request"],
+                "response": {
+                    "candidates": [
+                        {"content": {"role": "model", "parts": [{"text": text}]}}
+                    ]
+                },
+            }
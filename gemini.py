@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from enum import StrEnum
 
 
@@ -36,3 +37,52 @@ class GeminiModel(StrEnum):
     EMBEDDING_EXP = "gemini-embedding-exp"
     # --- Other Models ---
     AQA = "models/aqa"
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """List prices of a model in USD per million tokens."""
+
+    input: float
+    output: float
+    cached_input: float
+
+
+# Approximate list prices for prompts up to 128k/200k tokens, as of mid 2025.
+# Thinking tokens are billed as output. Experimental models are not listed.
+MODEL_PRICES = {
+    GeminiModel.PRO_2_5_PREVIEW: ModelPrice(1.25, 10.00, 0.31),
+    GeminiModel.PRO_2_5_FLASH_PREVIEW: ModelPrice(0.15, 0.60, 0.0375),
+    GeminiModel.FLASH_2_0: ModelPrice(0.10, 0.40, 0.025),
+    GeminiModel.FLASH_2_0_STABLE: ModelPrice(0.10, 0.40, 0.025),
+    GeminiModel.FLASH_LITE_2_0: ModelPrice(0.075, 0.30, 0.01875),
+    GeminiModel.FLASH_LITE_2_0_STABLE: ModelPrice(0.075, 0.30, 0.01875),
+    GeminiModel.PRO_1_5: ModelPrice(1.25, 5.00, 0.3125),
+    GeminiModel.PRO_1_5_LATEST: ModelPrice(1.25, 5.00, 0.3125),
+    GeminiModel.PRO_1_5_002: ModelPrice(1.25, 5.00, 0.3125),
+    GeminiModel.FLASH_1_5: ModelPrice(0.075, 0.30, 0.01875),
+    GeminiModel.FLASH_1_5_LATEST: ModelPrice(0.075, 0.30, 0.01875),
+    GeminiModel.FLASH_1_5_002: ModelPrice(0.075, 0.30, 0.01875),
+    GeminiModel.FLASH_1_5_8B: ModelPrice(0.0375, 0.15, 0.01),
+    GeminiModel.FLASH_1_5_8B_LATEST: ModelPrice(0.0375, 0.15, 0.01),
+    GeminiModel.FLASH_1_5_8B_001: ModelPrice(0.0375, 0.15, 0.01),
+}
+
+
+def estimate_cost(model, prompt_tokens, output_tokens, cached_tokens=0):
+    """
+    Estimates the cost of a model's token usage in USD.
+
+    Cached tokens are the part of `prompt_tokens` served from a context cache.
+
+    Returns:
+        float | None: The cost, or None if the model's prices are unknown.
+    """
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    return (
+        (prompt_tokens - cached_tokens) * price.input
+        + cached_tokens * price.cached_input
+        + output_tokens * price.output
+    ) / 1e6
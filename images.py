@@ -0,0 +1,67 @@
+"""Load screenshots as raw bytes ready to be sent to the Gemini API."""
+
+import io
+import logging
+from pathlib import Path
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# File signatures of the image formats the API accepts as inline data.
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+
+# Formats PIL can read but that must be converted before being sent.
+FALLBACK_FORMAT = "PNG"
+FALLBACK_MIME_TYPE = "image/png"
+
+
+def sniff_mime_type(header: bytes) -> str | None:
+    """Returns the MIME type of an image from its first bytes, if supported."""
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def convert_image(data: bytes) -> bytes:
+    """Decodes an image with PIL and re-encodes it in a format the API accepts."""
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode not in ("1", "L", "LA", "I", "P", "RGB", "RGBA"):
+            img = img.convert("RGBA")
+        buffered = io.BytesIO()
+        img.save(buffered, format=FALLBACK_FORMAT)
+        return buffered.getvalue()
+
+
+def load_image(image_path: Path) -> tuple[bytes, str] | None:
+    """
+    Loads an image and returns its bytes together with their MIME type.
+
+    PNG, JPEG and WebP files are returned exactly as stored on disk; only the
+    header is read to validate the file and detect its type. Any other format
+    PIL can open is converted to PNG.
+
+    Args:
+        image_path (Path): Path of the image to load.
+
+    Returns:
+        tuple[bytes, str] | None: The image bytes and MIME type, or None if the
+        file is not a readable image.
+    """
+    try:
+        data = Path(image_path).read_bytes()
+        mime_type = sniff_mime_type(data[:12])
+        if mime_type is not None:
+            return data, mime_type
+
+        logger.debug("Converting %s to %s", image_path, FALLBACK_FORMAT)
+        return convert_image(data), FALLBACK_MIME_TYPE
+    except Exception:
+        logger.exception("Error loading image %s", image_path)
+        return None
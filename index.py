@@ -1,15 +1,15 @@
 import argparse
+import bisect
 import json
 import logging
+import os
 from collections import OrderedDict, defaultdict
 from pathlib import Path
 from pprint import pformat
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+from index_store import STORE_SUFFIXES, IndexStore, format_post_id, is_store_file
+from scan import default_manifest_path, scan_directory
+
 logger = logging.getLogger(__name__)
 
 image_file_extensions = (
@@ -45,6 +45,48 @@ def infer_group_code_from_path(
     return group_mapping.get(parent_dir, "MISC")
 
 
+def parse_post_id(post_id: str) -> tuple[str, int] | None:
+    """Splits a post ID such as "NEOW-0012" into its group code and number."""
+    try:
+        group_code, number = post_id.split("-")[:2]
+        return group_code, int(number)
+    except ValueError:
+        logger.warning(f"Invalid post ID format: {post_id}")
+        return None
+
+
+def parse_post_id_range(spec: str) -> tuple[str, str]:
+    """Splits a range such as "NEOW-0100..NEOW-0200" into its two post IDs."""
+    start, separator, stop = spec.partition("..")
+    if not separator:
+        raise ValueError(f"Expected a range like NEOW-0100..NEOW-0200, got {spec!r}")
+    return start.strip(), stop.strip()
+
+
+def get_group_counters(index) -> defaultdict:
+    """Returns the highest post number of each group code in a single pass."""
+    numbers = defaultdict(list)
+    for post_id in index.values():
+        group_code, _, number = post_id.partition("-")
+        numbers[group_code].append(number.partition("-")[0])
+
+    counters = defaultdict(int)
+    for group_code, group_numbers in numbers.items():
+        try:
+            counters[group_code] = max(map(int, group_numbers))
+        except ValueError:
+            # Fall back to parsing one ID at a time to skip the invalid ones.
+            parsed = [
+                parse_post_id(post_id)
+                for post_id in index.values()
+                if post_id.partition("-")[0] == group_code
+            ]
+            valid = [number for _, number in filter(None, parsed)]
+            if valid:
+                counters[group_code] = max(valid)
+    return counters
+
+
 def get_next_post_id(group_code, index):
     """Computes the next available post ID for a group based on the existing index."""
     max_id = 0
@@ -58,25 +100,42 @@ def get_next_post_id(group_code, index):
     return max_id + 1
 
 
+def load_mapping(mapping: None | dict | str | Path = None) -> dict:
+    """Returns the group mapping, reading it from a JSON file if given a path."""
+    if mapping is None:
+        return group_mapping
+    if isinstance(mapping, dict):
+        return mapping
+    with open(mapping, "r") as f:
+        return json.load(f)
+
+
 def assign_post_id(
     filename: str | Path,
     index: OrderedDict,
-    mapping: None | dict = group_mapping,
+    mapping: None | dict | str | Path = group_mapping,
+    counters: dict | None = None,
 ):
-    if mapping is None:
-        mapping = group_mapping
-    else:
-        with open(mapping, "r") as f:
-            mapping = json.load(f)
+    """
+    Allocates the next post ID of the group `filename` belongs to.
 
+    With `counters` (as built by `get_group_counters`) the allocation takes
+    constant time and the counter of the group is advanced; without it the
+    whole index is scanned.
+    """
     try:
+        mapping = load_mapping(mapping)
         group_code = infer_group_code_from_path(filename, mapping)
         if not group_code:
             logger.warning(f"Could not infer group code from path: {filename}")
             return None
 
-        next_id = get_next_post_id(group_code, index)
-        post_id = f"{group_code}-{next_id:04d}"
+        if counters is None:
+            next_id = get_next_post_id(group_code, index)
+        else:
+            next_id = counters[group_code] + 1
+            counters[group_code] = next_id
+        post_id = format_post_id(group_code, next_id)
 
         return post_id
 
@@ -85,88 +144,306 @@ def assign_post_id(
         return None
 
 
+def has_image_extension(filename: str | Path) -> bool:
+    return os.path.splitext(filename)[1].lower() in image_file_extensions
+
+
 def is_image_file(file_path):
-    return all([file_path.is_file(), file_path.suffix.lower() in image_file_extensions])
+    return all([file_path.is_file(), has_image_extension(file_path)])
+
+
+def iter_image_files(directory):
+    """
+    Lazily yields the image files under `directory`.
+
+    Applies the same test as `is_image_file`, but takes the file type from
+    the directory listing instead of a stat call per file. Directories are
+    listed one at a time, so only one is held open and in memory at once.
+    """
+    pending = [Path(directory)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(Path(entry.path))
+                elif entry.is_file() and has_image_extension(entry.name):
+                    yield Path(entry.path)
+
+
+def write_index(index_file: str | Path, index: dict, new_entries: dict):
+    """
+    Saves `index` to `index_file`, writing only `new_entries` when possible.
+
+    The entries are spliced in before the closing brace of the existing file,
+    which leaves it byte-for-byte what `json.dump(index, f, indent=4)` writes.
+    """
+    index_file = Path(index_file)
+    if len(index) == len(new_entries) or not index_file.exists():
+        with open(index_file, "w") as f:
+            json.dump(index, f, indent=4)
+        return
+    if not new_entries:
+        return
+
+    with open(index_file, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+        body = tail.rstrip()
+        if not body.endswith(b"}"):
+            raise ValueError(f"{index_file} does not end with a JSON object")
+        body = body[:-1].rstrip()
+        lines = ",\n".join(
+            f"    {json.dumps(key)}: {json.dumps(value)}"
+            for key, value in new_entries.items()
+        )
+        f.seek(size - len(tail) + len(body))
+        f.write(f",\n{lines}\n}}".encode())
+        f.truncate()
 
 
 def process_directory(
-    directory: str | Path, index_file: str | Path, mapping: Path | None
+    directory: str | Path,
+    index_file: str | Path,
+    mapping: Path | None = None,
+    manifest_file: str | Path | None = None,
+    full_scan: bool = False,
 ):
-    directory_path = Path(directory)
-    index_file_path = Path(index_file)
-
-    if index_file_path.exists():
-        with open(index_file_path, "r") as f:
-            index = OrderedDict(json.load(f))  # Load as OrderedDict
-    else:
-        index = OrderedDict()
-
-    for file_path in sorted(directory_path.rglob("*")):
-        if is_image_file(file_path):
-            logger.info("Processing file: %s", file_path)
-            original_filename = str(file_path.relative_to(directory_path))
-            if original_filename not in index:  # Only process new files
-                post_id = assign_post_id(original_filename, index, mapping)
-                if post_id:
-                    index[original_filename] = post_id
-
-    with open(index_file, "w") as f:
-        json.dump(index, f, indent=4)
+    Index.process_directory(directory, index_file, mapping, manifest_file, full_scan)
     logger.info(f"Index saved to {index_file}")
 
 
 class Index(OrderedDict):
-    def __init__(self, directory, index_file):
+    """
+    Mapping of file names to post IDs, loaded from `index_file`.
+
+    The highest post number of each group is tracked in `counters`, so
+    allocating the ID of a new file with `add` takes constant time. An
+    `index_file` ending in .sqlite3 (or .sqlite/.db) is an `IndexStore`,
+    which several indexers can update at once; otherwise it is JSON.
+    """
+
+    def __init__(
+        self, directory, index_file, mapping=None, manifest_file=None, full_scan=False
+    ):
+        self.index_file = Path(index_file)
+        self.mapping = load_mapping(mapping)
+        self.counters = None
+        # Lookup structures, built on first use and then kept up to date.
+        self._reset_lookups()
         # Load or create the index
-        index = self.process_directory(directory=directory, index_file=index_file)
+        index, counters = self._update(
+            directory, index_file, self.mapping, manifest_file, full_scan
+        )
         super().__init__(index)
+        self.counters = counters
+
+    def __setitem__(self, filename, post_id):
+        if self._filenames is not None and filename in self:
+            self._unlink(filename, self[filename])
+        super().__setitem__(filename, post_id)
+        if self._filenames is not None:
+            self._link(filename, post_id)
+        if self.counters is not None:
+            parsed = parse_post_id(post_id)
+            if parsed and parsed[1] > self.counters[parsed[0]]:
+                self.counters[parsed[0]] = parsed[1]
+
+    def __delitem__(self, filename):
+        if self._filenames is not None and filename in self:
+            self._unlink(filename, self[filename])
+        super().__delitem__(filename)
+
+    def _reset_lookups(self):
+        self._filenames = self._groups = self._by_group = None
+
+    def pop(self, *args):
+        self._reset_lookups()
+        return super().pop(*args)
+
+    def popitem(self, last=True):
+        self._reset_lookups()
+        return super().popitem(last)
+
+    def clear(self):
+        self._reset_lookups()
+        super().clear()
+
+    def _build_lookups(self):
+        self._filenames = {}
+        self._groups = defaultdict(lambda: ([], []))
+        self._by_group = defaultdict(dict)
+        for filename, post_id in self.items():
+            self._link(filename, post_id)
+
+    def _link(self, filename, post_id):
+        self._filenames[post_id] = filename
+        group_code, _, number = post_id.partition("-")
+        if not number.isdigit():
+            return
+        self._by_group[group_code][number] = filename
+        numbers, post_ids = self._groups[group_code]
+        position = bisect.bisect_right(numbers, int(number))
+        numbers.insert(position, int(number))
+        post_ids.insert(position, post_id)
+
+    def _unlink(self, filename, post_id):
+        if self._filenames.get(post_id) == filename:
+            del self._filenames[post_id]
+        group_code, _, number = post_id.partition("-")
+        if not number.isdigit():
+            return
+        self._by_group[group_code].pop(number, None)
+        numbers, post_ids = self._groups[group_code]
+        position = post_ids.index(post_id, bisect.bisect_left(numbers, int(number)))
+        del numbers[position], post_ids[position]
+
+    def get_filename(self, post_id: str) -> str | None:
+        """Returns the file with a given post ID, or None if there is none."""
+        if self._filenames is None:
+            self._build_lookups()
+        return self._filenames.get(post_id)
+
+    def post_id_range(self, start: str, stop: str) -> list[tuple[str, str]]:
+        """
+        Returns the (post_id, filename) pairs from `start` to `stop` inclusive.
+
+        Both ends must belong to the same group, e.g. "NEOW-0100" and
+        "NEOW-0200". Pairs are ordered by post number.
+        """
+        start_group, start_number = parse_post_id(start) or (None, None)
+        stop_group, stop_number = parse_post_id(stop) or (None, None)
+        if start_group is None or start_group != stop_group:
+            raise ValueError(f"Invalid post ID range {start}..{stop}")
+        if self._groups is None:
+            self._build_lookups()
+        if start_group not in self._groups:
+            return []
+        numbers, post_ids = self._groups[start_group]
+        low = bisect.bisect_left(numbers, start_number)
+        high = bisect.bisect_right(numbers, stop_number)
+        return [(post_id, self._filenames[post_id]) for post_id in post_ids[low:high]]
+
+    def add(self, filename: str | Path):
+        """
+        Assigns the next post ID of its group to `filename` and returns it.
+
+        An SQLite index records the new entry at once. A JSON index is only
+        changed in memory; `write_index` saves it.
+        """
+        filename = str(filename)
+        if filename in self:
+            return self[filename]
+        if is_store_file(self.index_file):
+            group_code = infer_group_code_from_path(filename, self.mapping)
+            with IndexStore(self.index_file) as store:
+                post_id = store.allocate([(filename, group_code)])[filename]
+                self.counters.update(store.counters())
+        else:
+            post_id = assign_post_id(filename, self, self.mapping, self.counters)
+        if post_id:
+            self[filename] = post_id
+        return post_id
 
     @staticmethod
     def process_directory(
         directory: str | Path = "assets",
         index_file: str | Path = "file_index.json",
         mapping=None,
+        manifest_file: str | Path | None = None,
+        full_scan: bool = False,
     ):
+        """
+        Adds the images under `directory` that are not yet in `index_file`.
+
+        Directories left unchanged since the last run are skipped using the
+        scan manifest (by default next to `index_file`), and only the new
+        entries are written.
+        """
+        index, _ = Index._update(
+            directory, index_file, mapping, manifest_file, full_scan
+        )
+        return index
+
+    @staticmethod
+    def _update(directory, index_file, mapping, manifest_file, full_scan):
         directory_path = Path(directory)
         index_file_path = Path(index_file)
+        if manifest_file is None:
+            manifest_file = default_manifest_path(index_file_path)
+        mapping = load_mapping(mapping)
+        if is_store_file(index_file_path):
+            return Index._update_store(
+                directory_path, index_file_path, mapping, manifest_file, full_scan
+            )
 
         if index_file_path.exists():
             with open(index_file_path, "r") as f:
                 index = OrderedDict(json.load(f))
         else:
             index = OrderedDict()
+        counters = get_group_counters(index)
+
+        files = scan_directory(
+            directory_path, has_image_extension, manifest_file, full=full_scan
+        )
+        new_entries = OrderedDict()
+        # Sorted as Path objects so IDs follow the order of a sorted rglob.
+        for original_filename in sorted((f for f in files if f not in index), key=Path):
+            logger.debug("Processing file: %s", original_filename)
+            post_id = assign_post_id(original_filename, index, mapping, counters)
+            if post_id:
+                index[original_filename] = post_id
+                new_entries[original_filename] = post_id
+
+        write_index(index_file_path, index, new_entries)
+        return index, counters
 
-        for file_path in sorted(directory_path.rglob("*")):
-            process_file_condition = all(
-                [file_path.is_file(), file_path.suffix.lower() in image_file_extensions]
+    @staticmethod
+    def _update_store(directory, index_file, mapping, manifest_file, full_scan):
+        with IndexStore(index_file) as store:
+            index = OrderedDict(store.items())
+            files = scan_directory(
+                directory, has_image_extension, manifest_file, full=full_scan
             )
-            if process_file_condition:
-                logger.debug("Processing file: %s", file_path)
-                original_filename = str(file_path.relative_to(directory_path))
-                if original_filename not in index:
-                    filename, post_id = assign_post_id(
-                        original_filename, index, mapping
-                    )
-                    if filename and post_id:
-                        index[original_filename] = post_id
-
-        with open(index_file_path, "w") as f:
-            json.dump(index, f, indent=4)
-        return index
+            new_files = sorted((f for f in files if f not in index), key=Path)
+            # Files another indexer added meanwhile keep the ID it allocated.
+            index.update(
+                store.allocate(
+                    (f, infer_group_code_from_path(f, mapping)) for f in new_files
+                )
+            )
+            counters = defaultdict(int, store.counters())
+        return index, counters
 
     def __str__(self):
         return pformat(self)
 
     @property
     def by_group(self):
-        result = defaultdict(dict)
-        for key, value in self.items():
-            prefix, number = value.split("-")
-            result[prefix][number] = key
-        return result
+        """Filenames by group code and post number, e.g. ["NEOW"]["0012"]."""
+        if self._by_group is None:
+            self._build_lookups()
+        return self._by_group
+
+
+def read_index(index_file: str | Path) -> OrderedDict:
+    """Loads a JSON or SQLite index without scanning its directory."""
+    if not Path(index_file).exists():
+        raise FileNotFoundError(f"Index file {index_file} does not exist")
+    if is_store_file(index_file):
+        with IndexStore(index_file) as store:
+            return OrderedDict(store.items())
+    with open(index_file, "r") as f:
+        return OrderedDict(json.load(f))
 
 
 def main():
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
     epilog = """Example:
     uv run index.py -d mydir -m mymapping.json -i mynewindex.json
     """
@@ -191,9 +468,50 @@ def main():
         default="file_index.json",
         help="The name of the file to store the index. Defaults to 'file_index.json'.",
     )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help=(
+            "Scan manifest used to skip unchanged directories. Defaults to "
+            "the index file name with a .manifest.json suffix."
+        ),
+    )
+    parser.add_argument(
+        "--full-scan",
+        action="store_true",
+        help="List every directory again and rebuild the scan manifest.",
+    )
+    parser.add_argument(
+        "--import-json",
+        default=None,
+        help="Import an existing JSON index into an SQLite --index-file first.",
+    )
+    parser.add_argument(
+        "--export-json",
+        default=None,
+        help="Write an SQLite --index-file to this path in the JSON format.",
+    )
     args = parser.parse_args()
-
-    process_directory(args.directory, args.index_file, args.mapping)
+    if (args.import_json or args.export_json) and not is_store_file(args.index_file):
+        parser.error(
+            "--import-json and --export-json need an --index-file ending in "
+            + ", ".join(STORE_SUFFIXES)
+        )
+
+    if args.import_json:
+        with IndexStore(args.index_file) as store:
+            store.import_json(args.import_json)
+
+    process_directory(
+        args.directory,
+        args.index_file,
+        args.mapping,
+        manifest_file=args.manifest,
+        full_scan=args.full_scan,
+    )
+    if args.export_json:
+        with IndexStore(args.index_file) as store:
+            store.export_json(args.export_json)
     logger.info("Finished processing files.")
 
 
@@ -0,0 +1,223 @@
+"""SQLite storage for the file index with atomic post ID allocation."""
+
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STORE_SUFFIXES = (".sqlite3", ".sqlite", ".db")
+
+# How long a writer waits for another process's transaction, in seconds.
+BUSY_TIMEOUT = 60
+
+
+def is_store_file(path):
+    """Returns True if `path` names an SQLite index rather than a JSON one."""
+    return Path(path).suffix.lower() in STORE_SUFFIXES
+
+
+def format_post_id(group_code, number):
+    return f"{group_code}-{number:04d}"
+
+
+def _split_post_id(post_id):
+    group_code, _, rest = post_id.partition("-")
+    number = rest.partition("-")[0]
+    return group_code, int(number) if number.isdigit() else None
+
+
+class IndexStore:
+    """
+    File index kept in an SQLite database in WAL mode.
+
+    Each allocation runs in an immediate transaction that bumps the group's
+    counter and records the file, so several indexers can share one store
+    without handing out the same post ID twice. Readers never block writers.
+
+    Args:
+        path (str | Path): The database file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, timeout=BUSY_TIMEOUT, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS posts (
+                filename TEXT PRIMARY KEY,
+                post_id TEXT NOT NULL UNIQUE,
+                group_code TEXT NOT NULL,
+                number INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                group_code TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def __contains__(self, filename):
+        return self.get_post_id(filename) is not None
+
+    def get_post_id(self, filename):
+        """Returns the post ID of a file, or None if it is not indexed."""
+        row = self._connection.execute(
+            "SELECT post_id FROM posts WHERE filename = ?", (str(filename),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_filename(self, post_id):
+        """Returns the file with a given post ID, or None if there is none."""
+        row = self._connection.execute(
+            "SELECT filename FROM posts WHERE post_id = ?", (post_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def items(self):
+        """Returns the (filename, post_id) pairs in the order they were added."""
+        return self._connection.execute(
+            "SELECT filename, post_id FROM posts ORDER BY rowid"
+        ).fetchall()
+
+    def counters(self):
+        """Returns the last post number allocated in each group."""
+        return dict(self._connection.execute("SELECT group_code, value FROM counters"))
+
+    def allocate(self, files):
+        """
+        Assigns the next post ID of its group to each file, in order.
+
+        Files that are already indexed, possibly by another process since the
+        caller last read the store, keep their post ID.
+
+        Args:
+            files (Iterable[tuple[str, str]]): The filename and group code of
+                each file.
+
+        Returns:
+            OrderedDict[str, str]: The post ID of each file.
+        """
+        allocated = OrderedDict()
+        with self._transaction() as connection:
+            for filename, group_code in files:
+                filename = str(filename)
+                row = connection.execute(
+                    "SELECT post_id FROM posts WHERE filename = ?", (filename,)
+                ).fetchone()
+                if row:
+                    allocated[filename] = row[0]
+                    continue
+                (number,) = connection.execute(
+                    """
+                    INSERT INTO counters (group_code, value) VALUES (?, 1)
+                    ON CONFLICT (group_code) DO UPDATE SET value = value + 1
+                    RETURNING value
+                    """,
+                    (group_code,),
+                ).fetchone()
+                post_id = format_post_id(group_code, number)
+                connection.execute(
+                    "INSERT INTO posts VALUES (?, ?, ?, ?)",
+                    (filename, post_id, group_code, number),
+                )
+                allocated[filename] = post_id
+        return allocated
+
+    def import_entries(self, entries):
+        """
+        Adds existing (filename, post_id) pairs, keeping their post IDs.
+
+        Counters are raised to the highest imported number of each group, so
+        later allocations continue where the imported index left off.
+
+        Returns:
+            int: The number of entries added.
+        """
+        with self._transaction() as connection:
+            before = self._connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO posts VALUES (?, ?, ?, ?)",
+                (
+                    (str(filename), post_id, *_split_post_id(post_id))
+                    for filename, post_id in entries
+                ),
+            )
+            added = self._connection.total_changes - before
+            connection.execute(
+                """
+                INSERT INTO counters (group_code, value)
+                SELECT group_code, MAX(number) FROM posts
+                WHERE number IS NOT NULL GROUP BY group_code
+                ON CONFLICT (group_code) DO UPDATE
+                SET value = MAX(value, excluded.value)
+                """
+            )
+        return added
+
+    def rename_files(self, renames):
+        """
+        Changes the filename of indexed files, keeping their post IDs.
+
+        A file whose new name is already indexed keeps its old name.
+
+        Args:
+            renames (Iterable[tuple[str, str]]): The old and new filename of
+                each file.
+
+        Returns:
+            int: The number of files renamed.
+        """
+        with self._transaction() as connection:
+            before = self._connection.total_changes
+            connection.executemany(
+                "UPDATE OR IGNORE posts SET filename = ? WHERE filename = ?",
+                ((str(new), str(old)) for old, new in renames),
+            )
+            renamed = self._connection.total_changes - before
+        return renamed
+
+    def import_json(self, index_file):
+        """Imports a `file_index.json` written by `index.py`."""
+        with open(index_file, "r") as f:
+            added = self.import_entries(json.load(f).items())
+        logger.info("Imported %d entries from %s", added, index_file)
+        return added
+
+    def export_json(self, index_file):
+        """Writes the index in the `file_index.json` format."""
+        index = OrderedDict(self.items())
+        with open(index_file, "w") as f:
+            json.dump(index, f, indent=4)
+        logger.info("Exported %d entries to %s", len(index), index_file)
+        return len(index)
+
+    @contextmanager
+    def _transaction(self):
+        """Runs an immediate transaction, which takes the write lock up front."""
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,17 +1,37 @@
 from pathlib import Path
 import argparse
-import base64
-import io
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-from PIL import Image
-from tqdm import tqdm
-from google import genai
-from google.genai import types
 
+from cache import add_cache_arguments, cache_from_args
+from cascade import add_cascade_arguments, cascade_from_args
+from checkpoint import (
+    CheckpointWriter,
+    add_checkpoint_arguments,
+    compile_checkpoint,
+    default_checkpoint_path,
+    read_done_ids,
+)
+from clients import add_client_arguments, client_from_args
+from context_cache import add_context_cache_arguments, prompt_cache_from_args
+from dedup import add_dedup_arguments, dedup_options_from_args, dedup_work_items
+from engines import ENGINES, run_async, run_threaded
 from gemini import GeminiModel
-from parser import process_response, convert_dicts_to_dataframe
+from metrics import add_metrics_arguments, metrics_from_args
+from parser import parse_stats
+from pipeline import add_pipeline_arguments, run_pipeline, stage_workers_from_args
+from preprocess import add_preprocess_arguments, preprocessor_from_args
+from schema import add_schema_arguments, response_schema_from_args
+from scheduler import (
+    RequestScheduler,
+    add_scheduler_arguments,
+    scheduler_from_args,
+)
+from worklist import (
+    add_work_list_arguments,
+    iter_image_work_items,
+    iter_work_items,
+    shard_path,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -24,75 +44,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def create_gemini_content(instructions, prompt, encoded_image):
-    """
-    Creates the content structure for the Gemini API request.
-
-    Args:
-        instructions (str): The instructions for the model.
-        prompt (str): The prompt for the model.
-        encoded_image (str): The base64 encoded image string.
-
-    Returns:
-        list: A list of types.Content objects ready for the Gemini API.
-    """
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part(text=instructions),
-                types.Part(text=prompt),
-                types.Part(
-                    inline_data=types.Blob(
-                        mime_type="image/png", data=base64.b64decode(encoded_image)
-                    )
-                ),
-            ],
-        )
-    ]
-    return contents
-
-
-SAFETY_SETTINGS = [
-    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
-    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
-    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
-    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
-]
-
-
-def create_generate_content_config(
-    temperature=0, top_p=0.95, max_output_tokens=8192, response_modalities=["TEXT"]
-):
-    """
-    Creates and returns a GenerateContentConfig object with predefined settings.
-
-    Returns:
-        types.GenerateContentConfig: A configured GenerateContentConfig object.
-    """
-    generate_content_config = types.GenerateContentConfig(
-        temperature=temperature,
-        top_p=top_p,
-        max_output_tokens=max_output_tokens,
-        response_modalities=response_modalities,
-        safety_settings=SAFETY_SETTINGS,
-    )
-    return generate_content_config
-
-
-def load_image(image_path: Path) -> str | None:
-    """Loads an image and returns it as a base64 encoded string."""
-    try:
-        with Image.open(image_path) as img:
-            buffered = io.BytesIO()
-            img.save(buffered, format=img.format)
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            return img_str
-    except Exception as _:
-        logger.error(f"Error loading image {image_path}", exc_info=True)
-        return None
-
-
 def load_text_file(file_path: Path) -> str | None:
     """Loads the content of a text file."""
     try:
@@ -103,71 +54,135 @@ def load_text_file(file_path: Path) -> str | None:
         return None
 
 
-def analyze_image(client, model, image_path, instructions, prompt):
-    """Analyzes a single image and returns the result."""
-    logger.info("Processing image %s", image_path)
-    encoded_image = load_image(image_path)
-    if encoded_image is None:
-        return None
-
-    contents = create_gemini_content(instructions, prompt, encoded_image)
-
-    generate_content_config = create_generate_content_config()
-
-    try:
-        response = client.models.generate_content(
-            model=model, contents=contents, config=generate_content_config
+def generate_analysis(
+    client,
+    model,
+    image_folder,
+    instructions,
+    prompt,
+    output_file,
+    cache=None,
+    scheduler=None,
+    engine="threads",
+    checkpoint_file=None,
+    resume=False,
+    prompt_cache=None,
+    preprocessor=None,
+    index_file=None,
+    groups=None,
+    post_ids=None,
+    shard=None,
+    response_schema=None,
+    images_per_request=1,
+    dedup=None,
+    metrics=None,
+    stage_workers=None,
+    cascade=None,
+):
+    """
+    Generates analysis for images in a folder using threading, asyncio or the
+    staged pipeline of `pipeline.run_pipeline`.
+
+    With an `index_file`, the images listed in the index (optionally only
+    some `groups` or a `post_ids` range) are analyzed and keyed by post ID.
+    With a `shard` (i, N), only that shard is analyzed into its own
+    checkpoint and the CSV is left to merge.py. With `dedup` options, only
+    one image of each cluster of near-duplicates is sent. `stage_workers`
+    sets the worker counts of the pipeline engine. With a `cascade`, each
+    image goes to its models in turn instead of `model`.
+    """
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    if checkpoint_file is None:
+        checkpoint_file = shard_path(default_checkpoint_path(output_file), shard)
+    done = read_done_ids(checkpoint_file) if resume else set()
+    if done:
+        logger.info("Resuming: %d images already in %s", len(done), checkpoint_file)
+
+    if index_file is not None:
+        image_files = iter_work_items(
+            index_file, image_folder, groups, post_ids, done, shard=shard
+        )
+    else:
+        image_files = (
+            f for f in iter_image_work_items(image_folder, shard) if f.name not in done
         )
 
-        # Process the response
-        response_text = response.text
-        _result = process_response(response_text, image_path.name)
-        if _result:
-            _result["id"] = image_path.name
-            # TODO: remove this with better prompt
-            if "Image ID" in _result:
-                del _result["Image ID"]
-            return _result
+    with CheckpointWriter(checkpoint_file, resume=resume) as writer:
+        on_result = writer.write
+        if dedup is not None:
+            image_files, on_result = dedup_work_items(image_files, on_result, dedup)
+        if engine == "async":
+            analyzed, total = run_async(
+                client,
+                model,
+                image_files,
+                instructions,
+                prompt,
+                on_result,
+                cache=cache,
+                scheduler=scheduler,
+                prompt_cache=prompt_cache,
+                preprocessor=preprocessor,
+                response_schema=response_schema,
+                images_per_request=images_per_request,
+                metrics=metrics,
+                cascade=cascade,
+            )
+        elif engine == "pipeline":
+            analyzed, total = run_pipeline(
+                client,
+                model,
+                image_files,
+                instructions,
+                prompt,
+                on_result,
+                cache=cache,
+                scheduler=scheduler,
+                prompt_cache=prompt_cache,
+                preprocessor=preprocessor,
+                response_schema=response_schema,
+                metrics=metrics,
+                workers=stage_workers,
+            )
         else:
-            logger.error("Error loading image %s", image_path.name, exc_info=True)
-            return None
-
-    except Exception as e:
-        logger.error("Error processing image %s: %s", image_path.name, e)
-        return None
-
-
-def generate_analysis(client, model, image_folder, instructions, prompt, output_file):
-    """Generates analysis for images in a folder using threading."""
-    image_files = [f for f in image_folder.rglob("*") if f.is_file()]
-    results = []
-
-    with ThreadPoolExecutor(max_workers=4) as executor:  # Adjust max_workers as needed
-        futures = [
-            executor.submit(
-                analyze_image, client, model, image_path, instructions, prompt
+            analyzed, total = run_threaded(
+                client,
+                model,
+                image_files,
+                instructions,
+                prompt,
+                on_result,
+                cache=cache,
+                scheduler=scheduler,
+                prompt_cache=prompt_cache,
+                preprocessor=preprocessor,
+                response_schema=response_schema,
+                images_per_request=images_per_request,
+                metrics=metrics,
+                cascade=cascade,
             )
-            for image_path in image_files
-        ]
-
-        for future in tqdm(
-            as_completed(futures), total=len(futures), desc="Processing images"
-        ):
-            result = future.result()
-            if result:
-                results.append(result)
-
-    results_df = convert_dicts_to_dataframe(results)
-
-    # Move id column to leftmost position
-    if "id" in results_df.columns:
-        id_col = results_df.pop("id")
-        results_df.insert(0, "id", id_col)
-
-    # keep unique rows
-    results_df = results_df.drop_duplicates(subset=["id"])
 
-    results_df.to_csv(output_file, index=False)
+    if analyzed < total:
+        logger.warning("%d of %d images could not be analyzed", total - analyzed, total)
+    logger.info(
+        "Finished with %d retries, %d throttled responses, concurrency limit %d",
+        scheduler.retries,
+        scheduler.throttles,
+        int(scheduler.concurrency.limit),
+    )
+    logger.info("Responses parsed by tier: %s", parse_stats.report())
+    if cascade is not None:
+        cascade.log_report()
+
+    if shard is not None:
+        logger.info(
+            "Shard %d/%d written to %s; combine the shards with merge.py",
+            *shard,
+            checkpoint_file,
+        )
+    elif output_file is not None:
+        compile_checkpoint(checkpoint_file, output_file)
 
 
 def main():
@@ -208,18 +223,105 @@ def main():
         ),
     )
     parser.add_argument("--output", help="Ouput file path", type=Path)
+    add_cache_arguments(parser)
+    add_cascade_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_client_arguments(parser)
+    add_context_cache_arguments(parser)
+    add_dedup_arguments(parser)
+    add_metrics_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_preprocess_arguments(parser)
+    add_schema_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_work_list_arguments(parser)
+    parser.add_argument(
+        "--engine",
+        default="threads",
+        choices=ENGINES,
+        help=(
+            "Run requests on a thread pool, on the asyncio client, or in a "
+            "pipeline that loads and parses on process pools. Defaults to 'threads'."
+        ),
+    )
+    parser.add_argument(
+        "--images-per-request",
+        default=1,
+        help=(
+            "Send this many labeled images in each request and parse the JSON "
+            "array of answers. Batches with missing answers are split and "
+            "retried. Defaults to 1."
+        ),
+        type=int,
+    )
 
     args = parser.parse_args()
+    if args.images_per_request < 1:
+        parser.error("--images-per-request must be at least 1")
+    if args.engine == "pipeline" and args.images_per_request > 1:
+        parser.error("--engine pipeline sends one image per request")
+    if args.cascade and (args.engine == "pipeline" or args.images_per_request > 1):
+        parser.error(
+            "--cascade needs --engine threads or async with one image per request"
+        )
 
-    client = genai.Client(vertexai=True, project=args.project, location=args.location)
+    try:
+        client = client_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
     model = args.model
     instructions = load_text_file(args.instructions_file)
     prompt = load_text_file(args.prompt_file)
+    response_schema = cascade = None
+    if prompt:
+        try:
+            cascade = cascade_from_args(args, prompt)
+            response_schema, prompt = response_schema_from_args(args, prompt)
+        except ValueError as e:
+            parser.error(str(e))
+    if cascade is not None:
+        # The context cache, if any, serves the first tier, which sees every image.
+        model = cascade.models[0]
 
     if instructions and prompt:
-        generate_analysis(
-            client, model, args.image_folder, instructions, prompt, args.output
-        )
+        cache = cache_from_args(args)
+        prompt_cache = prompt_cache_from_args(args, client, model, instructions, prompt)
+        preprocessor = preprocessor_from_args(args)
+        metrics = metrics_from_args(args)
+        try:
+            generate_analysis(
+                client,
+                model,
+                args.image_folder,
+                instructions,
+                prompt,
+                args.output,
+                cache=cache,
+                scheduler=scheduler_from_args(args),
+                engine=args.engine,
+                checkpoint_file=args.checkpoint,
+                resume=args.resume,
+                prompt_cache=prompt_cache,
+                preprocessor=preprocessor,
+                index_file=args.index_file,
+                groups=args.groups,
+                post_ids=args.post_ids,
+                shard=args.shard,
+                response_schema=response_schema,
+                images_per_request=args.images_per_request,
+                dedup=dedup_options_from_args(args),
+                metrics=metrics,
+                stage_workers=stage_workers_from_args(args),
+                cascade=cascade,
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+            if prompt_cache is not None:
+                prompt_cache.close()
+            if preprocessor is not None:
+                preprocessor.close()
+            metrics.close()
     else:
         logger.error("Error: Could not load instructions or prompt.")
 
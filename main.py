@@ -1,16 +1,32 @@
 from pathlib import Path
 import argparse
-import base64
-import io
 import logging
 
-from PIL import Image
-from tqdm import tqdm
-from google import genai
-from google.genai import types
-
+from batch import VertexBatchBackend, run_batch
+from cache import add_cache_arguments, cache_from_args
+from cascade import add_cascade_arguments, cascade_from_args
+from checkpoint import (
+    CheckpointWriter,
+    add_checkpoint_arguments,
+    compile_checkpoint,
+    default_checkpoint_path,
+    read_done_ids,
+)
+from clients import add_client_arguments, client_from_args
+from context_cache import add_context_cache_arguments, prompt_cache_from_args
+from dedup import add_dedup_arguments, dedup_options_from_args, dedup_work_items
+from engines import run_serial
 from gemini import GeminiModel
-from parser import process_response, convert_dicts_to_dataframe
+from metrics import add_metrics_arguments, metrics_from_args
+from parser import parse_stats
+from preprocess import add_preprocess_arguments, preprocessor_from_args
+from schema import add_schema_arguments, response_schema_from_args
+from worklist import (
+    add_work_list_arguments,
+    iter_image_work_items,
+    iter_work_items,
+    shard_path,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,75 +39,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def create_gemini_content(instructions, prompt, encoded_image):
-    """
-    Creates the content structure for the Gemini API request.
-
-    Args:
-        instructions (str): The instructions for the model.
-        prompt (str): The prompt for the model.
-        encoded_image (str): The base64 encoded image string.
-
-    Returns:
-        list: A list of types.Content objects ready for the Gemini API.
-    """
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part(text=instructions),
-                types.Part(text=prompt),
-                types.Part(
-                    inline_data=types.Blob(
-                        mime_type="image/png", data=base64.b64decode(encoded_image)
-                    )
-                ),
-            ],
-        )
-    ]
-    return contents
-
-
-SAFETY_SETTINGS = [
-    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
-    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
-    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
-    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
-]
-
-
-def create_generate_content_config(
-    temperature=0, top_p=0.95, max_output_tokens=8192, response_modalities=["TEXT"]
-):
-    """
-    Creates and returns a GenerateContentConfig object with predefined settings.
-
-    Returns:
-        types.GenerateContentConfig: A configured GenerateContentConfig object.
-    """
-    generate_content_config = types.GenerateContentConfig(
-        temperature=temperature,
-        top_p=top_p,
-        max_output_tokens=max_output_tokens,
-        response_modalities=response_modalities,
-        safety_settings=SAFETY_SETTINGS,
-    )
-    return generate_content_config
-
-
-def load_image(image_path: Path) -> str | None:
-    """Loads an image and returns it as a base64 encoded string."""
-    try:
-        with Image.open(image_path) as img:
-            buffered = io.BytesIO()
-            img.save(buffered, format=img.format)
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            return img_str
-    except Exception as _:
-        logger.error(f"Error loading image {image_path}", exc_info=True)
-        return None
-
-
 def load_text_file(file_path: Path) -> str | None:
     """Loads the content of a text file."""
     try:
@@ -102,69 +49,161 @@ def load_text_file(file_path: Path) -> str | None:
         return None
 
 
-def generate_analysis(client, model, image_folder, instructions, prompt, output_file):
-    """Generates analysis for images in a folder based on instructions and prompt."""
-    image_files = [f for f in image_folder.rglob("*") if f.is_file()]
-    results = []
-
-    for image_file in tqdm(image_files, desc=""):
-        logger.info("Processing image %s", image_file)
-        encoded_image = load_image(image_file)
-        if encoded_image is None:
-            continue
-
-        contents = create_gemini_content(instructions, prompt, encoded_image)
-
-        generate_content_config = types.GenerateContentConfig(
-            temperature=0,
-            top_p=0.95,
-            max_output_tokens=8192,
-            response_modalities=["TEXT"],
-            safety_settings=[
-                types.SafetySetting(
-                    category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"
-                ),
-                types.SafetySetting(
-                    category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"
-                ),
-                types.SafetySetting(
-                    category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"
-                ),
-                types.SafetySetting(
-                    category="HARM_CATEGORY_HARASSMENT", threshold="OFF"
-                ),
-            ],
+def generate_analysis(
+    client,
+    model,
+    image_folder,
+    instructions,
+    prompt,
+    output_file,
+    cache=None,
+    checkpoint_file=None,
+    resume=False,
+    prompt_cache=None,
+    preprocessor=None,
+    index_file=None,
+    groups=None,
+    post_ids=None,
+    shard=None,
+    response_schema=None,
+    dedup=None,
+    metrics=None,
+    cascade=None,
+):
+    """
+    Generates analysis for images in a folder based on instructions and prompt.
+
+    With an `index_file`, the images listed in the index (optionally only
+    some `groups` or a `post_ids` range) are analyzed and keyed by post ID.
+    With a `shard` (i, N), only that shard is analyzed into its own
+    checkpoint and the CSV is left to merge.py. With `dedup` options, only
+    one image of each cluster of near-duplicates is sent. With a `cascade`,
+    each image goes to its models in turn instead of `model`.
+    """
+    if checkpoint_file is None:
+        checkpoint_file = shard_path(default_checkpoint_path(output_file), shard)
+    done = read_done_ids(checkpoint_file) if resume else set()
+    if done:
+        logger.info("Resuming: %d images already in %s", len(done), checkpoint_file)
+
+    if index_file is not None:
+        image_files = iter_work_items(
+            index_file, image_folder, groups, post_ids, done, shard=shard
+        )
+    else:
+        image_files = (
+            (f, f)
+            for f in iter_image_work_items(image_folder, shard)
+            if str(f) not in done
         )
 
-        try:
-            response = client.models.generate_content(
-                model=model, contents=contents, config=generate_content_config
-            )
-
-            # Process the response
-            response_text = response.text
-            _result = process_response(response_text, image_file)
-            if _result:
-                _result["id"] = image_file
-                # TODO: remove this with better prompt
-                del _result["Image ID"]
-                results.append(_result)
-            else:
-                logger.error("Error loading image %s", image_file, exc_info=True)
+    with CheckpointWriter(checkpoint_file, resume=resume) as writer:
+        on_result = writer.write
+        if dedup is not None:
+            image_files, on_result = dedup_work_items(image_files, on_result, dedup)
+        analyzed, total = run_serial(
+            client,
+            model,
+            image_files,
+            instructions,
+            prompt,
+            on_result,
+            cache=cache,
+            prompt_cache=prompt_cache,
+            preprocessor=preprocessor,
+            response_schema=response_schema,
+            metrics=metrics,
+            cascade=cascade,
+        )
 
-        except Exception as e:
-            logger.error("Error processing image %s: %s", image_file, e)
+    if analyzed < total:
+        logger.warning("%d of %d images could not be analyzed", total - analyzed, total)
+    logger.info("Responses parsed by tier: %s", parse_stats.report())
+    if cascade is not None:
+        cascade.log_report()
+
+    if shard is not None:
+        logger.info(
+            "Shard %d/%d written to %s; combine the shards with merge.py",
+            *shard,
+            checkpoint_file,
+        )
+    elif output_file is not None:
+        compile_checkpoint(checkpoint_file, output_file)
+
+
+def generate_batch_analysis(
+    backend,
+    model,
+    image_folder,
+    instructions,
+    prompt,
+    output_file,
+    checkpoint_file=None,
+    resume=False,
+    image_uri_prefix=None,
+    poll_interval=60,
+    index_file=None,
+    groups=None,
+    post_ids=None,
+    shard=None,
+    response_schema=None,
+    dedup=None,
+):
+    """
+    Generates analysis for images in a folder with one batch prediction job.
 
-    # Format and print the results
-    results_df = convert_dicts_to_dataframe(results)
+    With `dedup` options, only one image of each cluster of near-duplicates
+    is included in the job.
+    """
+    if checkpoint_file is None:
+        checkpoint_file = shard_path(default_checkpoint_path(output_file), shard)
+    done = read_done_ids(checkpoint_file) if resume else set()
 
-    # Move id column to leftmost position
-    if "id" in results_df.columns:
-        id_col = results_df.pop("id")
-        results_df.insert(0, "id", id_col)
+    if index_file is not None:
+        image_files = iter_work_items(
+            index_file, image_folder, groups, post_ids, done, shard=shard
+        )
+    else:
+        image_files = (
+            (str(f), f)
+            for f in iter_image_work_items(image_folder, shard)
+            if str(f) not in done
+        )
+    image_uri = None
+    if image_uri_prefix:
+
+        def image_uri(image_path):
+            relative_path = image_path.relative_to(image_folder).as_posix()
+            return f"{image_uri_prefix.rstrip('/')}/{relative_path}"
+
+    with CheckpointWriter(checkpoint_file, resume=resume) as writer:
+        on_result = writer.write
+        if dedup is not None:
+            image_files, on_result = dedup_work_items(image_files, on_result, dedup)
+        analyzed, total = run_batch(
+            backend,
+            model,
+            image_files,
+            instructions,
+            prompt,
+            on_result,
+            requests_file=checkpoint_file.with_suffix(".requests.jsonl"),
+            image_uri=image_uri,
+            poll_interval=poll_interval,
+            response_schema=response_schema,
+        )
 
-    results_df = results_df.drop_duplicates(subset=["id"])
-    results_df.to_csv(output_file, index=False)
+    if analyzed < total:
+        logger.warning("%d of %d images could not be analyzed", total - analyzed, total)
+    if shard is not None:
+        logger.info(
+            "Shard %d/%d written to %s; combine the shards with merge.py",
+            *shard,
+            checkpoint_file,
+        )
+    elif output_file is not None:
+        compile_checkpoint(checkpoint_file, output_file)
 
 
 def main():
@@ -205,21 +244,128 @@ def main():
         ),
     )
     parser.add_argument("--output", help="Ouput file path", type=Path)
+    add_cache_arguments(parser)
+    add_cascade_arguments(parser)
+    add_checkpoint_arguments(parser)
+    add_client_arguments(parser)
+    add_context_cache_arguments(parser)
+    add_dedup_arguments(parser)
+    add_metrics_arguments(parser)
+    add_preprocess_arguments(parser)
+    add_schema_arguments(parser)
+    add_work_list_arguments(parser)
+    parser.add_argument(
+        "--mode",
+        default="online",
+        choices=["online", "batch"],
+        help=(
+            "Send one request per image, or submit all images as a single "
+            "Vertex AI batch prediction job. Defaults to 'online'."
+        ),
+    )
+    parser.add_argument(
+        "--batch-gcs-prefix",
+        default=None,
+        help="gs:// prefix for batch inputs and outputs. Required with --mode batch.",
+    )
+    parser.add_argument(
+        "--batch-image-uri-prefix",
+        default=None,
+        help=(
+            "gs:// prefix mirroring --image-folder. When set, batch requests "
+            "reference images there instead of inlining their bytes."
+        ),
+    )
+    parser.add_argument(
+        "--poll-interval",
+        default=60,
+        help="Seconds between batch job status checks. Defaults to 60.",
+        type=float,
+    )
 
     args = parser.parse_args()
+    if args.mode == "batch" and not args.batch_gcs_prefix:
+        parser.error("--mode batch requires --batch-gcs-prefix")
+    if args.mode == "batch" and args.replay is not None:
+        parser.error("--replay only applies to --mode online")
+    if args.mode == "batch" and args.cascade:
+        parser.error("--cascade only applies to --mode online")
 
-    client = genai.Client(vertexai=True, project=args.project, location=args.location)
+    try:
+        client = client_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
     model = args.model
     instructions = load_text_file(args.instructions_file)
     prompt = load_text_file(args.prompt_file)
+    response_schema = cascade = None
+    if prompt:
+        try:
+            cascade = cascade_from_args(args, prompt)
+            response_schema, prompt = response_schema_from_args(args, prompt)
+        except ValueError as e:
+            parser.error(str(e))
+    if cascade is not None:
+        # The context cache, if any, serves the first tier, which sees every image.
+        model = cascade.models[0]
     logger.info("Using model %s", model)
 
-    if instructions and prompt:
-        generate_analysis(
-            client, model, args.image_folder, instructions, prompt, args.output
+    if not (instructions and prompt):
+        logger.error("Error: Could not load instructions or prompt.")
+    elif args.mode == "batch":
+        generate_batch_analysis(
+            VertexBatchBackend(client, args.batch_gcs_prefix),
+            model,
+            args.image_folder,
+            instructions,
+            prompt,
+            args.output,
+            checkpoint_file=args.checkpoint,
+            resume=args.resume,
+            image_uri_prefix=args.batch_image_uri_prefix,
+            poll_interval=args.poll_interval,
+            index_file=args.index_file,
+            groups=args.groups,
+            post_ids=args.post_ids,
+            shard=args.shard,
+            response_schema=response_schema,
+            dedup=dedup_options_from_args(args),
         )
     else:
-        logger.error("Error: Could not load instructions or prompt.")
+        cache = cache_from_args(args)
+        prompt_cache = prompt_cache_from_args(args, client, model, instructions, prompt)
+        preprocessor = preprocessor_from_args(args)
+        metrics = metrics_from_args(args)
+        try:
+            generate_analysis(
+                client,
+                model,
+                args.image_folder,
+                instructions,
+                prompt,
+                args.output,
+                cache=cache,
+                checkpoint_file=args.checkpoint,
+                resume=args.resume,
+                prompt_cache=prompt_cache,
+                preprocessor=preprocessor,
+                index_file=args.index_file,
+                groups=args.groups,
+                post_ids=args.post_ids,
+                shard=args.shard,
+                response_schema=response_schema,
+                dedup=dedup_options_from_args(args),
+                metrics=metrics,
+                cascade=cascade,
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+            if prompt_cache is not None:
+                prompt_cache.close()
+            if preprocessor is not None:
+                preprocessor.close()
+            metrics.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+"""Combine the per-shard checkpoints of a sharded run into one CSV."""
+
+import argparse
+import logging
+from pathlib import Path
+
+from checkpoint import compile_checkpoint, read_done_ids
+from index import read_index
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def merge_checkpoints(checkpoint_paths, output_file, index_file=None):
+    """
+    Writes the rows of every shard checkpoint to a single CSV file.
+
+    Checkpoints are read in sorted order, so the row kept for an id that more
+    than one shard produced does not depend on the order they were given in.
+    With an `index_file`, the post IDs that no shard produced are reported.
+
+    Returns:
+        tuple[int, list[str]]: The number of rows written and the missing post IDs.
+    """
+    checkpoint_paths = sorted(set(map(Path, checkpoint_paths)))
+    rows = compile_checkpoint(checkpoint_paths, output_file)
+
+    missing = []
+    if index_file is not None:
+        done = read_done_ids(*checkpoint_paths)
+        missing = [
+            post_id
+            for post_id in read_index(index_file).values()
+            if post_id not in done
+        ]
+        if missing:
+            logger.warning(
+                "%d post IDs have no results, e.g. %s",
+                len(missing),
+                ", ".join(missing[:5]),
+            )
+    return rows, missing
+
+
+def main():
+    epilog = """Example:
+    uv run merge.py results.shard-*-of-4.jsonl --output results.csv
+    """
+    parser = argparse.ArgumentParser(
+        description="Merge the checkpoints of a sharded analysis run into a CSV.",
+        epilog=epilog,
+    )
+    parser.add_argument(
+        "checkpoints", help="The shard checkpoints to merge.", nargs="+", type=Path
+    )
+    parser.add_argument(
+        "--output", "-o", help="The CSV file to write.", required=True, type=Path
+    )
+    parser.add_argument(
+        "--index-file",
+        default=None,
+        help="Report the post IDs of this index that no shard produced.",
+        type=Path,
+    )
+    args = parser.parse_args()
+
+    merge_checkpoints(args.checkpoints, args.output, args.index_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Per-image timings and token counts, written to a sidecar file and summarized."""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import numpy as np
+
+from gemini import estimate_cost
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("load", "cache", "request", "parse", "total")
+TOKEN_FIELDS = {
+    "prompt_tokens": "prompt_token_count",
+    "output_tokens": "candidates_token_count",
+    "cached_tokens": "cached_content_token_count",
+    "thoughts_tokens": "thoughts_token_count",
+}
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class ImageMetrics:
+    """
+    The measurements of one request, filled in as it goes through the stages.
+
+    The token fields add up every response about the image, and `usage` splits
+    them by model so each is priced at its own rate.
+
+    Args:
+        image_id (str): The image, or the first image of a multi-image request.
+        model (str): The Gemini model identifier.
+        images (int): Images the request carries.
+    """
+
+    def __init__(self, image_id, model, images=1):
+        self.started = time.perf_counter()
+        self.fields = {
+            "id": str(image_id),
+            "model": str(model),
+            "images": images,
+            "cache_hit": False,
+            "retries": 0,
+            "parse_tier": None,
+            "ok": False,
+            **{f"{stage}_s": 0.0 for stage in STAGES},
+            **dict.fromkeys(TOKEN_FIELDS, 0),
+        }
+        # Token counts by the model that used them, as a cascade may ask
+        # several models about one image.
+        self.usage = defaultdict(lambda: dict.fromkeys(TOKEN_FIELDS, 0))
+
+    @contextmanager
+    def stage(self, name):
+        """Adds the time spent in the block to the stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fields[f"{name}_s"] += time.perf_counter() - start
+
+    def note_retry(self, error=None):
+        self.fields["retries"] += 1
+
+    def record_usage(self, usage_metadata, model=None):
+        """
+        Adds the token counts of a response from `model`, by default the model
+        the record was started with.
+        """
+        usage = self.usage[str(model) if model is not None else self.fields["model"]]
+        for field, attribute in TOKEN_FIELDS.items():
+            count = getattr(usage_metadata, attribute, None) or 0
+            self.fields[field] += count
+            usage[field] += count
+
+    def update(self, **fields):
+        self.fields.update(fields)
+
+
+def time_stage(record, name):
+    """Times a stage of `record`, an `ImageMetrics`, if there is one."""
+    return record.stage(name) if record is not None else nullcontext()
+
+
+def retry_callback(record):
+    """Returns the callback counting the retries of `record`, if there is one."""
+    return record.note_retry if record is not None else None
+
+
+def percentiles(values):
+    """Returns the QUANTILES of `values`, or zeros if there are none."""
+    if not values:
+        return [0.0] * len(QUANTILES)
+    return np.quantile(np.asarray(values), QUANTILES).tolist()
+
+
+class RunMetrics:
+    """
+    Collects the `ImageMetrics` of a run.
+
+    Each record is appended to a JSONL file as it completes. `close` logs the
+    p50/p95/p99 of every stage and the estimated cost per model, and can write
+    the same summary in the Prometheus text format for a textfile collector.
+    The class is safe to share between threads.
+
+    Args:
+        jsonl_file (Path | None): Per-request records are appended here.
+        prometheus_file (Path | None): The summary is written here on close.
+    """
+
+    def __init__(self, jsonl_file=None, prometheus_file=None):
+        self.jsonl_file = jsonl_file
+        self.prometheus_file = prometheus_file
+        self._file = None
+        if jsonl_file is not None:
+            Path(jsonl_file).parent.mkdir(parents=True, exist_ok=True)
+            # Stays open until close().
+            self._file = open(jsonl_file, "a", encoding="utf-8")  # noqa: SIM115
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.images = 0
+        self.failed = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.stage_times = {stage: [] for stage in STAGES}
+        self.tokens = defaultdict(lambda: dict.fromkeys(TOKEN_FIELDS, 0))
+        self.parse_tiers = defaultdict(int)
+
+    def start(self, image_id, model, images=1):
+        """Returns the metrics of a new request."""
+        return ImageMetrics(image_id, model, images)
+
+    def finish(self, record, ok):
+        """Records a completed request."""
+        record.fields["ok"] = bool(ok)
+        record.fields["total_s"] = time.perf_counter() - record.started
+        fields = record.fields
+        line = json.dumps(fields) if self._file is not None else None
+        with self._lock:
+            self.requests += 1
+            self.images += fields["images"]
+            self.failed += not ok
+            self.retries += fields["retries"]
+            self.cache_hits += fields["cache_hit"]
+            for stage in STAGES:
+                self.stage_times[stage].append(fields[f"{stage}_s"])
+            # Lists the model even when its responses carry no usage.
+            self.tokens[fields["model"]]
+            for model, usage in record.usage.items():
+                tokens = self.tokens[model]
+                for field in TOKEN_FIELDS:
+                    tokens[field] += usage[field]
+            if fields["parse_tier"]:
+                self.parse_tiers[fields["parse_tier"]] += 1
+            if line is not None:
+                self._file.write(line + "\n")
+
+    def summary(self):
+        """Returns the totals, stage percentiles and cost per model so far."""
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            costs = {}
+            for model, tokens in self.tokens.items():
+                costs[model] = estimate_cost(
+                    model,
+                    tokens["prompt_tokens"],
+                    tokens["output_tokens"] + tokens["thoughts_tokens"],
+                    tokens["cached_tokens"],
+                )
+            return {
+                "requests": self.requests,
+                "images": self.images,
+                "failed": self.failed,
+                "retries": self.retries,
+                "cache_hits": self.cache_hits,
+                "seconds": elapsed,
+                "images_per_second": self.images / elapsed if elapsed else 0.0,
+                "stages": {
+                    stage: dict(zip(QUANTILES, percentiles(times)))
+                    for stage, times in self.stage_times.items()
+                },
+                "tokens": {
+                    model: dict(tokens) for model, tokens in self.tokens.items()
+                },
+                "cost": costs,
+                "parse_tiers": dict(self.parse_tiers),
+            }
+
+    def prometheus_text(self, summary=None):
+        """Renders the summary in the Prometheus text exposition format."""
+        summary = summary or self.summary()
+        lines = [
+            "# HELP cdl_wind_stage_seconds Time spent per request in each stage.",
+            "# TYPE cdl_wind_stage_seconds summary",
+        ]
+        for stage, quantiles in summary["stages"].items():
+            for quantile, value in quantiles.items():
+                lines.append(
+                    f'cdl_wind_stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                    f"{value:.6f}"
+                )
+            lines.append(
+                f'cdl_wind_stage_seconds_count{{stage="{stage}"}} {summary["requests"]}'
+            )
+        for name in ("requests", "images", "failed", "retries", "cache_hits"):
+            lines.append(f"# TYPE cdl_wind_{name}_total counter")
+            lines.append(f"cdl_wind_{name}_total {summary[name]}")
+        lines.append("# TYPE cdl_wind_tokens_total counter")
+        for model, tokens in summary["tokens"].items():
+            for field, value in tokens.items():
+                kind = field.removesuffix("_tokens")
+                lines.append(
+                    f'cdl_wind_tokens_total{{model="{model}",kind="{kind}"}} {value}'
+                )
+        lines.append("# TYPE cdl_wind_cost_usd gauge")
+        for model, cost in summary["cost"].items():
+            if cost is not None:
+                lines.append(f'cdl_wind_cost_usd{{model="{model}"}} {cost:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Closes the sidecar files and logs the summary of the run."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        summary = self.summary()
+        if self.prometheus_file is not None:
+            Path(self.prometheus_file).write_text(self.prometheus_text(summary))
+
+        if not summary["requests"]:
+            return summary
+        logger.info(
+            "Metrics: %d requests for %d images in %.1fs (%.2f images/s), "
+            "%d failed, %d retries, %d cache hits",
+            summary["requests"],
+            summary["images"],
+            summary["seconds"],
+            summary["images_per_second"],
+            summary["failed"],
+            summary["retries"],
+            summary["cache_hits"],
+        )
+        for stage, quantiles in summary["stages"].items():
+            logger.info(
+                "Metrics: %-7s p50 %.3fs  p95 %.3fs  p99 %.3fs",
+                stage,
+                *quantiles.values(),
+            )
+        for model, tokens in summary["tokens"].items():
+            cost = summary["cost"][model]
+            logger.info(
+                "Metrics: %s used %d prompt (%d cached), %d output and %d thinking "
+                "tokens, estimated cost %s",
+                model,
+                tokens["prompt_tokens"],
+                tokens["cached_tokens"],
+                tokens["output_tokens"],
+                tokens["thoughts_tokens"],
+                "unknown" if cost is None else f"${cost:.4f}",
+            )
+        return summary
+
+
+def add_metrics_arguments(parser):
+    """Adds the metrics options to an argparse parser."""
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Append per-request stage timings and token counts to this JSONL file.",
+        type=Path,
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        default=None,
+        help="Write the run summary in the Prometheus text format to this file.",
+        type=Path,
+    )
+
+
+def metrics_from_args(args):
+    """Creates the metrics collector of a run; the summary is always logged."""
+    return RunMetrics(args.metrics_file, args.metrics_prometheus)
@@ -1,60 +1,222 @@
 import json
 import logging
-import re
-from functools import reduce
+import os
+import threading
 from pprint import pp
 
+import numpy as np
 import pandas as pd
 from json_repair import repair_json
 
 logger = logging.getLogger(__name__)
 
 
-def parse_json_like_output(output_text, image_name=None):
+# Longest span the brace matcher scans for the end of an object, so a stray
+# "{" in a long response cannot make extraction quadratic.
+MAX_EXTRACT_CHARS = 100_000
+# Number of "{" positions the brace matcher tries before giving up.
+MAX_EXTRACT_CANDIDATES = 4
+
+PARSE_TIERS = ("strict", "extract", "repair", "failed")
+
+
+class ParseStats:
+    """Counts how often each tier of `parse_json_like_output` parsed a response."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, tier):
+        with self._lock:
+            self.counts[tier] += 1
+
+    def report(self):
+        """Returns the number of responses each tier handled."""
+        with self._lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(PARSE_TIERS, 0)
+
+
+parse_stats = ParseStats()
+
+
+def strip_code_fence(text):
+    """Returns the body of a markdown code block, or the trimmed text."""
+    text = text.strip()
+    if text.startswith("```") and text.endswith("```") and len(text) >= 6:
+        body = text[3:-3]
+        # Drop the language tag, e.g. ```json.
+        first_line, newline, rest = body.partition("\n")
+        if newline and (not first_line.strip() or first_line.strip().isalnum()):
+            body = rest
+        text = body.strip()
+    return text
+
+
+def _loads_dict(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _balanced_object_end(text, start):
+    """Returns the index just past the object opening at `start`, or None."""
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, min(len(text), start + MAX_EXTRACT_CHARS)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def extract_json_object(text):
     """
-    Parses a JSON-like string into a Python dictionary.
+    Finds the first valid JSON object embedded in `text` by matching braces.
+
+    Returns:
+        dict | None: The object, or None if no balanced span parses.
+    """
+    start = text.find("{")
+    for _ in range(MAX_EXTRACT_CANDIDATES):
+        if start == -1:
+            return None
+        end = _balanced_object_end(text, start)
+        if end is not None and (data := _loads_dict(text[start:end])) is not None:
+            return data
+        start = text.find("{", start + 1)
+    return None
+
+
+def split_json_objects(text):
+    """
+    Splits the top-level objects out of a JSON array, or any other text.
+
+    Each object can then be parsed on its own, so one malformed answer does
+    not lose the others. An object cut off by a truncated response is dropped.
+
+    Returns:
+        list[str]: The text of each balanced `{...}` span, in order.
+    """
+    objects = []
+    start = text.find("{")
+    while start != -1:
+        end = _balanced_object_end(text, start)
+        if end is None:
+            break
+        objects.append(text[start:end])
+        start = text.find("{", end)
+    return objects
+
+
+def parse_with_tier(output_text, image_name=None):
+    """
+    Parses a JSON-like string into a dictionary, reporting how it was parsed.
+
+    Parsing is tiered, cheapest first: strict `json.loads` of the trimmed text
+    or code block body, then the first balanced `{...}` span, and only then
+    `repair_json`, which handles single quotes, trailing commas and the like.
+    The tier that succeeded is counted in `parse_stats`.
 
     Args:
         output_text: The string output from the AI, resembling a JSON dictionary.
 
     Returns:
-        A Python dictionary representing the parsed data, or None if parsing fails.
+        tuple[dict | None, str]: The parsed data, or None if parsing fails, and
+        the tier that produced it (one of `PARSE_TIERS`).
     """
     try:
-        # Remove any leading/trailing whitespace and newlines
-        output_text = output_text.strip()
-
-        # Handle cases where the AI might include extra characters or newlines
-        # before or after the curly braces, or markdown code blocks.
-        if output_text.startswith("```json") and output_text.endswith("```"):
-            output_text = output_text[7:-3].strip()
-        elif not output_text.startswith("{") or not output_text.endswith("}"):
-            # Attempt to find the dictionary within the string
-            match = re.search(r"\{.*\}", output_text, re.DOTALL)
-            if match:
-                output_text = match.group(0)
-            else:
-                logger.error("Error: Could not find a dictionary within the output.")
-                return None
-
-        # Replace single quotes with double quotes for valid JSON
-        output_text = repair_json(output_text.replace("'", '"'))
-
-        # Load the string as a JSON object
-        data = json.loads(output_text)
-        return data
-
-    except json.JSONDecodeError:
+        output_text = strip_code_fence(output_text)
+
+        data = _loads_dict(output_text)
+        if data is not None:
+            parse_stats.record("strict")
+            return data, "strict"
+
+        data = extract_json_object(output_text)
+        if data is not None:
+            parse_stats.record("extract")
+            return data, "extract"
+
+        start, end = output_text.find("{"), output_text.rfind("}")
+        if start == -1:
+            parse_stats.record("failed")
+            logger.error("Error: Could not find a dictionary within the output.")
+            return None, "failed"
+        candidate = output_text[start : end + 1] if end > start else output_text[start:]
+        data = _loads_dict(repair_json(candidate))
+        if data is not None:
+            parse_stats.record("repair")
+            return data, "repair"
+
+        parse_stats.record("failed")
         img_name = f"for image {image_name}." if image_name else "."
         problematic_content = f"\nProblematic content:\n{output_text}"
-        log_message = f"Error: Invalid JSON format {img_name}{problematic_content}"
-        logger.error(log_message, exc_info=True)
-        return None
+        logger.error(f"Error: Invalid JSON format {img_name}{problematic_content}")
+        return None, "failed"
+
     except Exception:
+        parse_stats.record("failed")
         base_message = "An unexpected error occurred while processing text"
         log_message = f"{base_message} from {image_name}." if image_name else "."
         logger.error(log_message, exc_info=True)
-        return None
+        return None, "failed"
+
+
+def make_row(answers, image_id):
+    """Turns parsed answers into a result row keyed by `image_id`."""
+    answers["id"] = image_id
+    # TODO: remove this with better prompt
+    if "Image ID" in answers:
+        del answers["Image ID"]
+    return answers
+
+
+def parse_row(response_text, image_id):
+    """
+    Parses a response into a result row keyed by `image_id`.
+
+    Takes and returns only picklable values, so it can run in a worker process.
+
+    Returns:
+        tuple[dict | None, str]: The row, or None, and the parse tier.
+    """
+    data, tier = parse_with_tier(response_text, image_id)
+    return (make_row(data, image_id) if data else None), tier
+
+
+def parse_json_like_output(output_text, image_name=None):
+    """
+    Parses a JSON-like string into a Python dictionary.
+
+    See `parse_with_tier` for how the string is parsed.
+
+    Args:
+        output_text: The string output from the AI, resembling a JSON dictionary.
+
+    Returns:
+        A Python dictionary representing the parsed data, or None if parsing fails.
+    """
+    return parse_with_tier(output_text, image_name)[0]
 
 
 def process_response(response_text, image_name=None):
@@ -79,25 +241,74 @@ def convert_dicts_to_dataframe(list_of_dicts):
     """
     Converts a list of dictionaries into a single pandas DataFrame.
 
+    Values are collected column by column in a single pass, so the cost grows
+    linearly with the number of rows. Dictionaries may have different keys:
+    columns appear in the order their key is first seen, values missing from a
+    row are NaN, and the "id" column, if any, is placed first.
+
     Args:
-        list_of_dicts (list): A list where each element is a dictionary with the same keys.
+        list_of_dicts (list): A list where each element is a dictionary of answers.
 
     Returns:
-        pd.DataFrame: A concatenated DataFrame with all dictionaries as rows.
+        pd.DataFrame: A DataFrame with one row per dictionary.
     """
+    columns = {}
+    n_rows = 0
+    for d in list_of_dicts:
+        for key, value in d.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [np.nan] * n_rows
+            column.append(value)
+        n_rows += 1
+        # Pad the columns this row did not have.
+        for column in columns.values():
+            if len(column) < n_rows:
+                column.append(np.nan)
 
-    # Convert each dictionary to a DataFrame (one row per dict)
-    def dict_to_df(d):
-        return pd.DataFrame({k: [v] for k, v in d.items()})
+    if "id" in columns:
+        columns = {"id": columns.pop("id"), **columns}
 
-    list_of_dfs = list(map(dict_to_df, list_of_dicts))
+    return pd.DataFrame(columns, index=pd.RangeIndex(n_rows))
+
+
+def join_post_ids(results, index, on="id", column="post_id", directory=None):
+    """
+    Attaches the post ID of each result row's file as a new column.
+
+    The join is a single vectorized lookup rather than a scan per row. Values
+    of `on` are matched against the index filenames, after removing the
+    `directory` prefix if given; values that still do not match are looked up
+    by bare file name, for names that are unique in the index.
+
+    Args:
+        results (pd.DataFrame): Result rows, e.g. from `convert_dicts_to_dataframe`.
+        index (Mapping[str, str]): Filenames and their post IDs, such as an `Index`.
+        on (str): Column holding the file of each row.
+        column (str): Name of the post ID column to add after `on`.
+        directory (str | Path | None): Directory the index filenames are
+            relative to.
+
+    Returns:
+        pd.DataFrame: A copy of `results` with the post ID column.
+    """
+    post_ids = pd.Series(list(index.values()), index=list(index.keys()), dtype=object)
+    files = results[on].astype(str)
+    if directory is not None:
+        prefix = str(directory).rstrip("/\\") + os.sep
+        files = files.str.removeprefix(prefix)
+    joined = files.map(post_ids)
 
-    # Concatenate all DataFrames vertically (like vcat)
-    final_df = reduce(
-        lambda x, y: pd.concat([x, y], axis=0, ignore_index=True), list_of_dfs
-    )
+    missing = joined.isna()
+    if missing.any():
+        names = post_ids.index.str.rsplit(os.sep, n=1).str[-1]
+        by_name = pd.Series(post_ids.values, index=names)
+        by_name = by_name[~by_name.index.duplicated(keep=False)]
+        joined[missing] = files[missing].str.rsplit(os.sep, n=1).str[-1].map(by_name)
 
-    return final_df
+    results = results.copy()
+    results.insert(results.columns.get_loc(on) + 1, column, joined)
+    return results
 
 
 if __name__ == "__main__":
@@ -0,0 +1,336 @@
+"""
+A staged engine that keeps CPU work off the threads waiting on the network.
+
+Images are loaded and preprocessed on one process pool, requests are sent
+from a pool of I/O threads, and responses are parsed on a second process
+pool. Bounded queues between the stages provide backpressure: a slow stage
+fills the queue in front of it and the stages upstream wait, so neither
+loaded images nor responses pile up in memory.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from tqdm import tqdm
+
+from analyzer import (
+    create_gemini_content,
+    create_generate_content_config,
+    generate,
+)
+from cache import make_cache_key
+from metrics import retry_callback, time_stage
+from parser import parse_row, parse_stats
+from preprocess import load_and_preprocess
+from scheduler import RequestScheduler, estimate_request_tokens
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items a stage receives.
+_DONE = object()
+
+
+@dataclass(frozen=True)
+class StageWorkers:
+    """
+    Worker counts of the pipeline stages.
+
+    Args:
+        load (int | None): Processes loading and preprocessing images.
+            Defaults to the CPU count.
+        request (int | None): Threads sending requests. Defaults to the
+            scheduler's concurrency ceiling.
+        parse (int): Processes parsing responses.
+        queue_size (int | None): Capacity of each queue between two stages.
+            Defaults to twice the request threads.
+    """
+
+    load: int | None = None
+    request: int | None = None
+    parse: int = 1
+    queue_size: int | None = None
+
+    def resolve(self, scheduler):
+        """Returns the counts with the defaults filled in."""
+        request = self.request or scheduler.concurrency.max_workers
+        return StageWorkers(
+            load=self.load or os.cpu_count(),
+            request=request,
+            parse=self.parse,
+            queue_size=self.queue_size or 2 * request,
+        )
+
+
+class _Item:
+    """An image on its way through the stages."""
+
+    def __init__(self, image_id, image_path, record):
+        self.image_id = image_id
+        self.image_path = image_path
+        self.record = record
+        self.image = None
+        self.response_text = None
+        self.row = None
+
+
+def _start_stage(name, workers, handle, inbox, outbox, failed, consumers):
+    """
+    Starts the threads of a stage.
+
+    Each thread takes items from `inbox` until it receives `_DONE` and
+    passes them to `handle`, which returns True if the item goes on to
+    `outbox`. Items that fail are put on `failed`. The last thread to finish
+    puts one `_DONE` per thread of the next stage on `outbox`.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def run():
+        try:
+            while (item := inbox.get()) is not _DONE:
+                try:
+                    ok = handle(item)
+                # One failed image must not stop the stage's thread.
+                except Exception as e:  # noqa: BLE001
+                    logger.error("Error processing image %s: %s", item.image_id, e)
+                    ok = False
+                (outbox if ok else failed).put(item)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(consumers):
+                    outbox.put(_DONE)
+
+    threads = [
+        threading.Thread(target=run, name=f"{name}-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run_pipeline(
+    client,
+    model,
+    image_files,
+    instructions,
+    prompt,
+    on_result,
+    cache=None,
+    scheduler=None,
+    prompt_cache=None,
+    preprocessor=None,
+    response_schema=None,
+    metrics=None,
+    workers=None,
+):
+    """
+    Analyzes images in three stages connected by bounded queues.
+
+    The load and parse stages submit their work to process pools, one thread
+    per worker process waiting on the result, and the request stage runs on
+    threads. Work items are pulled from `image_files` only as the first
+    queue has room, so the work list can be a lazy generator.
+
+    Args:
+        image_files (Iterable[Path | tuple[str, Path]]): The images to analyze,
+            see `engines.split_work_item`.
+        on_result (callable): Called with each result row as it completes,
+            from the calling thread.
+        preprocessor (ImagePreprocessor | None): Its options are applied in
+            the load stage, and it tallies what they saved.
+        workers (StageWorkers | None): The worker count of each stage.
+
+    Returns:
+        tuple[int, int]: The number of images analyzed and the number submitted.
+    """
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    workers = (workers or StageWorkers()).resolve(scheduler)
+    options = preprocessor.options if preprocessor is not None else None
+    config = create_generate_content_config(response_schema=response_schema)
+    tokens = estimate_request_tokens(instructions, prompt)
+
+    pending = queue.Queue(maxsize=workers.queue_size)
+    loaded = queue.Queue(maxsize=workers.queue_size)
+    responses = queue.Queue(maxsize=workers.queue_size)
+    results = queue.Queue(maxsize=workers.queue_size)
+    stop = threading.Event()
+    feed_errors = []
+    submitted = 0
+
+    def feed():
+        nonlocal submitted
+        try:
+            for work_item in image_files:
+                if stop.is_set():
+                    break
+                image_id, image_path = (
+                    work_item
+                    if isinstance(work_item, tuple)
+                    else (work_item.name, work_item)
+                )
+                record = metrics.start(image_id, model) if metrics is not None else None
+                pending.put(_Item(image_id, image_path, record))
+                submitted += 1
+        # Re-raised on the calling thread once the stages have drained.
+        except Exception as e:  # noqa: BLE001
+            feed_errors.append(e)
+        finally:
+            for _ in range(workers.load):
+                pending.put(_DONE)
+
+    def load(item):
+        with time_stage(item.record, "load"):
+            image, result = load_pool.submit(
+                load_and_preprocess, item.image_path, options
+            ).result()
+        if image is None:
+            return False
+        if result is not None:
+            image = preprocessor.apply(*image, result)
+        item.image = image
+        return True
+
+    def request(item):
+        logger.info("Processing image %s", item.image_path)
+        image_data, mime_type = item.image
+        item.image = None
+        response_text = None
+        if cache is not None:
+            with time_stage(item.record, "cache"):
+                cache_key = make_cache_key(
+                    image_data, instructions, prompt, model, config
+                )
+                response_text = cache.get(cache_key)
+            if item.record is not None:
+                item.record.update(cache_hit=response_text is not None)
+
+        if response_text is None:
+            with time_stage(item.record, "request"):
+                response = generate(
+                    client,
+                    model,
+                    create_gemini_content(instructions, prompt, image_data, mime_type),
+                    config,
+                    scheduler=scheduler,
+                    prompt_cache=prompt_cache,
+                    tokens=tokens,
+                    on_retry=retry_callback(item.record),
+                )
+            if item.record is not None:
+                item.record.record_usage(response.usage_metadata)
+            response_text = response.text
+            if cache is not None and response_text:
+                cache.put(cache_key, response_text)
+        item.response_text = response_text
+        return True
+
+    def parse(item):
+        with time_stage(item.record, "parse"):
+            row, tier = parse_pool.submit(
+                parse_row, item.response_text, item.image_id
+            ).result()
+        parse_stats.record(tier)
+        if item.record is not None:
+            item.record.update(parse_tier=tier)
+        item.row = row
+        if row is None:
+            logger.error("Could not parse the response for image %s", item.image_id)
+        return row is not None
+
+    # Spawned for the same reason as the preprocessing pool.
+    context = multiprocessing.get_context("spawn")
+    load_pool = ProcessPoolExecutor(max_workers=workers.load, mp_context=context)
+    parse_pool = ProcessPoolExecutor(max_workers=workers.parse, mp_context=context)
+    threads = [threading.Thread(target=feed, name="feed", daemon=True)]
+    threads += _start_stage(
+        "load", workers.load, load, pending, loaded, results, workers.request
+    )
+    threads += _start_stage(
+        "request", workers.request, request, loaded, responses, results, workers.parse
+    )
+    threads += _start_stage(
+        "parse", workers.parse, parse, responses, results, results, 1
+    )
+    threads[0].start()
+
+    analyzed = 0
+    item = None
+    description = (
+        f"Processing images (load {workers.load} procs, "
+        f"request {workers.request} threads, parse {workers.parse} procs)"
+    )
+    try:
+        with tqdm(desc=description) as progress:
+            while (item := results.get()) is not _DONE:
+                if item.row is not None:
+                    on_result(item.row)
+                    analyzed += 1
+                if item.record is not None:
+                    metrics.finish(item.record, item.row is not None)
+                progress.update(1)
+                progress.set_postfix(
+                    loaded=loaded.qsize(), responses=responses.qsize(), refresh=False
+                )
+    finally:
+        # On an error, stop feeding and let the images in flight drain.
+        stop.set()
+        while item is not _DONE:
+            item = results.get()
+        for thread in threads:
+            thread.join()
+        load_pool.shutdown()
+        parse_pool.shutdown()
+    if feed_errors:
+        raise feed_errors[0]
+    return analyzed, submitted
+
+
+def add_pipeline_arguments(parser):
+    """Adds the worker counts of the pipeline engine to an argparse parser."""
+    parser.add_argument(
+        "--load-workers",
+        default=None,
+        help="Processes loading images for --engine pipeline. Defaults to the CPU count.",
+        type=int,
+    )
+    parser.add_argument(
+        "--request-workers",
+        default=None,
+        help="Threads sending requests for --engine pipeline. Defaults to --max-workers.",
+        type=int,
+    )
+    parser.add_argument(
+        "--parse-workers",
+        default=1,
+        help="Processes parsing responses for --engine pipeline. Defaults to 1.",
+        type=int,
+    )
+    parser.add_argument(
+        "--queue-size",
+        default=None,
+        help=(
+            "Capacity of the queues between the pipeline stages. Defaults to "
+            "twice the request threads."
+        ),
+        type=int,
+    )
+
+
+def stage_workers_from_args(args):
+    """Returns the stage worker counts configured on the command line."""
+    return StageWorkers(
+        load=args.load_workers,
+        request=args.request_workers,
+        parse=args.parse_workers,
+        queue_size=args.queue_size,
+    )
@@ -0,0 +1,307 @@
+"""Shrinking screenshots before they are sent, to save image tokens and upload time."""
+
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops
+
+from images import load_image
+
+logger = logging.getLogger(__name__)
+
+# Images whose sides are both at most SMALL_IMAGE_SIDE count as one tile;
+# larger ones are split into TILE_SIDE x TILE_SIDE tiles.
+TILE_SIDE = 768
+SMALL_IMAGE_SIDE = 384
+TILE_TOKENS = 258
+
+# Errors of an image Pillow cannot decode, convert or save.
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+OUTPUT_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def estimate_image_tokens(width, height):
+    """Estimates the input tokens Gemini charges for an image of this size."""
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TILE_TOKENS
+    return math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE) * TILE_TOKENS
+
+
+@dataclass(frozen=True)
+class PreprocessOptions:
+    """
+    How screenshots are shrunk before being sent.
+
+    Args:
+        max_side (int | None): Longest side, in pixels, after downsampling.
+        max_tokens (int | None): Image token budget the image is downsampled to fit.
+        trim_borders (bool): Crop uniform margins around the post.
+        border_tolerance (int): Largest per-channel difference from the corner
+            color still treated as border.
+        format (str): Output format, one of `OUTPUT_FORMATS`.
+        quality (int): Encoder quality for WebP and JPEG.
+    """
+
+    max_side: int | None = 1536
+    max_tokens: int | None = None
+    trim_borders: bool = True
+    border_tolerance: int = 8
+    format: str = "webp"
+    quality: int = 85
+
+
+def trim_borders(img, tolerance=8):
+    """Crops the margins of `img` that match the color of its top-left pixel."""
+    background = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background)
+    if img.mode != "L":
+        diff = diff.convert("L")
+    bbox = diff.point(lambda value: 255 if value > tolerance else 0).getbbox()
+    if bbox is None or bbox == (0, 0, *img.size):
+        return img
+    return img.crop(bbox)
+
+
+def target_size(width, height, max_side=None, max_tokens=None):
+    """Returns the size an image is downsampled to, keeping its aspect ratio."""
+    scale = 1.0
+    if max_side is not None and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+
+    def scaled(scale):
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    if max_tokens is not None:
+        # Shrinking by 10% at a time converges in a few dozen steps even for
+        # budgets of a single tile.
+        while estimate_image_tokens(*scaled(scale)) > max_tokens and scale > 0.01:
+            scale *= 0.9
+    return scaled(scale)
+
+
+def preprocess_image(data, options):
+    """
+    Trims, downsamples and re-encodes one image.
+
+    Runs in a worker process, so it only takes and returns picklable values.
+    The original bytes are kept when processing would save neither bytes nor
+    tokens.
+
+    Args:
+        data (bytes): The encoded image.
+        options (PreprocessOptions): How to shrink it.
+
+    Returns:
+        tuple[bytes | None, str | None, int, int]: The new bytes and MIME type
+        (None to keep the original), and the estimated tokens before and after.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        tokens_before = estimate_image_tokens(*img.size)
+        has_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha and options.format != "jpeg" else "RGB")
+
+    if options.trim_borders:
+        img = trim_borders(img, options.border_tolerance)
+    size = target_size(*img.size, options.max_side, options.max_tokens)
+    if size != img.size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    tokens_after = estimate_image_tokens(*img.size)
+
+    image_format, mime_type = OUTPUT_FORMATS[options.format]
+    buffered = io.BytesIO()
+    img.save(buffered, format=image_format, quality=options.quality)
+    processed = buffered.getvalue()
+
+    if len(processed) >= len(data) and tokens_after >= tokens_before:
+        return None, None, tokens_before, tokens_before
+    return processed, mime_type, tokens_before, tokens_after
+
+
+def load_and_preprocess(image_path, options=None):
+    """
+    Loads an image and, with preprocessing `options`, shrinks it.
+
+    Runs in a worker process of the load stage of `pipeline.run_pipeline`.
+
+    Returns:
+        tuple: The image bytes and MIME type, or None if the file is not a
+        readable image, and the `preprocess_image` result or None.
+    """
+    image = load_image(image_path)
+    if image is None or options is None:
+        return image, None
+    try:
+        return image, preprocess_image(image[0], options)
+    except IMAGE_ERRORS as e:
+        logger.warning("Could not preprocess %s, sending it as is: %s", image_path, e)
+        return image, None
+
+
+class ImagePreprocessor:
+    """
+    Runs `preprocess_image` on a process pool and tallies what it saved.
+
+    `process` blocks the calling thread until its image is done, so it can be
+    called from the request threads (or `asyncio.to_thread`) while decoding
+    and encoding run outside the GIL of the main process.
+
+    Args:
+        options (PreprocessOptions): How to shrink images.
+        max_workers (int | None): Worker processes. Defaults to the CPU count.
+    """
+
+    def __init__(self, options=None, max_workers=None):
+        self.options = options or PreprocessOptions()
+        # Spawned rather than forked: the pool starts after the request
+        # threads, and forking a threaded process is unsafe.
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def process(self, image_data, mime_type):
+        """
+        Returns the preprocessed bytes and MIME type of an image.
+
+        Images that cannot be processed are returned unchanged.
+        """
+        try:
+            future = self._executor.submit(preprocess_image, image_data, self.options)
+            result = future.result()
+        except (*IMAGE_ERRORS, BrokenExecutor) as e:
+            logger.warning("Could not preprocess image, sending it as is: %s", e)
+            return image_data, mime_type
+        return self.apply(image_data, mime_type, result)
+
+    def apply(self, image_data, mime_type, result):
+        """
+        Tallies a `preprocess_image` result computed elsewhere, such as by
+        `load_and_preprocess`.
+
+        Returns:
+            tuple[bytes, str]: The bytes and MIME type to send.
+        """
+        processed, processed_mime_type, tokens_before, tokens_after = result
+        with self._lock:
+            self.images += 1
+            self.bytes_before += len(image_data)
+            self.bytes_after += len(processed or image_data)
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+        if processed is None:
+            return image_data, mime_type
+        return processed, processed_mime_type
+
+    def report(self):
+        """Returns the totals of the images processed so far."""
+        with self._lock:
+            return {
+                "images": self.images,
+                "bytes_before": self.bytes_before,
+                "bytes_after": self.bytes_after,
+                "bytes_saved": self.bytes_before - self.bytes_after,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "tokens_saved": self.tokens_before - self.tokens_after,
+            }
+
+    def close(self):
+        """Stops the worker processes and logs the bytes and tokens saved."""
+        self._executor.shutdown()
+        report = self.report()
+        if report["images"]:
+            logger.info(
+                "Preprocessed %d images: %.1f MB -> %.1f MB, "
+                "~%d -> ~%d image tokens (%d saved)",
+                report["images"],
+                report["bytes_before"] / 1e6,
+                report["bytes_after"] / 1e6,
+                report["tokens_before"],
+                report["tokens_after"],
+                report["tokens_saved"],
+            )
+        return report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def add_preprocess_arguments(parser):
+    """Adds the image preprocessing options to an argparse parser."""
+    parser.add_argument(
+        "--preprocess",
+        action="store_true",
+        help="Trim, downsample and recompress images before sending them.",
+    )
+    parser.add_argument(
+        "--max-side",
+        default=PreprocessOptions.max_side,
+        help=(
+            "Longest image side in pixels after preprocessing. "
+            f"Defaults to {PreprocessOptions.max_side}."
+        ),
+        type=int,
+    )
+    parser.add_argument(
+        "--max-image-tokens",
+        default=None,
+        help="Downsample each image until its estimated token cost fits this budget.",
+        type=int,
+    )
+    parser.add_argument(
+        "--no-trim-borders",
+        action="store_true",
+        help="Keep uniform margins around the screenshots.",
+    )
+    parser.add_argument(
+        "--image-format",
+        default=PreprocessOptions.format,
+        help=f"Format images are recompressed to. Defaults to {PreprocessOptions.format}.",
+        choices=list(OUTPUT_FORMATS),
+    )
+    parser.add_argument(
+        "--image-quality",
+        default=PreprocessOptions.quality,
+        help=f"WebP/JPEG quality. Defaults to {PreprocessOptions.quality}.",
+        type=int,
+    )
+    parser.add_argument(
+        "--preprocess-workers",
+        default=None,
+        help="Preprocessing processes. Defaults to the number of CPUs.",
+        type=int,
+    )
+
+
+def preprocessor_from_args(args):
+    """Creates the preprocessor configured on the command line, if enabled."""
+    if not args.preprocess:
+        return None
+    options = PreprocessOptions(
+        max_side=args.max_side,
+        max_tokens=args.max_image_tokens,
+        trim_borders=not args.no_trim_borders,
+        format=args.image_format,
+        quality=args.image_quality,
+    )
+    return ImagePreprocessor(options, max_workers=args.preprocess_workers)
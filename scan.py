@@ -0,0 +1,144 @@
+"""Incremental directory scanning backed by a manifest of directory mtimes."""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Directories modified this close to the scan are listed again next time, since
+# a file added within the same mtime tick would not change it.
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def default_manifest_path(index_file):
+    """Returns the manifest path used for `index_file` when none is given."""
+    index_file = Path(index_file)
+    return index_file.with_name(f"{index_file.stem}.manifest.json")
+
+
+def load_manifest(manifest_file):
+    """Reads a scan manifest, returning an empty one if it is missing or corrupt."""
+    if manifest_file is None or not Path(manifest_file).exists():
+        return {}
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        logger.warning("Ignoring unreadable scan manifest %s", manifest_file)
+        return {}
+
+
+def save_manifest(manifest_file, manifest):
+    """Writes a scan manifest atomically."""
+    manifest_file = Path(manifest_file)
+    tmp_file = manifest_file.with_name(manifest_file.name + ".tmp")
+    with open(tmp_file, "w") as f:
+        f.write(json.dumps(manifest, separators=(",", ":")))
+    os.replace(tmp_file, manifest_file)
+
+
+class _Walker:
+    """Walks one subtree, reusing the manifest entries of unchanged directories."""
+
+    def __init__(self, root, previous, accept, scan_start_ns, full=False):
+        self.root = root
+        self.previous = previous
+        self.full = full
+        self.accept = accept
+        self.scan_start_ns = scan_start_ns
+        self.manifest = {}
+        self.files = []
+        self.listed = 0
+
+    def _list(self, path, mtime_ns):
+        dirs, files = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif self.accept(entry.name) and entry.is_file():
+                    files.append(entry.name)
+        if self.scan_start_ns - mtime_ns < RACY_WINDOW_NS:
+            mtime_ns = None
+        return {"mtime": mtime_ns, "dirs": sorted(dirs), "files": sorted(files)}
+
+    def visit(self, relative_dir):
+        """Records one directory and returns its manifest entry, or None."""
+        path = os.path.join(self.root, relative_dir)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            entry = None if self.full else self.previous.get(relative_dir)
+            if entry is None or entry["mtime"] != mtime_ns:
+                entry = self._list(path, mtime_ns)
+                self.listed += 1
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("Could not scan %s: %s", path, e)
+            return None
+        self.manifest[relative_dir] = entry
+        prefix = relative_dir + os.sep if relative_dir else ""
+        self.files.extend(prefix + name for name in entry["files"])
+        return entry
+
+    def walk(self, relative_dir):
+        stack = [relative_dir]
+        while stack:
+            relative_dir = stack.pop()
+            entry = self.visit(relative_dir)
+            if entry is not None:
+                stack.extend(os.path.join(relative_dir, name) for name in entry["dirs"])
+        return self
+
+
+def scan_directory(directory, accept, manifest_file=None, max_workers=None, full=False):
+    """
+    Lists the files under `directory` whose name passes `accept`.
+
+    Directories whose mtime matches the manifest are not listed again: their
+    files and subdirectories are taken from the manifest, so only the
+    directories that gained or lost entries are read. The subtrees of the
+    top-level directories (the groups) are walked in parallel threads.
+
+    Args:
+        directory (str | Path): The directory to scan.
+        accept (callable): Takes a file name and returns whether to keep it.
+        manifest_file (Path | None): Manifest from the previous scan, updated
+            in place. Without one every directory is listed.
+        max_workers (int | None): Threads walking the group directories.
+        full (bool): List every directory and rebuild the manifest.
+
+    Returns:
+        list[str]: The matching files, relative to `directory`, in no
+        particular order.
+    """
+    root = str(directory)
+    previous = load_manifest(manifest_file)
+    scan_start_ns = time.time_ns()
+
+    def walker():
+        return _Walker(root, previous, accept, scan_start_ns, full=full)
+
+    top = walker()
+    top_entry = top.visit("")
+    if top_entry is None:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        walkers = list(
+            executor.map(lambda name: walker().walk(name), top_entry["dirs"])
+        )
+
+    manifest, files, listed = top.manifest, top.files, top.listed
+    for subtree in walkers:
+        manifest.update(subtree.manifest)
+        files.extend(subtree.files)
+        listed += subtree.listed
+
+    logger.info("Scanned %s: listed %d of %d directories", root, listed, len(manifest))
+    if manifest_file is not None and (listed or manifest.keys() != previous.keys()):
+        save_manifest(manifest_file, manifest)
+    return files
@@ -0,0 +1,370 @@
+"""Rate limiting, adaptive concurrency and retries for Gemini API calls."""
+
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import httpx
+from google.genai import errors
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean "try again later" rather than "this request is bad".
+THROTTLE_STATUS_CODES = (429, 503)
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# Rough token cost of one image tile and of one character of text.
+IMAGE_TOKENS = 258
+CHARS_PER_TOKEN = 4
+
+
+def estimate_request_tokens(instructions, prompt, images=1):
+    """Estimates the input tokens of a request without calling count_tokens."""
+    text_tokens = (len(instructions) + len(prompt)) // CHARS_PER_TOKEN
+    return text_tokens + images * IMAGE_TOKENS
+
+
+def is_retryable(exc):
+    """Returns True if a failed call is worth retrying."""
+    if isinstance(exc, errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (httpx.TimeoutException, httpx.NetworkError))
+
+
+def is_throttled(exc):
+    """Returns True if the service asked us to slow down."""
+    return isinstance(exc, errors.APIError) and exc.code in THROTTLE_STATUS_CODES
+
+
+def get_retry_after(exc):
+    """
+    Returns the delay in seconds requested by the service, if any.
+
+    Looks at the `Retry-After` header first and then at a `google.rpc.RetryInfo`
+    entry in the error details. Malformed values are ignored, so the caller
+    falls back to its own backoff.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            logger.debug("Ignoring malformed Retry-After header %r", value)
+
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        error = details.get("error", details)
+        entries = error.get("details") if isinstance(error, dict) else None
+        for detail in entries if isinstance(entries, list) else []:
+            delay = isinstance(detail, dict) and detail.get("retryDelay")
+            if delay:
+                try:
+                    return max(0.0, float(str(delay).rstrip("s")))
+                except ValueError:
+                    logger.debug("Ignoring malformed retryDelay %r", delay)
+    return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    Callers reserve tokens up front and wait for the returned delay, so waiting
+    callers are served in order. Requests larger than the bucket are charged
+    as a full bucket so they cannot block forever.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def reserve(self, amount=1):
+        """Takes `amount` tokens and returns the seconds to wait before using them."""
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, amount=1):
+        time.sleep(self.reserve(amount))
+
+    def adjust(self, amount):
+        """Charges (or refunds, if negative) tokens after the real cost is known."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits in-flight calls with additive-increase/multiplicative-decrease.
+
+    Every success grows the limit by roughly one slot per round of calls, and
+    a throttling response cuts it by `decrease`. Decreases are applied at most
+    once per `cooldown` seconds so a burst of 429s from the same congestion
+    only halves the limit once. The limit never exceeds `max_workers`.
+    """
+
+    def __init__(self, max_workers, initial=None, decrease=0.5, cooldown=1.0):
+        self.max_workers = max_workers
+        self.limit = float(initial or max_workers)
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Wakes the coroutines of `acquire_async`, bound to one event loop.
+        self._async_condition = None
+        self._async_loop = None
+
+    def _has_slot(self):
+        return self.in_flight < max(1, int(self.limit))
+
+    def acquire(self):
+        with self._condition:
+            while not self._has_slot():
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _try_acquire(self):
+        with self._condition:
+            if not self._has_slot():
+                return False
+            self.in_flight += 1
+            return True
+
+    def _get_async_condition(self):
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_condition = asyncio.Condition()
+            self._async_loop = loop
+        return self._async_condition
+
+    async def acquire_async(self):
+        """Waits for a slot under the current limit without blocking the loop."""
+        condition = self._get_async_condition()
+        async with condition:
+            while not self._try_acquire():
+                await condition.wait()
+
+    async def release_async(self):
+        self.release()
+        condition = self._get_async_condition()
+        async with condition:
+            condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.max_workers, self.limit + 1.0 / max(self.limit, 1))
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(1.0, self.limit * self.decrease)
+                self._last_decrease = now
+                logger.info("Throttled, concurrency limit is now %d", int(self.limit))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class RequestScheduler:
+    """
+    Runs API calls under a concurrency limit, rate limits and a retry policy.
+
+    Args:
+        max_workers (int): Ceiling on concurrent calls.
+        rpm (int | None): Requests per minute ceiling.
+        tpm (int | None): Tokens per minute ceiling.
+        max_retries (int): Retries of a retryable error before giving up.
+        base_delay (float): Backoff delay of the first retry, in seconds.
+        max_delay (float): Ceiling on a single backoff delay, in seconds.
+    """
+
+    def __init__(
+        self,
+        max_workers=4,
+        rpm=None,
+        tpm=None,
+        max_retries=6,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.concurrency = AdaptiveConcurrency(max_workers)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, exc=None):
+        """Returns the delay before retry `attempt`, honoring Retry-After."""
+        retry_after = get_retry_after(exc) if exc is not None else None
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        # Exponential backoff with full jitter.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def _reserve(self, tokens):
+        """Reserves rate limit capacity and returns the seconds to wait for it."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def _on_error(self, error, attempt):
+        """Records a failed attempt and returns the delay before retrying it."""
+        if not is_retryable(error) or attempt == self.max_retries:
+            raise error
+        if is_throttled(error):
+            self.concurrency.on_throttle()
+        delay = self.backoff(attempt, error)
+        with self._lock:
+            self.retries += 1
+            self.throttles += is_throttled(error)
+        logger.warning(
+            "Retrying in %.1fs (attempt %d/%d): %s",
+            delay,
+            attempt + 1,
+            self.max_retries,
+            error,
+        )
+        return delay
+
+    def call(self, fn, *args, tokens=0, on_retry=None, **kwargs):
+        """
+        Calls `fn(*args, **kwargs)`, retrying throttled and transient failures.
+
+        Args:
+            fn (callable): The API call, e.g. `client.models.generate_content`.
+            tokens (int): Estimated tokens of the request, charged to the TPM limit.
+            on_retry (callable | None): Called with the error of each failed
+                attempt that is retried.
+
+        Returns:
+            The return value of `fn`. The last error is raised once retries run out.
+        """
+        for attempt in range(self.max_retries + 1):
+            # Waits for rate limit capacity before taking a slot, so a call
+            # held back by the limit does not keep another from running.
+            time.sleep(self._reserve(tokens))
+            with self.concurrency:
+                try:
+                    result = fn(*args, **kwargs)
+                # _on_error re-raises whatever is not worth retrying.
+                except Exception as e:  # noqa: BLE001
+                    error = e
+                else:
+                    self.concurrency.on_success()
+                    self._charge_usage(result, tokens)
+                    return result
+
+            delay = self._on_error(error, attempt)
+            if on_retry is not None:
+                on_retry(error)
+            time.sleep(delay)
+
+    async def call_async(self, fn, *args, tokens=0, on_retry=None, **kwargs):
+        """
+        Awaits `fn(*args, **kwargs)` with the same limits and retries as `call`.
+
+        Each attempt waits for rate limit capacity and then for a slot under the
+        adaptive concurrency limit, so throttling reduces the requests in
+        flight as it does for threads.
+        """
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._reserve(tokens))
+            await self.concurrency.acquire_async()
+            try:
+                result = await fn(*args, **kwargs)
+            # _on_error re-raises whatever is not worth retrying.
+            except Exception as e:  # noqa: BLE001
+                error = e
+            else:
+                self.concurrency.on_success()
+                self._charge_usage(result, tokens)
+                return result
+            finally:
+                await self.concurrency.release_async()
+
+            delay = self._on_error(error, attempt)
+            if on_retry is not None:
+                on_retry(error)
+            await asyncio.sleep(delay)
+
+    def _charge_usage(self, response, estimated_tokens):
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None)
+        if self.tokens is not None and total:
+            self.tokens.adjust(total - estimated_tokens)
+
+
+def add_scheduler_arguments(parser):
+    """Adds the concurrency and rate limit options to an argparse parser."""
+    parser.add_argument(
+        "--max-workers",
+        default=4,
+        help="Maximum number of concurrent requests. Defaults to 4.",
+        type=int,
+    )
+    parser.add_argument(
+        "--rpm", default=None, help="Maximum requests per minute.", type=int
+    )
+    parser.add_argument(
+        "--tpm",
+        default=None,
+        help="Maximum input and output tokens per minute.",
+        type=int,
+    )
+    parser.add_argument(
+        "--max-retries",
+        default=6,
+        help="Retries of a throttled or failed request. Defaults to 6.",
+        type=int,
+    )
+
+
+def scheduler_from_args(args):
+    """Builds the request scheduler configured on the command line."""
+    return RequestScheduler(
+        max_workers=args.max_workers,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_retries=args.max_retries,
+    )
@@ -0,0 +1,129 @@
+"""Structured output: a response schema generated from the prompt's question list."""
+
+import json
+import logging
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+CANNOT_DETERMINE = "Cannot determine from image"
+IMAGE_ID_KEY = "Image ID"
+
+# Question types answered with exactly one of their options. Types ending in
+# "_other" or "_text" also take free text, so they stay plain strings.
+CHOICE_TYPES = {
+    "yes_no",
+    "multiple_choice",
+    "single_choice",
+    "multiple_choice_conditional",
+}
+
+
+def extract_questions(prompt):
+    """
+    Reads the JSON list of questions that follows "Questions:" in a prompt.
+
+    Returns:
+        list[dict]: The questions, each with at least a "number", or an empty
+        list if the prompt has none.
+    """
+    _, found, rest = prompt.partition("Questions:")
+    start = rest.find("[")
+    if not found or start == -1:
+        return []
+    try:
+        questions, _ = json.JSONDecoder().raw_decode(rest, start)
+    except json.JSONDecodeError as e:
+        logger.warning("Could not parse the question list of the prompt: %s", e)
+        return []
+    return [q for q in questions if isinstance(q, dict) and "number" in q]
+
+
+def question_schema(question):
+    """Returns the schema of the answer to one question."""
+    question_type = question.get("type", "text")
+    description = question.get("question")
+    if question_type == "number":
+        # No count is visible: null rather than a sentinel string, so the
+        # column stays numeric.
+        return types.Schema(
+            type=types.Type.INTEGER, nullable=True, description=description
+        )
+    if question_type in CHOICE_TYPES and question.get("options"):
+        return types.Schema(
+            type=types.Type.STRING,
+            enum=[*question["options"], CANNOT_DETERMINE],
+            description=description,
+        )
+    return types.Schema(type=types.Type.STRING, description=description)
+
+
+def build_response_schema(questions):
+    """
+    Builds the response schema of an answer dictionary for `questions`.
+
+    Keys are the image ID and the question numbers, in the order the prompt's
+    example output uses, and every key is required.
+    """
+    properties = {IMAGE_ID_KEY: types.Schema(type=types.Type.STRING)}
+    for question in questions:
+        properties[str(question["number"])] = question_schema(question)
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties=properties,
+        property_ordering=list(properties),
+        required=list(properties),
+    )
+
+
+def structured_prompt(questions):
+    """
+    Renders a compact prompt for structured output.
+
+    The response schema already fixes the format and the allowed answers, so
+    the JSON formatting rules and examples of the full prompt are left out.
+    """
+    lines = [
+        (
+            "Answer the following questions about the image. If a question cannot "
+            f'be answered from the image, answer "{CANNOT_DETERMINE}".'
+        ),
+        "",
+    ]
+    for question in questions:
+        line = f"{question['number']}. {question.get('question', '')}"
+        options = question.get("options")
+        if options and question.get("type") not in CHOICE_TYPES:
+            line += f" ({' / '.join(options)})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def add_schema_arguments(parser):
+    """Adds the structured output options to an argparse parser."""
+    parser.add_argument(
+        "--structured-output",
+        action="store_true",
+        help=(
+            "Ask for JSON matching a schema built from the question list of the "
+            "prompt, and send only the questions instead of the full prompt."
+        ),
+    )
+
+
+def response_schema_from_args(args, prompt):
+    """
+    Returns the response schema and prompt configured on the command line.
+
+    Raises:
+        ValueError: If structured output is enabled but the prompt has no
+            question list.
+    """
+    if not args.structured_output:
+        return None, prompt
+    questions = extract_questions(prompt)
+    if not questions:
+        raise ValueError("--structured-output needs a prompt with a question list")
+    logger.info("Using a response schema for %d questions", len(questions))
+    return build_response_schema(questions), structured_prompt(questions)
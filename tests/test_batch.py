@@ -0,0 +1,62 @@
+import json
+
+from PIL import Image
+
+from analyzer import create_gemini_content, create_generate_content_config
+from batch import create_batch_request, run_batch
+from fake_client import FakeBatchBackend
+
+
+def test_create_batch_request():
+    contents = create_gemini_content("instructions", "prompt", b"\x89PNG")
+    request = create_batch_request(contents, create_generate_content_config())
+
+    assert request["contents"][0]["parts"][:2] == [
+        {"text": "instructions"},
+        {"text": "prompt"},
+    ]
+    assert request["contents"][0]["parts"][2]["inlineData"] == {
+        "data": "iVBORw==",
+        "mimeType": "image/png",
+    }
+    assert request["generationConfig"]["maxOutputTokens"] == 8192
+    assert "safetySettings" not in request["generationConfig"]
+    assert len(request["safetySettings"]) == 4
+
+
+def test_run_batch(tmp_path):
+    image_files = []
+    for i in range(3):
+        image_path = tmp_path / f"image_{i}.png"
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(image_path)
+        image_files.append((image_path.name, image_path))
+    # A copy of an image is sent once and answered for both ids.
+    copy_path = tmp_path / "copy.png"
+    copy_path.write_bytes(image_files[0][1].read_bytes())
+    image_files.append((copy_path.name, copy_path))
+
+    def respond(contents):
+        return json.dumps({"Image ID": "x", "1": contents[0]["parts"][1]["text"]})
+
+    backend = FakeBatchBackend(respond=respond, polls_until_done=3)
+    results = []
+    analyzed, total = run_batch(
+        backend,
+        "model",
+        image_files,
+        "instructions",
+        "prompt",
+        results.append,
+        requests_file=tmp_path / "requests.jsonl",
+        poll_interval=0,
+    )
+
+    assert (analyzed, total) == (4, 4)
+    assert len((tmp_path / "requests.jsonl").read_text().splitlines()) == 3
+    assert sorted(result["id"] for result in results) == [
+        "copy.png",
+        "image_0.png",
+        "image_1.png",
+        "image_2.png",
+    ]
+    assert all(result["1"] == "prompt" for result in results)
@@ -0,0 +1,68 @@
+import json
+from types import SimpleNamespace
+
+from PIL import Image
+
+from analyzer import analyze_image, create_generate_content_config
+from cache import ResponseCache, make_cache_key
+
+
+class CountingClient:
+    """Minimal stand-in for genai.Client that counts generate_content calls."""
+
+    def __init__(self, response_text):
+        self.calls = 0
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+        self.response_text = response_text
+
+    def generate_content(self, model, contents, config):
+        self.calls += 1
+        return SimpleNamespace(text=self.response_text)
+
+
+def test_make_cache_key():
+    config = create_generate_content_config()
+    key = make_cache_key(b"image", "instructions", "prompt", "model", config)
+
+    assert key == make_cache_key(b"image", "instructions", "prompt", "model", config)
+    assert key != make_cache_key(b"image2", "instructions", "prompt", "model", config)
+    assert key != make_cache_key(b"image", "instructions", "prompt", "other", config)
+    assert key != make_cache_key(
+        b"image",
+        "instructions",
+        "prompt",
+        "model",
+        create_generate_content_config(temperature=1),
+    )
+    assert key != make_cache_key(b"image", "instructionsprompt", "", "model", config)
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ResponseCache(tmp_path, max_size=10)
+    cache.put("a", "12345")
+    cache.put("b", "12345")
+    cache.get("a")
+    cache.put("c", "12345")
+    cache.evict()
+
+    assert cache.get("a") == "12345"
+    assert cache.get("b") is None
+    assert cache.get("c") == "12345"
+    cache.close()
+
+
+def test_analyze_image_uses_cache(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_path)
+    client = CountingClient(json.dumps({"Image ID": "image.png", "1": "Yes"}))
+    cache = ResponseCache(tmp_path / "cache")
+
+    for _ in range(3):
+        result = analyze_image(
+            client, "model", image_path, "instructions", "prompt", cache=cache
+        )
+        assert result == {"1": "Yes", "id": "image.png"}
+
+    assert client.calls == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.close()
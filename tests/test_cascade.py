@@ -0,0 +1,172 @@
+import argparse
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors
+from PIL import Image
+
+from analyzer import analyze_image
+from cascade import (
+    ModelCascade,
+    add_cascade_arguments,
+    cascade_from_args,
+    escalation_reason,
+)
+from engines import run_async, run_threaded
+from gemini import GeminiModel
+from index import iter_image_files
+from metrics import RunMetrics
+from schema import CANNOT_DETERMINE
+
+CHEAP = GeminiModel.FLASH_LITE_2_0.value
+STRONG = GeminiModel.PRO_2_5_PREVIEW.value
+PROMPT = 'Questions: [{"number": 1, "question": "A?"}, {"number": 2, "question": "B?"}]'
+
+
+def test_escalation_reason():
+    keys = ("1", "2")
+    assert escalation_reason(None, keys) == "parse"
+    assert escalation_reason({"id": "a", "1": "Yes"}, keys) == "missing_keys"
+    undetermined = {"id": "a", "1": CANNOT_DETERMINE, "2": CANNOT_DETERMINE}
+    assert escalation_reason(undetermined, keys) == "undetermined"
+    half = {"id": "a", "1": CANNOT_DETERMINE, "2": "No"}
+    assert escalation_reason(half, keys, max_undetermined=0.5) is None
+    assert escalation_reason(half, keys, max_undetermined=0.4) == "undetermined"
+
+
+class TieredClient:
+    """
+    Answers by model: the cheap one badly for odd images, or with an error
+    if `fail` is set.
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+        self.models = SimpleNamespace(generate_content=self._generate)
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self._generate_async)
+        )
+
+    def _generate(self, model, contents, config=None):
+        self.calls.append(model)
+        image = Image.open(io.BytesIO(contents[0].parts[2].inline_data.data))
+        odd = image.getpixel((0, 0))[0] % 2
+        if model == CHEAP and odd and self.fail:
+            raise errors.ClientError(
+                400, {"error": {"code": 400, "message": "Invalid argument."}}
+            )
+        if model == CHEAP and odd:
+            answers = {"1": CANNOT_DETERMINE, "2": CANNOT_DETERMINE}
+        else:
+            answers = {"1": "Yes", "2": "No"}
+        usage = SimpleNamespace(
+            prompt_token_count=100 if model == CHEAP else 1000,
+            candidates_token_count=10,
+        )
+        return SimpleNamespace(text=json.dumps(answers), usage_metadata=usage)
+
+    async def _generate_async(self, model, contents, config=None):
+        return self._generate(model, contents, config)
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    for i in range(6):
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(tmp_path / f"image_{i}.png")
+    return tmp_path
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_cascade_escalates_only_unusable_answers(engine, image_folder):
+    client = TieredClient()
+    cascade = ModelCascade([CHEAP, STRONG], required_keys=("1", "2"))
+    results = []
+
+    analyzed, total = engine(
+        client,
+        "unused",
+        [(f.name, f) for f in iter_image_files(image_folder)],
+        "instructions",
+        "prompt",
+        results.append,
+        cascade=cascade,
+    )
+
+    assert (analyzed, total) == (6, 6)
+    assert all(result["1"] == "Yes" for result in results)
+    assert client.calls.count(CHEAP) == 6 and client.calls.count(STRONG) == 3
+    report = cascade.report()
+    assert report[CHEAP]["hit_rate"] == 0.5
+    assert report[CHEAP]["escalated"] == {"undetermined": 3}
+    assert report[STRONG]["accepted"] == 3
+    assert report[STRONG]["latency"]["p50"] > 0
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_cascade_escalates_failed_requests(engine, image_folder):
+    client = TieredClient(fail=True)
+    cascade = ModelCascade([CHEAP, STRONG], required_keys=("1", "2"))
+    results = []
+
+    analyzed, total = engine(
+        client,
+        "unused",
+        [(f.name, f) for f in iter_image_files(image_folder)],
+        "instructions",
+        "prompt",
+        results.append,
+        cascade=cascade,
+    )
+
+    assert (analyzed, total) == (6, 6)
+    assert client.calls.count(STRONG) == 3
+    assert cascade.report()[CHEAP]["escalated"] == {"parse": 3}
+
+
+def test_cascade_prices_each_tier_on_its_own(image_folder):
+    client = TieredClient()
+    cascade = ModelCascade([CHEAP, STRONG], required_keys=("1", "2"))
+    metrics = RunMetrics()
+
+    result = analyze_image(
+        client,
+        "unused",
+        image_folder / "image_1.png",
+        "instructions",
+        "prompt",
+        metrics=metrics,
+        cascade=cascade,
+    )
+    summary = metrics.close()
+
+    assert result["1"] == "Yes"
+    assert summary["tokens"][CHEAP]["prompt_tokens"] == 100
+    assert summary["tokens"][STRONG]["prompt_tokens"] == 1000
+    assert cascade.report()[STRONG]["tokens"]["prompt_tokens"] == 1000
+
+
+def test_cascade_keeps_an_earlier_answer():
+    cascade = ModelCascade([CHEAP, STRONG], required_keys=("1",))
+    answers = {CHEAP: {"id": "a"}, STRONG: None}
+
+    row, model = cascade.route(lambda model: (answers[model], None))
+
+    assert (row, model) == ({"id": "a"}, CHEAP)
+    assert cascade.report()[STRONG]["escalated"] == {"parse": 1}
+
+
+def test_cascade_from_args():
+    parser = argparse.ArgumentParser()
+    add_cascade_arguments(parser)
+
+    assert cascade_from_args(parser.parse_args([]), PROMPT) is None
+    cascade = cascade_from_args(parser.parse_args(["--cascade", CHEAP, STRONG]), PROMPT)
+    assert cascade.models == [CHEAP, STRONG]
+    assert cascade.required_keys == ("1", "2")
+    with pytest.raises(ValueError, match="between 0 and 1"):
+        cascade_from_args(
+            parser.parse_args(["--cascade", CHEAP, "--max-undetermined", "2"]), PROMPT
+        )
@@ -0,0 +1,42 @@
+import csv
+
+from checkpoint import (
+    CheckpointWriter,
+    compile_checkpoint,
+    iter_checkpoint,
+    read_done_ids,
+)
+
+
+def test_resume_drops_incomplete_last_row(tmp_path):
+    checkpoint = tmp_path / "results.jsonl"
+    with CheckpointWriter(checkpoint) as writer:
+        writer.write({"1": "Yes", "id": "a.png"})
+    with open(checkpoint, "a") as f:
+        f.write('{"1": "No", "id": "b.p')
+
+    assert read_done_ids(checkpoint) == {"a.png"}
+
+    with CheckpointWriter(checkpoint, resume=True) as writer:
+        writer.write({"1": "No", "id": "b.png"})
+
+    assert [row["id"] for row in iter_checkpoint(checkpoint)] == ["a.png", "b.png"]
+
+
+def test_compile_checkpoint(tmp_path):
+    checkpoint = tmp_path / "results.jsonl"
+    output = tmp_path / "results.csv"
+    with CheckpointWriter(checkpoint) as writer:
+        writer.write({"1": "Yes", "2": "No", "id": "a.png"})
+        writer.write({"1": "No", "3": "Maybe", "id": "b.png"})
+        writer.write({"1": "Again", "id": "a.png"})
+
+    assert compile_checkpoint(checkpoint, output) == 2
+
+    with open(output, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        ["id", "1", "2", "3"],
+        ["a.png", "Yes", "No", ""],
+        ["b.png", "No", "", "Maybe"],
+    ]
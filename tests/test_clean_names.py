@@ -0,0 +1,117 @@
+import json
+import os
+
+from clean_names import (
+    RenamePlan,
+    list_tree,
+    read_journal,
+    rename_spaces,
+    undo_renames,
+)
+from index import read_index
+from index_store import IndexStore
+
+
+def make_tree(root):
+    (root / "Group A" / "sub dir").mkdir(parents=True)
+    (root / "Group A" / "sub dir" / "image 1.png").touch()
+    (root / "Group A" / "image 2.png").touch()
+    (root / "Group A" / "clean.png").touch()
+    (root / "Group B").mkdir()
+    (root / "Group B" / "a b.png").touch()
+    (root / "Group B" / "a\tb.png").touch()
+    (root / "Group B" / "c d.png").touch()
+    (root / "Group B" / "c_d.png").touch()
+
+
+def test_list_tree(tmp_path):
+    make_tree(tmp_path)
+    tree = list_tree(tmp_path)
+    assert set(tree) == {"", "Group A", "Group B", os.path.join("Group A", "sub dir")}
+    assert sorted(tree["Group A"]) == ["clean.png", "image 2.png", "sub dir"]
+
+
+def test_plan_renames_bottom_up_and_skips_collisions(tmp_path):
+    make_tree(tmp_path)
+    plan = RenamePlan(tmp_path)
+
+    assert [sorted(level) for level in plan.levels] == [
+        [
+            (
+                os.path.join("Group A", "sub dir", "image 1.png"),
+                os.path.join("Group A", "sub dir", "image_1.png"),
+            )
+        ],
+        [
+            (
+                os.path.join("Group A", "image 2.png"),
+                os.path.join("Group A", "image_2.png"),
+            ),
+            (os.path.join("Group A", "sub dir"), os.path.join("Group A", "sub_dir")),
+        ],
+        [("Group A", "Group_A"), ("Group B", "Group_B")],
+    ]
+    assert sorted(source for source, _ in plan.collisions) == [
+        os.path.join("Group B", "a\tb.png"),
+        os.path.join("Group B", "a b.png"),
+        os.path.join("Group B", "c d.png"),
+    ]
+    assert plan.entries == 10
+
+
+def test_dry_run_renames_nothing(tmp_path):
+    make_tree(tmp_path)
+    plan = rename_spaces(tmp_path, dry_run=True)
+    assert len(plan) == 5
+    assert (tmp_path / "Group A" / "sub dir" / "image 1.png").exists()
+
+
+def test_rename_updates_index_and_undo_restores_it(tmp_path):
+    root = tmp_path / "assets"
+    make_tree(root)
+    index_file = tmp_path / "file_index.json"
+    index = {
+        os.path.join("Group A", "sub dir", "image 1.png"): "MISC-0001",
+        os.path.join("Group A", "clean.png"): "MISC-0002",
+        os.path.join("Group B", "c d.png"): "MISC-0003",
+    }
+    index_file.write_text(json.dumps(index, indent=4))
+    journal_file = tmp_path / "renames.jsonl"
+
+    rename_spaces(root, journal_file=journal_file, index_file=index_file)
+
+    assert (root / "Group_A" / "sub_dir" / "image_1.png").exists()
+    assert (root / "Group_B" / "c d.png").exists()
+    assert list(read_index(index_file).items()) == [
+        (os.path.join("Group_A", "sub_dir", "image_1.png"), "MISC-0001"),
+        (os.path.join("Group_A", "clean.png"), "MISC-0002"),
+        (os.path.join("Group_B", "c d.png"), "MISC-0003"),
+    ]
+    assert len(read_journal(journal_file)) == 5
+
+    assert undo_renames(root, journal_file, index_file) == 5
+    assert (root / "Group A" / "sub dir" / "image 1.png").exists()
+    assert read_index(index_file) == index
+
+
+def test_rename_updates_sqlite_index(tmp_path):
+    root = tmp_path / "assets"
+    make_tree(root)
+    index_file = tmp_path / "index.sqlite3"
+    with IndexStore(index_file) as store:
+        store.import_entries(
+            [
+                (os.path.join("Group A", "image 2.png"), "MISC-0001"),
+                (os.path.join("Group_A", "image_2.png"), "MISC-0002"),
+                (os.path.join("Group A", "clean.png"), "MISC-0003"),
+            ]
+        )
+
+    rename_spaces(root, index_file=index_file)
+
+    # The stale entry already holds the new name, so the first one keeps its own.
+    assert read_index(index_file) == {
+        os.path.join("Group A", "image 2.png"): "MISC-0001",
+        os.path.join("Group_A", "image_2.png"): "MISC-0002",
+        os.path.join("Group_A", "clean.png"): "MISC-0003",
+    }
@@ -0,0 +1,116 @@
+import json
+
+from google.genai import errors
+from PIL import Image
+
+from analyzer import analyze_image
+from context_cache import PromptCache
+from fake_client import FakeClient
+
+
+def count_parts(contents):
+    return len(contents[0].parts)
+
+
+def make_client(**kwargs):
+    parts = []
+
+    def respond(contents):
+        parts.append(count_parts(contents))
+        return json.dumps({"Image ID": "image.png", "1": "Yes"})
+
+    return FakeClient(respond=respond, **kwargs), parts
+
+
+def test_analyze_image_references_cached_prompt(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_path)
+    client, parts = make_client()
+    prompt_cache = PromptCache(client, "model", "instructions", "prompt")
+
+    for _ in range(2):
+        result = analyze_image(
+            client,
+            "model",
+            image_path,
+            "instructions",
+            "prompt",
+            prompt_cache=prompt_cache,
+        )
+        assert result == {"1": "Yes", "id": "image.png"}
+
+    assert parts == [1, 1]
+    assert len(client.caches.contents) == 1
+    prompt_cache.close()
+    assert client.caches.contents == {}
+
+
+def test_analyze_image_falls_back_to_full_prompt(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_path)
+
+    client, parts = make_client(caching=False)
+    prompt_cache = PromptCache(client, "model", "instructions", "prompt")
+    assert analyze_image(
+        client, "model", image_path, "instructions", "prompt", prompt_cache=prompt_cache
+    )
+    assert prompt_cache.disabled
+    assert parts == [3]
+
+    # A cache that expired on the server is dropped and the image is retried.
+    client, parts = make_client()
+    prompt_cache = PromptCache(client, "model", "instructions", "prompt")
+    prompt_cache.get_name()
+    client.caches.contents.clear()
+    assert analyze_image(
+        client, "model", image_path, "instructions", "prompt", prompt_cache=prompt_cache
+    )
+    assert parts == [3]
+    assert prompt_cache.name is None
+
+
+def test_rejected_image_keeps_the_context_cache(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_path)
+
+    def respond(contents):
+        raise errors.ClientError(
+            400,
+            {
+                "error": {
+                    "code": 400,
+                    "message": "Unable to process input image.",
+                    "status": "INVALID_ARGUMENT",
+                }
+            },
+        )
+
+    client = FakeClient(respond=respond)
+    prompt_cache = PromptCache(client, "model", "instructions", "prompt")
+    name = prompt_cache.get_name()
+
+    for _ in range(2):
+        assert not analyze_image(
+            client,
+            "model",
+            image_path,
+            "instructions",
+            "prompt",
+            prompt_cache=prompt_cache,
+        )
+
+    assert prompt_cache.name == name
+    assert list(client.caches.contents) == [name]
+    # The cache was used, and the full prompt was never sent.
+    assert client.calls == 2
+
+
+def test_invalidated_cache_is_deleted():
+    client = FakeClient()
+    prompt_cache = PromptCache(client, "model", "instructions", "prompt")
+    name = prompt_cache.get_name()
+
+    prompt_cache.invalidate(name)
+
+    assert client.caches.contents == {}
+    assert prompt_cache.get_name() != name
@@ -0,0 +1,114 @@
+import csv
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+import dedup
+from dedup import (
+    BKTree,
+    DedupOptions,
+    compute_hashes,
+    dedup_work_items,
+    find_duplicates,
+    hamming,
+)
+from engines import run_threaded
+from fake_client import FakeClient
+
+
+def screenshot(seed, size=(400, 600)):
+    """Draws a post-like image: a white page with blocks of "text"."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    y = 20
+    while y < size[1] - 40:
+        height = rng.randint(8, 60)
+        shade = rng.randint(0, 200)
+        draw.rectangle(
+            (20, y, rng.randint(100, size[0] - 20), y + height), fill=(shade,) * 3
+        )
+        y += height + rng.randint(5, 25)
+    return img
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    for seed in range(3):
+        img = screenshot(seed)
+        img.save(tmp_path / f"post_{seed}.png")
+        # A re-screenshot: a few pixels scrolled and at another resolution.
+        img.crop((0, 6, 400, 600)).resize((380, 564)).save(
+            tmp_path / f"post_{seed}_again.png"
+        )
+    return tmp_path
+
+
+def work_items(image_folder):
+    return [(f.name, f) for f in sorted(image_folder.glob("*.png"))]
+
+
+def test_hashes_match_re_screenshots(image_folder):
+    (a, a_again), (b, _) = [
+        compute_hashes(
+            [image_folder / f"post_{i}.png", image_folder / f"post_{i}_again.png"]
+        )
+        for i in (0, 1)
+    ]
+
+    assert hamming(a[0], a_again[0]) <= dedup.DEFAULT_THRESHOLD
+    assert hamming(a[0], b[0]) > dedup.DEFAULT_THRESHOLD
+
+
+def test_bk_tree_matches_brute_force():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    values += [v ^ (1 << rng.randrange(64)) for v in values[:50]]
+    tree = BKTree()
+    for i, value in enumerate(values):
+        tree.add(value, i)
+
+    for query in values[:20]:
+        expected = sorted(
+            i for i, value in enumerate(values) if hamming(query, value) <= 3
+        )
+        assert sorted(i for _, i in tree.search(query, 3)) == expected
+    assert len(tree) == len(values)
+
+
+def test_find_duplicates(image_folder, monkeypatch):
+    # Small chunks send the hashing to the process pool.
+    monkeypatch.setattr(dedup, "CHUNK_SIZE", 2)
+
+    canonical, duplicates = find_duplicates(work_items(image_folder))
+
+    assert [image_id for image_id, _ in canonical] == [
+        f"post_{i}.png" for i in range(3)
+    ]
+    assert {key: [d[0] for d in value] for key, value in duplicates.items()} == {
+        f"post_{i}.png": [f"post_{i}_again.png"] for i in range(3)
+    }
+
+
+def test_duplicates_reuse_the_canonical_result(image_folder, tmp_path):
+    client = FakeClient()
+    results = []
+    report_file = tmp_path / "clusters.csv"
+
+    image_files, on_result = dedup_work_items(
+        work_items(image_folder), results.append, DedupOptions(report_file=report_file)
+    )
+    run_threaded(client, "model", image_files, "instructions", "prompt", on_result)
+
+    assert client.calls == 3
+    rows = {result["id"]: result for result in results}
+    assert len(rows) == 6
+    assert rows["post_1_again.png"]["duplicate_of"] == "post_1.png"
+    assert rows["post_1_again.png"]["1"] == rows["post_1.png"]["1"]
+    with open(report_file, newline="") as f:
+        report = list(csv.DictReader(f))
+    assert [row["id"] for row in report if row["cluster"] == "post_2.png"] == [
+        "post_2.png",
+        "post_2_again.png",
+    ]
@@ -0,0 +1,71 @@
+import pytest
+from PIL import Image
+
+from engines import run_async, run_threaded
+from fake_client import FakeClient
+from index import iter_image_files
+from scheduler import RequestScheduler
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    for group in ("group_a", "group_b"):
+        (tmp_path / group).mkdir()
+        for i in range(10):
+            Image.new("RGB", (4, 4)).save(tmp_path / group / f"image_{i}.png")
+    return tmp_path
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_engines_analyze_every_image(engine, image_folder):
+    client = FakeClient(latency=0.001, throttle_rate=0.2, seed=1)
+    scheduler = RequestScheduler(max_workers=4, base_delay=0.001, max_retries=50)
+    results = []
+
+    analyzed, total = engine(
+        client,
+        "model",
+        list(iter_image_files(image_folder)),
+        "instructions",
+        "prompt",
+        results.append,
+        scheduler=scheduler,
+    )
+
+    assert (analyzed, total) == (20, 20)
+    assert sorted(result["id"] for result in results) == sorted(
+        f"image_{i}.png" for i in range(10) for _ in range(2)
+    )
+    assert client.peak_in_flight <= 4
+
+
+def test_threaded_engine_submits_a_bounded_window(image_folder):
+    pulled = 0
+    ahead = []
+
+    def work_items():
+        nonlocal pulled
+        for _ in range(20):
+            for f in iter_image_files(image_folder):
+                pulled += 1
+                yield f
+
+    def on_result(result):
+        ahead.append(pulled - len(ahead))
+
+    analyzed, total = run_threaded(
+        FakeClient(latency=0.001),
+        "model",
+        work_items(),
+        "instructions",
+        "prompt",
+        on_result,
+        scheduler=RequestScheduler(max_workers=4),
+        window=8,
+    )
+
+    assert analyzed == total == 400
+    # The first result arrives before the work list is exhausted, and no
+    # more than the window is ever submitted ahead of the results.
+    assert ahead[0] <= 8
+    assert max(ahead) <= 8
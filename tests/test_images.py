@@ -0,0 +1,38 @@
+from PIL import Image
+
+from images import load_image, sniff_mime_type
+
+
+def test_sniff_mime_type():
+    assert sniff_mime_type(b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR") == "image/png"
+    assert sniff_mime_type(b"\xff\xd8\xff\xe0\x00\x10JFIF") == "image/jpeg"
+    assert sniff_mime_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_mime_type(b"GIF89a") is None
+    assert sniff_mime_type(b"") is None
+
+
+def test_load_image_returns_raw_bytes(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (4, 4), "red").save(image_path)
+
+    data, mime_type = load_image(image_path)
+
+    assert data == image_path.read_bytes()
+    assert mime_type == "image/png"
+
+
+def test_load_image_converts_unsupported_formats(tmp_path):
+    image_path = tmp_path / "image.gif"
+    Image.new("P", (4, 4)).save(image_path)
+
+    data, mime_type = load_image(image_path)
+
+    assert mime_type == "image/png"
+    assert sniff_mime_type(data) == "image/png"
+
+
+def test_load_image_rejects_non_images(tmp_path):
+    image_path = tmp_path / "notes.png"
+    image_path.write_text("not an image")
+
+    assert load_image(image_path) is None
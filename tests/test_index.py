@@ -3,9 +3,12 @@ from collections import OrderedDict
 import json
 
 from index import (
+    Index,
     infer_group_code_from_path,
+    get_group_counters,
     get_next_post_id,
     assign_post_id,
+    iter_image_files,
     process_directory,
 )
 
@@ -104,3 +107,87 @@ def test_process_directory(assets_dir):
         index = json.load(f)
     expected_index["New England Offshore Wind Discussion/image4.png"] = "NEOW-0002"
     assert index == expected_index
+
+
+def test_group_counters_allocate_the_same_ids_as_a_scan():
+    mapping = {"A": "AAAA", "B": "BBBB"}
+    index = OrderedDict({"A/old.png": "AAAA-0007", "C/old.png": "MISC-0002"})
+    counters = get_group_counters(index)
+    assert counters == {"AAAA": 7, "MISC": 2}
+
+    scanned = OrderedDict(index)
+    for i in range(50):
+        filename = f"{'ABC'[i % 3]}/image{i}.png"
+        index[filename] = assign_post_id(filename, index, mapping, counters)
+        scanned[filename] = assign_post_id(filename, scanned, mapping)
+    assert index == scanned
+    assert index["A/image0.png"] == "AAAA-0008"
+    assert index["B/image1.png"] == "BBBB-0001"
+
+
+def test_index_tracks_counters(tmp_path):
+    index_file = tmp_path / "file_index.json"
+    index_file.write_text(
+        json.dumps({"x/a.png": "NEOW-0041", "x/b.png": "bad", "x/c.png": "NEOW-7"})
+    )
+    mapping = {"New_England_Offshore_Wind_Discussion": "NEOW"}
+
+    index = Index(tmp_path / "assets", index_file, mapping=mapping)
+
+    assert index.counters == {"NEOW": 41}
+    assert index.add("New_England_Offshore_Wind_Discussion/c.png") == "NEOW-0042"
+    assert index.add("New_England_Offshore_Wind_Discussion/c.png") == "NEOW-0042"
+    assert index.add("Elsewhere/d.png") == "MISC-0001"
+    index["y/e.png"] = "NEOW-0100"
+    assert index.add("New_England_Offshore_Wind_Discussion/f.png") == "NEOW-0101"
+
+
+def test_index_lookups_follow_updates(tmp_path):
+    index_file = tmp_path / "file_index.json"
+    entries = {f"NEOW/{n}.png": f"NEOW-{n:04d}" for n in (5, 150, 99, 100, 200, 201)}
+    entries["PCNJ/1.png"] = "PCNJ-0001"
+    index_file.write_text(json.dumps(entries))
+
+    index = Index(tmp_path / "assets", index_file)
+
+    assert index.get_filename("NEOW-0150") == "NEOW/150.png"
+    assert index.get_filename("NEOW-0151") is None
+    assert index.post_id_range("NEOW-0100", "NEOW-0200") == [
+        ("NEOW-0100", "NEOW/100.png"),
+        ("NEOW-0150", "NEOW/150.png"),
+        ("NEOW-0200", "NEOW/200.png"),
+    ]
+    assert index.by_group["PCNJ"] == {"0001": "PCNJ/1.png"}
+
+    index["NEOW/120.png"] = "NEOW-0120"
+    del index["NEOW/150.png"]
+    index["PCNJ/1.png"] = "PCNJ-0002"
+    assert [p for p, _ in index.post_id_range("NEOW-0100", "NEOW-0200")] == [
+        "NEOW-0100",
+        "NEOW-0120",
+        "NEOW-0200",
+    ]
+    assert index.get_filename("NEOW-0150") is None
+    assert index.get_filename("PCNJ-0002") == "PCNJ/1.png"
+    assert index.by_group["PCNJ"] == {"0002": "PCNJ/1.png"}
+    assert index.post_id_range("MISC-0001", "MISC-0009") == []
+    with pytest.raises(ValueError):
+        index.post_id_range("NEOW-0001", "PCNJ-0009")
+
+    index.pop("NEOW/120.png")
+    assert index.get_filename("NEOW-0120") is None
+
+
+def test_iter_image_files(assets_dir):
+    (assets_dir / "Unknown Group" / "nested").mkdir()
+    (assets_dir / "Unknown Group" / "nested" / "image4.PNG").touch()
+
+    files = iter_image_files(assets_dir)
+
+    assert not isinstance(files, list)
+    assert sorted(f.relative_to(assets_dir).as_posix() for f in files) == [
+        "New England Offshore Wind Discussion/image1.png",
+        "Protect Our Coast - NJ Community Group/image2.jpg",
+        "Unknown Group/image3.gif",
+        "Unknown Group/nested/image4.PNG",
+    ]
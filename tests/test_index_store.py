@@ -0,0 +1,83 @@
+import json
+import multiprocessing
+
+from index import Index
+from index_store import IndexStore, is_store_file
+
+
+def allocate_in_process(path, worker):
+    with IndexStore(path) as store:
+        for i in range(50):
+            # Every worker also tries to claim the same shared files.
+            store.allocate([(f"own/{worker}-{i}.png", "AAAA")])
+            store.allocate([(f"shared/{i}.png", "AAAA")])
+
+
+def test_allocate_and_lookup(tmp_path):
+    with IndexStore(tmp_path / "index.sqlite3") as store:
+        allocated = store.allocate(
+            [("a/1.png", "AAAA"), ("b/1.png", "BBBB"), ("a/2.png", "AAAA")]
+        )
+        assert list(allocated.items()) == [
+            ("a/1.png", "AAAA-0001"),
+            ("b/1.png", "BBBB-0001"),
+            ("a/2.png", "AAAA-0002"),
+        ]
+        assert store.allocate([("a/1.png", "AAAA")]) == {"a/1.png": "AAAA-0001"}
+        assert store.get_post_id("b/1.png") == "BBBB-0001"
+        assert store.get_filename("AAAA-0002") == "a/2.png"
+        assert store.get_post_id("missing.png") is None
+        assert "a/1.png" in store and len(store) == 3
+        assert store.counters() == {"AAAA": 2, "BBBB": 1}
+
+
+def test_import_and_export_json(tmp_path):
+    legacy = {"x/a.png": "NEOW-0041", "x/b.png": "MISC-0002", "x/c.png": "bad"}
+    (tmp_path / "file_index.json").write_text(json.dumps(legacy, indent=4))
+
+    with IndexStore(tmp_path / "index.sqlite3") as store:
+        assert store.import_json(tmp_path / "file_index.json") == 3
+        assert store.import_json(tmp_path / "file_index.json") == 0
+        assert store.allocate([("x/d.png", "NEOW")]) == {"x/d.png": "NEOW-0042"}
+        store.export_json(tmp_path / "exported.json")
+
+    legacy["x/d.png"] = "NEOW-0042"
+    assert (tmp_path / "exported.json").read_text() == json.dumps(legacy, indent=4)
+
+
+def test_concurrent_allocation(tmp_path):
+    path = tmp_path / "index.sqlite3"
+    IndexStore(path).close()
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=allocate_in_process, args=(path, worker))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    with IndexStore(path) as store:
+        post_ids = [post_id for _, post_id in store.items()]
+    assert len(post_ids) == 4 * 50 + 50
+    assert sorted(post_ids) == [f"AAAA-{n:04d}" for n in range(1, len(post_ids) + 1)]
+
+
+def test_index_with_store(tmp_path):
+    root = tmp_path / "assets"
+    (root / "GroupA").mkdir(parents=True)
+    (root / "GroupA" / "image1.png").touch()
+    index_file = tmp_path / "index.sqlite3"
+    assert is_store_file(index_file)
+
+    index = Index(root, index_file, mapping={"GroupA": "AAAA"})
+    assert index == {"GroupA/image1.png": "AAAA-0001"}
+    assert index.add("GroupA/image2.png") == "AAAA-0002"
+
+    (root / "GroupA" / "image3.png").touch()
+    index = Index(root, index_file, mapping={"GroupA": "AAAA"})
+    assert index["GroupA/image3.png"] == "AAAA-0003"
+    with IndexStore(index_file) as store:
+        assert store.get_filename("AAAA-0002") == "GroupA/image2.png"
@@ -0,0 +1,121 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from engines import run_async, run_threaded
+from fake_client import FakeClient
+from gemini import GeminiModel, estimate_cost
+from index import iter_image_files
+from metrics import STAGES, RunMetrics, percentiles
+from scheduler import RequestScheduler
+
+USAGE = SimpleNamespace(
+    prompt_token_count=1000,
+    candidates_token_count=100,
+    cached_content_token_count=None,
+    thoughts_token_count=50,
+)
+MODEL = GeminiModel.FLASH_2_0.value
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for i in range(6):
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(folder / f"image_{i}.png")
+    return folder
+
+
+def work_items(image_folder):
+    return [(f.name, f) for f in sorted(iter_image_files(image_folder))]
+
+
+def test_percentiles():
+    assert percentiles([]) == [0.0, 0.0, 0.0]
+    p50, p95, p99 = percentiles(list(range(101)))
+    assert (p50, p95, p99) == (50.0, 95.0, 99.0)
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_run_metrics_records_each_request(engine, image_folder, tmp_path):
+    jsonl_file = tmp_path / "metrics.jsonl"
+    prometheus_file = tmp_path / "metrics.prom"
+    metrics = RunMetrics(jsonl_file, prometheus_file)
+    client = FakeClient(usage_metadata=USAGE)
+
+    engine(
+        client,
+        MODEL,
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        lambda result: None,
+        metrics=metrics,
+    )
+    summary = metrics.close()
+
+    records = [json.loads(line) for line in jsonl_file.read_text().splitlines()]
+    assert sorted(record["id"] for record in records) == [
+        f"image_{i}.png" for i in range(6)
+    ]
+    for record in records:
+        assert record["ok"] and record["parse_tier"] == "strict"
+        assert record["prompt_tokens"] == 1000 and record["thoughts_tokens"] == 50
+        assert record["total_s"] >= record["request_s"] > 0
+        assert all(f"{stage}_s" in record for stage in STAGES)
+
+    assert (summary["requests"], summary["images"], summary["failed"]) == (6, 6, 0)
+    assert summary["tokens"][MODEL]["output_tokens"] == 600
+    assert summary["cost"][MODEL] == pytest.approx(estimate_cost(MODEL, 6000, 900))
+
+    text = prometheus_file.read_text()
+    assert 'cdl_wind_stage_seconds{stage="request",quantile="0.95"}' in text
+    assert "cdl_wind_requests_total 6" in text
+    assert f'cdl_wind_tokens_total{{model="{MODEL}",kind="prompt"}} 6000' in text
+
+
+def test_run_metrics_counts_retries(image_folder):
+    metrics = RunMetrics()
+    client = FakeClient(throttle_rate=0.3, seed=1)
+    scheduler = RequestScheduler(max_workers=2, base_delay=0.0, max_delay=0.0)
+
+    run_threaded(
+        client,
+        MODEL,
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        lambda result: None,
+        scheduler=scheduler,
+        metrics=metrics,
+    )
+    summary = metrics.close()
+
+    assert client.throttled > 0
+    assert summary["retries"] == client.throttled == scheduler.retries
+
+
+def test_failed_requests_are_recorded(image_folder):
+    metrics = RunMetrics()
+    client = FakeClient(respond=lambda contents: "no json here")
+
+    run_threaded(
+        client,
+        MODEL,
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        lambda result: None,
+        metrics=metrics,
+    )
+    summary = metrics.close()
+
+    assert summary["failed"] == 6
+    assert summary["parse_tiers"] == {"failed": 6}
+
+
+def test_unknown_model_has_no_cost():
+    assert estimate_cost("some-model", 100, 100) is None
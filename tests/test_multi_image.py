@@ -0,0 +1,205 @@
+import asyncio
+import json
+
+import pytest
+from PIL import Image
+
+import engines
+from analyzer import (
+    analyze_images,
+    analyze_images_async,
+    create_generate_content_config,
+    create_multi_image_content,
+    match_rows,
+    use_cached_content,
+)
+from engines import run_async, run_threaded
+from fake_client import FakeClient, image_labels
+from index import iter_image_files
+from metrics import RunMetrics
+from schema import build_response_schema
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    for i in range(10):
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(tmp_path / f"image_{i}.png")
+    return tmp_path
+
+
+def work_items(image_folder):
+    return [(f.name, f) for f in sorted(iter_image_files(image_folder))]
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_engines_pack_images_per_request(engine, image_folder):
+    client = FakeClient()
+    results = []
+
+    analyzed, total = engine(
+        client,
+        "model",
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        results.append,
+        images_per_request=4,
+    )
+
+    assert (analyzed, total) == (10, 10)
+    assert client.calls == 3
+    assert sorted(result["id"] for result in results) == [
+        f"image_{i}.png" for i in range(10)
+    ]
+    assert all("Image ID" not in result for result in results)
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_engines_pack_plain_paths(engine, image_folder):
+    results = []
+
+    analyzed, total = engine(
+        FakeClient(),
+        "model",
+        sorted(iter_image_files(image_folder)),
+        "instructions",
+        "prompt",
+        results.append,
+        images_per_request=4,
+    )
+
+    assert (analyzed, total) == (10, 10)
+    assert sorted(result["id"] for result in results) == [
+        f"image_{i}.png" for i in range(10)
+    ]
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_a_failed_batch_does_not_stop_the_run(engine, image_folder, monkeypatch):
+    def fail_first(analyze):
+        def wrapper(client, model, batch, *args, **kwargs):
+            if batch[0][0] == "image_0.png":
+                raise RuntimeError("boom")
+            return analyze(client, model, batch, *args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(engines, "analyze_images", fail_first(analyze_images))
+    monkeypatch.setattr(
+        engines, "analyze_images_async", fail_first(analyze_images_async)
+    )
+    results = []
+
+    analyzed, total = engine(
+        FakeClient(),
+        "model",
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        results.append,
+        images_per_request=4,
+    )
+
+    assert (analyzed, total) == (6, 10)
+    assert sorted(result["id"] for result in results) == [
+        f"image_{i}.png" for i in range(4, 10)
+    ]
+
+
+def test_incomplete_responses_are_split_and_retried(image_folder):
+    def respond(contents):
+        # Drops the last answer of any request with more than two images.
+        labels = image_labels(contents)
+        if len(labels) > 2:
+            labels = labels[:-1]
+        return json.dumps([{"Image ID": label, "1": "Yes"} for label in labels])
+
+    client = FakeClient(respond=respond)
+    items = work_items(image_folder)[:8]
+
+    results = analyze_images(client, "model", items, "instructions", "prompt")
+
+    assert [result["id"] for result in results] == [name for name, _ in items]
+    # 8 -> 7 answered, the last one retried in a half of one.
+    assert client.calls == 2
+
+
+@pytest.mark.parametrize("is_async", [False, True])
+def test_split_keeps_schema_and_metrics(is_async, image_folder):
+    def respond(contents):
+        labels = image_labels(contents)
+        if len(labels) > 2:
+            labels = labels[:-1]
+        return json.dumps([{"Image ID": label, "1": "Yes"} for label in labels])
+
+    client = FakeClient(respond=respond)
+    items = work_items(image_folder)[:4]
+    metrics = RunMetrics()
+    options = {
+        "response_schema": build_response_schema([{"number": 1}]),
+        "metrics": metrics,
+    }
+
+    if is_async:
+        results = asyncio.run(
+            analyze_images_async(
+                client, "model", items, "instructions", "prompt", **options
+            )
+        )
+    else:
+        results = analyze_images(
+            client, "model", items, "instructions", "prompt", **options
+        )
+
+    assert [result["id"] for result in results] == [name for name, _ in items]
+    summary = metrics.close()
+    # 4 -> 3 answered, the last one retried alone.
+    assert (summary["requests"], summary["images"], summary["failed"]) == (2, 5, 1)
+
+
+def test_unparseable_responses_fall_back_to_single_images(image_folder):
+    def respond(contents):
+        labels = image_labels(contents)
+        if len(labels) > 1:
+            return '[{"Image ID": "image_0.png", "1": "Ye'
+        return json.dumps([{"Image ID": labels[0], "1": "Yes"}])
+
+    client = FakeClient(respond=respond)
+    items = work_items(image_folder)[:4]
+
+    results = analyze_images(client, "model", items, "instructions", "prompt")
+
+    assert len(results) == 4
+    # 4 -> 2 + 2 -> 1 + 1 + 1 + 1
+    assert client.calls == 7
+
+
+def test_match_rows():
+    image_ids = ["NEOW-0001", "NEOW-0002"]
+
+    by_label = match_rows(
+        '```json\n[{"Image ID": "NEOW-0002", "1": "No"}, '
+        '{"Image ID": "NEOW-0001", "1": "Yes"}]\n```',
+        image_ids,
+    )
+    by_position = match_rows('[{"1": "Yes"}, {"1": "No"}]', image_ids)
+    unmatched = match_rows('[{"1": "Yes"}]', image_ids)
+
+    assert by_label["NEOW-0001"] == {"1": "Yes", "id": "NEOW-0001"}
+    assert by_position["NEOW-0002"] == {"1": "No", "id": "NEOW-0002"}
+    assert unmatched == {}
+
+
+def test_cached_content_keeps_the_image_labels():
+    contents = create_multi_image_content(
+        "instructions",
+        "prompt",
+        [("a", b"\x89PNG", "image/png"), ("b", b"\x89PNG", "image/png")],
+    )
+
+    contents, _ = use_cached_content(
+        contents, create_generate_content_config(), "cachedContents/1"
+    )
+
+    assert image_labels(contents) == ["a", "b"]
+    assert "instructions" not in [part.text for part in contents[0].parts]
@@ -0,0 +1,92 @@
+from functools import reduce
+
+import pandas as pd
+import pytest
+
+from parser import (
+    convert_dicts_to_dataframe,
+    join_post_ids,
+    parse_json_like_output,
+    parse_stats,
+)
+
+
+def concat_dicts(list_of_dicts):
+    """The previous row-by-row implementation, kept as a reference."""
+    dfs = [pd.DataFrame({k: [v] for k, v in d.items()}) for d in list_of_dicts]
+    df = reduce(lambda x, y: pd.concat([x, y], axis=0, ignore_index=True), dfs)
+    df.insert(0, "id", df.pop("id"))
+    return df
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        [
+            {"1": "A", "2": "B", "id": "file1.png"},
+            {"1": "C", "2": "D", "id": "file2.png"},
+        ],
+        [
+            {"1": "A", "3": 38, "id": "file1.png"},
+            {"2": "B", "id": "file2.png", "1": "C"},
+            {"id": "file3.png", "18": "extra", "3": 12},
+        ],
+    ],
+)
+def test_convert_dicts_to_dataframe_matches_concat(rows):
+    df = convert_dicts_to_dataframe(rows)
+
+    assert next(iter(df.columns)) == "id"
+    pd.testing.assert_frame_equal(df, concat_dicts(rows))
+
+
+def test_convert_dicts_to_dataframe_empty():
+    assert convert_dicts_to_dataframe([]).empty
+
+
+def test_join_post_ids():
+    index = {
+        "NEOW/a.png": "NEOW-0001",
+        "PCNJ/a.png": "PCNJ-0001",
+        "PCNJ/b.png": "PCNJ-0002",
+    }
+    results = pd.DataFrame(
+        {
+            "id": ["NEOW/a.png", "assets/PCNJ/a.png", "b.png", "a.png", "c.png"],
+            "1": ["Yes", "No", "Yes", "No", "Yes"],
+        }
+    )
+
+    joined = join_post_ids(results, index, directory="assets")
+
+    assert list(joined.columns) == ["id", "post_id", "1"]
+    # "a.png" is ambiguous and "c.png" is not indexed.
+    assert joined["post_id"][:3].tolist() == ["NEOW-0001", "PCNJ-0001", "PCNJ-0002"]
+    assert joined["post_id"][3:].isna().all()
+    assert "post_id" not in results
+
+
+@pytest.mark.parametrize(
+    "text, tier",
+    [
+        ('{"1": "We can\'t see the turbines"}', "strict"),
+        ('```json\n{"1": "We can\'t see the turbines"}\n```', "strict"),
+        ('```\n{"1": "We can\'t see the turbines"}\n```', "strict"),
+        ('Sure:\n{"1": "We can\'t see the turbines"} {"2": "}"}', "extract"),
+        ('Note {not json}\n{"1": "We can\'t see the turbines"}', "extract"),
+        ("{'1': \"We can't see the turbines\",}", "repair"),
+    ],
+)
+def test_parse_json_like_output_tiers(text, tier):
+    parse_stats.reset()
+
+    assert parse_json_like_output(text) == {"1": "We can't see the turbines"}
+    assert parse_stats.report()[tier] == 1
+
+
+def test_parse_json_like_output_failures():
+    parse_stats.reset()
+
+    assert parse_json_like_output("Cannot determine from image") is None
+    assert parse_json_like_output('["not", "a", "dict"]') is None
+    assert parse_stats.report()["failed"] == 2
@@ -0,0 +1,108 @@
+import pytest
+from PIL import Image
+
+from fake_client import FakeClient
+from index import iter_image_files
+from metrics import RunMetrics
+from pipeline import StageWorkers, run_pipeline
+from preprocess import ImagePreprocessor
+from scheduler import RequestScheduler
+
+WORKERS = StageWorkers(load=2, request=4, parse=1, queue_size=4)
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    for i in range(12):
+        Image.new("RGB", (64, 64), (i, 0, 0)).save(tmp_path / f"image_{i}.png")
+    (tmp_path / "broken.png").write_text("not an image")
+    (tmp_path / "notes.txt").write_text("skipped")
+    return tmp_path
+
+
+def test_pipeline_analyzes_every_image(image_folder):
+    client = FakeClient(latency=0.001, throttle_rate=0.2, seed=1)
+    scheduler = RequestScheduler(max_workers=4, base_delay=0.001, max_retries=50)
+    metrics = RunMetrics()
+    results = []
+
+    with ImagePreprocessor(max_workers=1) as preprocessor:
+        analyzed, total = run_pipeline(
+            client,
+            "model",
+            iter_image_files(image_folder),
+            "instructions",
+            "prompt",
+            results.append,
+            scheduler=scheduler,
+            preprocessor=preprocessor,
+            metrics=metrics,
+            workers=WORKERS,
+        )
+
+    assert (analyzed, total) == (12, 13)
+    assert sorted(result["id"] for result in results) == sorted(
+        f"image_{i}.png" for i in range(12)
+    )
+    assert client.peak_in_flight <= 4
+    assert preprocessor.report()["images"] == 12
+    summary = metrics.close()
+    assert (summary["requests"], summary["failed"]) == (13, 1)
+    assert summary["parse_tiers"] == {"strict": 12}
+
+
+def test_pipeline_bounds_the_images_in_flight(image_folder):
+    pulled = 0
+    in_flight = []
+
+    def work_items():
+        nonlocal pulled
+        for _ in range(10):
+            for f in sorted(image_folder.glob("image_*.png")):
+                pulled += 1
+                yield (f"{pulled}", f)
+
+    def on_result(result):
+        in_flight.append(pulled - len(in_flight))
+
+    analyzed, total = run_pipeline(
+        FakeClient(latency=0.005),
+        "model",
+        work_items(),
+        "instructions",
+        "prompt",
+        on_result,
+        workers=WORKERS,
+    )
+
+    assert analyzed == total == 120
+    # Four queues plus the items held by the feeder, the stage threads and
+    # the consumer.
+    limit = 4 * WORKERS.queue_size + WORKERS.load + WORKERS.request + 3
+    assert max(in_flight) <= limit
+
+
+def test_pipeline_stops_feeding_on_error(image_folder):
+    pulled = 0
+
+    def work_items():
+        nonlocal pulled
+        for _ in range(50):
+            for f in sorted(image_folder.glob("image_*.png")):
+                pulled += 1
+                yield (f"{pulled}", f)
+
+    def on_result(result):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError, match="disk full"):
+        run_pipeline(
+            FakeClient(),
+            "model",
+            work_items(),
+            "instructions",
+            "prompt",
+            on_result,
+            workers=WORKERS,
+        )
+    assert pulled < 600
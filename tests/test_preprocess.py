@@ -0,0 +1,98 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from preprocess import (
+    ImagePreprocessor,
+    PreprocessOptions,
+    estimate_image_tokens,
+    preprocess_image,
+    target_size,
+    trim_borders,
+)
+
+
+def screenshot(size=(1170, 2532), margin=100):
+    """A white page with a noisy post inside uniform margins."""
+    img = Image.new("RGB", size, "white")
+    width, height = size
+    post_size = (width - 2 * margin, height - 2 * margin)
+    noise = Image.effect_noise(post_size, 32).convert("RGB")
+    img.paste(noise, (margin, margin))
+    return img
+
+
+def encode(img, format="PNG"):
+    buffered = io.BytesIO()
+    img.save(buffered, format=format)
+    return buffered.getvalue()
+
+
+def test_estimate_image_tokens():
+    assert estimate_image_tokens(384, 200) == 258
+    assert estimate_image_tokens(768, 768) == 258
+    assert estimate_image_tokens(769, 768) == 2 * 258
+    assert estimate_image_tokens(1170, 2532) == 8 * 258
+
+
+def test_trim_borders():
+    img = Image.new("RGB", (400, 600), "white")
+    ImageDraw.Draw(img).rectangle((50, 60, 349, 539), fill="black")
+    assert trim_borders(img).size == (300, 480)
+
+    blank = Image.new("RGB", (10, 10), "white")
+    assert trim_borders(blank) is blank
+
+
+def test_target_size():
+    assert target_size(1170, 2532, max_side=1536) == (710, 1536)
+    assert target_size(500, 300, max_side=1536) == (500, 300)
+
+    width, height = target_size(1170, 2532, max_tokens=3 * 258)
+    assert estimate_image_tokens(width, height) <= 3 * 258
+    assert abs(width / height - 1170 / 2532) < 0.01
+
+
+def test_preprocess_image_shrinks_screenshots():
+    data = encode(screenshot())
+
+    processed, mime_type, tokens_before, tokens_after = preprocess_image(
+        data, PreprocessOptions(max_side=1024, format="jpeg")
+    )
+
+    assert mime_type == "image/jpeg"
+    assert len(processed) < len(data)
+    assert tokens_before == 8 * 258
+    assert tokens_after < tokens_before
+    with Image.open(io.BytesIO(processed)) as img:
+        assert max(img.size) == 1024
+
+
+def test_preprocess_image_keeps_images_it_cannot_improve():
+    data = encode(Image.new("RGB", (8, 8), "red"))
+
+    processed, mime_type, tokens_before, tokens_after = preprocess_image(
+        data, PreprocessOptions(format="png")
+    )
+
+    assert processed is None and mime_type is None
+    assert tokens_before == tokens_after == 258
+
+
+def test_image_preprocessor_reports_savings():
+    data = encode(screenshot())
+
+    with ImagePreprocessor(PreprocessOptions(max_side=768), max_workers=1) as pool:
+        image_data, mime_type = pool.process(data, "image/png")
+        assert pool.process(b"not an image", "image/png") == (
+            b"not an image",
+            "image/png",
+        )
+        report = pool.report()
+
+    assert mime_type == "image/webp"
+    assert report["images"] == 1
+    assert report["bytes_saved"] == len(data) - len(image_data)
+    assert report["tokens_saved"] == 8 * 258 - estimate_image_tokens(
+        *Image.open(io.BytesIO(image_data)).size
+    )
@@ -0,0 +1,126 @@
+import argparse
+import json
+import random
+
+import pytest
+from PIL import Image
+
+from analyzer import create_gemini_content, create_multi_image_content
+from clients import RecordingClient, add_client_arguments, client_from_args
+from engines import run_serial, run_threaded
+from fake_client import FakeClient, ReplayResponder, image_key, parse_latency
+from index import iter_image_files
+from scheduler import RequestScheduler
+
+
+@pytest.fixture
+def image_folder(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for i in range(8):
+        Image.new("RGB", (4, 4), (i, 0, 0)).save(folder / f"image_{i}.png")
+    return folder
+
+
+def work_items(image_folder):
+    return [(f.name, f) for f in sorted(iter_image_files(image_folder))]
+
+
+def answer(i):
+    return json.dumps({"Image ID": f"image_{i}", "1": str(i)})
+
+
+def test_parse_latency():
+    rng = random.Random(0)
+    assert parse_latency("0.5") == 0.5
+    assert 1 <= parse_latency("uniform:1,2")(rng) <= 2
+    assert parse_latency("normal:0,1")(rng) >= 0
+    assert parse_latency("lognormal:1,0.5")(rng) > 0
+    with pytest.raises(ValueError, match="Unknown latency"):
+        parse_latency("gamma:1,2")
+
+
+def test_replay_answers_recorded_and_unknown_images(tmp_path):
+    fixtures = tmp_path / "fixtures"
+    fixtures.mkdir()
+    known = create_gemini_content("instructions", "prompt", b"known")
+    (fixtures / f"{image_key(known)}.txt").write_text(answer(0))
+    (fixtures / "other.txt").write_text(answer(1))
+    respond = ReplayResponder(fixtures)
+
+    assert respond(known) == answer(0)
+    unknown = create_gemini_content("instructions", "prompt", b"unknown")
+    assert respond(unknown) in (answer(0), answer(1))
+    assert respond(unknown) == respond(unknown)
+
+
+def test_replay_composes_multi_image_answers(tmp_path):
+    fixtures = tmp_path / "fixtures"
+    fixtures.mkdir()
+    for i in range(2):
+        contents = create_gemini_content("instructions", "prompt", f"{i}".encode())
+        text = f"```json\n{answer(i)}\n```"
+        (fixtures / f"{image_key(contents)}.txt").write_text(text)
+
+    contents = create_multi_image_content(
+        "instructions", "prompt", [("a", b"0", "image/png"), ("b", b"1", "image/png")]
+    )
+    assert json.loads(ReplayResponder(fixtures)(contents)) == [
+        json.loads(answer(0)),
+        json.loads(answer(1)),
+    ]
+
+
+def test_replay_requires_recorded_responses(tmp_path):
+    with pytest.raises(ValueError, match="No recorded responses"):
+        ReplayResponder(tmp_path)
+
+
+def test_recorded_responses_replay(image_folder, tmp_path):
+    fixtures = tmp_path / "fixtures"
+    recorded, replayed = [], []
+
+    run_serial(
+        RecordingClient(FakeClient(), fixtures),
+        "model",
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        recorded.append,
+    )
+    assert len(list(fixtures.glob("*.txt"))) == 8
+
+    client = FakeClient(
+        respond=ReplayResponder(fixtures),
+        throttle_rate=0.2,
+        error_rate=0.1,
+        malformed_rate=0.3,
+        seed=3,
+    )
+    analyzed, total = run_threaded(
+        client,
+        "model",
+        work_items(image_folder),
+        "instructions",
+        "prompt",
+        replayed.append,
+        scheduler=RequestScheduler(max_workers=2, base_delay=0.0, max_delay=0.0),
+    )
+
+    assert (analyzed, total) == (8, 8)
+    assert client.throttled and client.errors and client.malformed
+    assert sorted(replayed, key=lambda row: row["id"]) == recorded
+
+
+def test_client_from_args(tmp_path):
+    (tmp_path / "response.txt").write_text(answer(0))
+    parser = argparse.ArgumentParser()
+    add_client_arguments(parser)
+
+    args = parser.parse_args(["--replay", str(tmp_path), "--replay-latency", "0.1"])
+    client = client_from_args(args)
+    assert isinstance(client, FakeClient) and client.latency == 0.1
+
+    args = parser.parse_args(["--replay", str(tmp_path), "--record", str(tmp_path)])
+    with pytest.raises(ValueError, match="cannot be combined"):
+        client_from_args(args)
@@ -0,0 +1,94 @@
+import json
+import os
+
+from index import Index, has_image_extension, write_index
+from scan import load_manifest, scan_directory
+
+MAPPING = {"GroupA": "AAAA", "GroupB": "BBBB"}
+
+
+def make_tree(root):
+    for group in MAPPING:
+        (root / group / "nested").mkdir(parents=True)
+        (root / group / "image1.png").touch()
+        (root / group / "nested" / "image2.JPG").touch()
+    (root / "GroupA" / "notes.txt").touch()
+    (root / "top.png").touch()
+
+
+def age(root, seconds=10):
+    """Backdates every directory so the scan trusts their mtimes."""
+    for path in [root, *root.rglob("*")]:
+        if path.is_dir():
+            stat = path.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - seconds * 10**9))
+
+
+def test_scan_directory_reuses_unchanged_directories(tmp_path, caplog):
+    root = tmp_path / "assets"
+    make_tree(root)
+    age(root)
+    manifest_file = tmp_path / "manifest.json"
+
+    files = scan_directory(root, has_image_extension, manifest_file)
+    assert sorted(files) == [
+        os.path.join("GroupA", "image1.png"),
+        os.path.join("GroupA", "nested", "image2.JPG"),
+        os.path.join("GroupB", "image1.png"),
+        os.path.join("GroupB", "nested", "image2.JPG"),
+        "top.png",
+    ]
+    manifest = load_manifest(manifest_file)
+    assert set(manifest) == {
+        "",
+        "GroupA",
+        "GroupB",
+        os.path.join("GroupA", "nested"),
+        os.path.join("GroupB", "nested"),
+    }
+
+    (root / "GroupB" / "nested" / "image3.png").touch()
+    caplog.set_level("INFO", logger="scan")
+    new_files = scan_directory(root, has_image_extension, manifest_file)
+    assert "listed 1 of 5 directories" in caplog.text
+    assert sorted(new_files) == sorted(
+        files + [os.path.join("GroupB", "nested", "image3.png")]
+    )
+
+    (root / "GroupB" / "nested" / "image3.png").unlink()
+    assert sorted(scan_directory(root, has_image_extension, manifest_file)) == sorted(
+        files
+    )
+
+
+def test_index_writes_only_new_entries(tmp_path):
+    root = tmp_path / "assets"
+    make_tree(root)
+    index_file = tmp_path / "file_index.json"
+
+    index = Index(root, index_file, mapping=MAPPING)
+    assert index[os.path.join("GroupA", "image1.png")] == "AAAA-0001"
+    assert index[os.path.join("GroupB", "image1.png")] == "BBBB-0001"
+    # Groups are inferred from the parent directory only.
+    assert index[os.path.join("GroupA", "nested", "image2.JPG")] == "MISC-0001"
+    assert index["top.png"] == "MISC-0003"
+    assert (tmp_path / "file_index.manifest.json").exists()
+
+    (root / "GroupA" / "nested" / "image0.png").touch()
+    (root / "GroupB" / "image9.png").touch()
+    index = Index(root, index_file, mapping=MAPPING)
+    assert index[os.path.join("GroupA", "nested", "image0.png")] == "MISC-0004"
+    assert index[os.path.join("GroupB", "image9.png")] == "BBBB-0002"
+    assert index_file.read_text() == json.dumps(index, indent=4)
+
+
+def test_write_index_appends_in_json_dump_format(tmp_path):
+    index_file = tmp_path / "file_index.json"
+    index = {"a.png": "MISC-0001"}
+    write_index(index_file, index, index)
+
+    index["b.png"] = "MISC-0002"
+    index["c é.png"] = "MISC-0003"
+    write_index(index_file, index, {"b.png": "MISC-0002", "c é.png": "MISC-0003"})
+
+    assert index_file.read_text() == json.dumps(index, indent=4)
@@ -0,0 +1,169 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.genai import errors
+
+from fake_client import FakeClient, throttle_error
+from scheduler import (
+    AdaptiveConcurrency,
+    RequestScheduler,
+    get_retry_after,
+    is_retryable,
+)
+
+
+def test_get_retry_after():
+    assert get_retry_after(throttle_error(retry_after=7)) == 7.0
+    assert get_retry_after(throttle_error()) is None
+
+    error = errors.ClientError(
+        429,
+        {
+            "error": {
+                "code": 429,
+                "details": [
+                    {
+                        "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": "12s",
+                    }
+                ],
+            }
+        },
+    )
+    assert get_retry_after(error) == 12.0
+
+
+def test_get_retry_after_ignores_malformed_values():
+    assert get_retry_after(throttle_error(retry_after="soon")) is None
+    assert get_retry_after(throttle_error(retry_after="Mon, 99 Foo")) is None
+
+    error = throttle_error()
+    for details in (
+        {"error": "Resource exhausted"},
+        {"error": {"details": "none"}},
+        {"error": {"details": [{"retryDelay": "later"}]}},
+    ):
+        error.details = details
+        assert get_retry_after(error) is None
+
+
+def test_scheduler_retries_with_a_malformed_retry_after():
+    client = FakeClient(throttle_rate=0.5, retry_after="soon", seed=0)
+    scheduler = RequestScheduler(max_workers=1, base_delay=0.0, max_delay=0.0)
+
+    for _ in range(5):
+        scheduler.call(
+            client.models.generate_content, model="model", contents=[], config=None
+        )
+
+    assert client.throttled > 0
+    assert scheduler.retries == client.throttled
+
+
+def test_is_retryable():
+    assert is_retryable(throttle_error())
+    assert is_retryable(errors.ServerError(503, {"error": {"code": 503}}))
+    assert not is_retryable(errors.ClientError(400, {"error": {"code": 400}}))
+    assert not is_retryable(ValueError())
+
+
+def test_adaptive_concurrency():
+    concurrency = AdaptiveConcurrency(max_workers=8, cooldown=0)
+    concurrency.on_throttle()
+    assert concurrency.limit == 4
+    concurrency.on_throttle()
+    assert concurrency.limit == 2
+
+    for _ in range(100):
+        concurrency.on_success()
+    assert concurrency.limit == 8
+
+
+def test_scheduler_gives_up_on_non_retryable_errors():
+    scheduler = RequestScheduler(base_delay=0.001)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise errors.ClientError(400, {"error": {"code": 400}})
+
+    with pytest.raises(errors.ClientError):
+        scheduler.call(fail)
+    assert len(calls) == 1
+
+
+def test_rate_limit_wait_does_not_hold_a_slot(monkeypatch):
+    scheduler = RequestScheduler(max_workers=1, rpm=60)
+    scheduler.requests.tokens = 0
+    in_flight = []
+    monkeypatch.setattr(
+        "scheduler.time.sleep",
+        lambda seconds: in_flight.append(scheduler.concurrency.in_flight),
+    )
+
+    assert scheduler.call(lambda: "ok") == "ok"
+    assert in_flight == [0]
+
+
+def test_async_rate_limit_wait_does_not_hold_a_slot(monkeypatch):
+    scheduler = RequestScheduler(max_workers=1, rpm=60)
+    scheduler.requests.tokens = 0
+    in_flight = []
+
+    async def sleep(seconds):
+        in_flight.append(scheduler.concurrency.in_flight)
+
+    async def call():
+        return "ok"
+
+    monkeypatch.setattr("scheduler.asyncio.sleep", sleep)
+
+    assert asyncio.run(scheduler.call_async(call)) == "ok"
+    assert in_flight == [0]
+
+
+def test_scheduler_does_not_lose_throttled_requests():
+    client = FakeClient(latency=0.005, max_concurrency=2, throttle_rate=0.1, seed=0)
+    scheduler = RequestScheduler(max_workers=8, base_delay=0.001, max_retries=50)
+
+    def call(i):
+        return scheduler.call(
+            client.models.generate_content, model="model", contents=[i]
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(call, range(100)))
+
+    assert len(responses) == 100
+    assert all(response.text for response in responses)
+    assert client.throttled > 0
+    assert scheduler.retries == client.throttled
+
+
+def test_async_calls_respect_the_adaptive_limit():
+    client = FakeClient(latency=0.01)
+    scheduler = RequestScheduler(max_workers=8)
+    scheduler.concurrency.limit = 2.0
+    scheduler.concurrency.max_workers = 2
+
+    async def run():
+        await asyncio.gather(
+            *(
+                scheduler.call_async(
+                    client.aio.models.generate_content,
+                    model="model",
+                    contents=[],
+                    config=None,
+                )
+                for _ in range(12)
+            )
+        )
+
+    asyncio.run(run())
+    # A second event loop gets a fresh condition.
+    asyncio.run(run())
+
+    assert client.calls == 24
+    assert client.peak_in_flight == 2
+    assert scheduler.concurrency.in_flight == 0
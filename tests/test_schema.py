@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+from google.genai import types
+from PIL import Image
+
+from analyzer import (
+    analyze_image,
+    create_gemini_content,
+    create_generate_content_config,
+)
+from batch import create_batch_request
+from parser import convert_dicts_to_dataframe, parse_stats
+from schema import (
+    CANNOT_DETERMINE,
+    build_response_schema,
+    extract_questions,
+    structured_prompt,
+)
+
+PROMPT_FILE = Path(__file__).parents[1] / "prompts-instructions" / "prompt.txt"
+
+
+def test_extract_questions():
+    prompt = PROMPT_FILE.read_text()
+    questions = extract_questions(prompt)
+
+    assert [q["number"] for q in questions] == list(range(1, 18))
+    assert len(structured_prompt(questions)) < len(prompt) / 2
+    assert extract_questions("No question list here") == []
+
+
+def test_build_response_schema():
+    schema = build_response_schema(extract_questions(PROMPT_FILE.read_text()))
+
+    assert schema.property_ordering == ["Image ID", *map(str, range(1, 18))]
+    assert schema.required == schema.property_ordering
+    assert schema.properties["3"].type == types.Type.INTEGER
+    assert schema.properties["10"].enum == [
+        "Support",
+        "Oppose",
+        "Neutral",
+        "Unclear",
+        CANNOT_DETERMINE,
+    ]
+    # Questions that also take free text are not restricted to their options.
+    assert schema.properties["8"].enum is None
+
+
+def test_config_and_batch_request_carry_the_schema():
+    schema = build_response_schema([{"number": 1, "type": "number"}])
+    config = create_generate_content_config(response_schema=schema)
+    request = create_batch_request(
+        create_gemini_content("instructions", "prompt", b"\x89PNG"), config
+    )
+
+    assert create_generate_content_config().response_mime_type is None
+    assert request["generationConfig"]["responseMimeType"] == "application/json"
+    assert request["generationConfig"]["responseSchema"]["properties"]["1"] == {
+        "nullable": True,
+        "type": "INTEGER",
+    }
+
+
+def test_structured_responses_parse_to_native_columns(tmp_path):
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (4, 4)).save(image_path)
+    configs = []
+
+    def generate_content(model, contents, config):
+        configs.append(config)
+        return SimpleNamespace(
+            text=json.dumps({"Image ID": "image.png", "3": 38, "5": "Yes"}),
+            usage_metadata=None,
+        )
+
+    client = SimpleNamespace(models=SimpleNamespace(generate_content=generate_content))
+    schema = build_response_schema(extract_questions(PROMPT_FILE.read_text()))
+    parse_stats.reset()
+
+    result = analyze_image(
+        client, "model", image_path, "instructions", "prompt", response_schema=schema
+    )
+
+    assert configs[0].response_schema == schema
+    assert parse_stats.report()["strict"] == 1
+    assert convert_dicts_to_dataframe([result])["3"].dtype.kind == "i"
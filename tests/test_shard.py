@@ -0,0 +1,104 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+
+import pytest
+from PIL import Image
+
+from checkpoint import CheckpointWriter
+from engines import run_threaded
+from fake_client import FakeClient
+from merge import merge_checkpoints
+from worklist import in_shard, iter_work_items, parse_shard, shard_path
+
+SHARDS = 3
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    index = {}
+    for group in ("NEOW", "PCNJ"):
+        (tmp_path / "assets" / group).mkdir(parents=True)
+        for i in range(1, 13):
+            filename = f"{group}/image_{i}.png"
+            Image.new("RGB", (4, 4)).save(tmp_path / "assets" / filename)
+            index[filename] = f"{group}-{i:04d}"
+    index_file = tmp_path / "file_index.json"
+    index_file.write_text(json.dumps(index))
+    return index_file
+
+
+def test_parse_shard():
+    assert parse_shard("0/4") == (0, 4)
+    assert parse_shard("3/4") == (3, 4)
+    for spec in ("4/4", "-1/4", "1/0", "1", "a/b"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(spec)
+
+
+def test_shards_partition_the_work_list(index_file, tmp_path):
+    assets = tmp_path / "assets"
+    everything = [post_id for post_id, _ in iter_work_items(index_file, assets)]
+    shards = [
+        [post_id for post_id, _ in iter_work_items(index_file, assets, shard=(i, 3))]
+        for i in range(3)
+    ]
+
+    assert sorted(itertools.chain.from_iterable(shards)) == sorted(everything)
+    assert all(shards)
+    assert all(
+        in_shard("NEOW-0001", (i, 3)) == ("NEOW-0001" in shards[i]) for i in range(3)
+    )
+
+
+def run_shard(index_file, image_folder, checkpoint_file, shard):
+    with CheckpointWriter(shard_path(checkpoint_file, shard)) as writer:
+        run_threaded(
+            FakeClient(latency=0.001),
+            "model",
+            iter_work_items(index_file, image_folder, shard=shard),
+            "instructions",
+            "prompt",
+            writer.write,
+        )
+
+
+def test_sharded_run_merges_to_every_post_id(index_file, tmp_path):
+    checkpoint_file = tmp_path / "results.jsonl"
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=run_shard,
+            args=(index_file, tmp_path / "assets", checkpoint_file, (i, SHARDS)),
+        )
+        for i in range(SHARDS)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * SHARDS
+
+    output_file = tmp_path / "results.csv"
+    shards = sorted(tmp_path.glob("results.shard-*.jsonl"), reverse=True)
+    rows, missing = merge_checkpoints(shards, output_file, index_file)
+
+    with open(output_file, newline="") as f:
+        ids = [row["id"] for row in csv.DictReader(f)]
+    assert rows == 24
+    assert missing == []
+    assert sorted(ids) == sorted(json.loads(index_file.read_text()).values())
+
+
+def test_merge_reports_missing_post_ids(index_file, tmp_path):
+    checkpoint_file = tmp_path / "results.jsonl"
+    run_shard(index_file, tmp_path / "assets", checkpoint_file, (0, SHARDS))
+
+    _, missing = merge_checkpoints(
+        [shard_path(checkpoint_file, (0, SHARDS))], tmp_path / "results.csv", index_file
+    )
+
+    assert missing
+    assert not any(in_shard(post_id, (0, SHARDS)) for post_id in missing)
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+from PIL import Image
+
+from engines import run_async, run_threaded
+from fake_client import FakeClient
+from worklist import iter_work_items
+
+INDEX = {
+    "NEOW/image_1.png": "NEOW-0001",
+    "NEOW/image_2.png": "NEOW-0002",
+    "NEOW/image_3.png": "NEOW-0003",
+    "PCNJ/image_1.png": "PCNJ-0001",
+}
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    for filename in INDEX:
+        (tmp_path / "assets" / filename).parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (4, 4)).save(tmp_path / "assets" / filename)
+    index_file = tmp_path / "file_index.json"
+    index_file.write_text(json.dumps(INDEX))
+    return index_file
+
+
+def post_ids(*args, **kwargs):
+    return [post_id for post_id, _ in iter_work_items(*args, **kwargs)]
+
+
+def test_iter_work_items(index_file, tmp_path):
+    assets = tmp_path / "assets"
+    assert next(iter_work_items(index_file, assets)) == (
+        "NEOW-0001",
+        assets / "NEOW" / "image_1.png",
+    )
+    assert post_ids(index_file, assets, groups=["PCNJ"]) == ["PCNJ-0001"]
+    assert post_ids(index_file, assets, post_ids="NEOW-0002..NEOW-0009") == [
+        "NEOW-0002",
+        "NEOW-0003",
+    ]
+    assert post_ids(index_file, assets, done={"NEOW-0001", "NEOW-0003"}) == [
+        "NEOW-0002",
+        "PCNJ-0001",
+    ]
+    with pytest.raises(ValueError):
+        post_ids(index_file, assets, post_ids="NEOW-0001..PCNJ-0002")
+
+
+@pytest.mark.parametrize("engine", [run_threaded, run_async])
+def test_engines_key_rows_by_post_id(engine, index_file, tmp_path):
+    results = []
+
+    analyzed, total = engine(
+        FakeClient(),
+        "model",
+        list(iter_work_items(index_file, tmp_path / "assets")),
+        "instructions",
+        "prompt",
+        results.append,
+    )
+
+    # Both groups have an image_1.png; post IDs keep their rows apart.
+    assert (analyzed, total) == (4, 4)
+    assert sorted(result["id"] for result in results) == sorted(INDEX.values())
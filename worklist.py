@@ -0,0 +1,146 @@
+"""Work lists of (post ID, image path) pairs read from the file index."""
+
+import argparse
+import hashlib
+import logging
+from pathlib import Path
+
+from index import iter_image_files, parse_post_id, parse_post_id_range, read_index
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(spec):
+    """Parses a "--shard i/N" value into (i, N), with 0 <= i < N."""
+    index, separator, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = None
+    if not separator or count is None or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            f"Expected a shard like 0/4 with 0 <= i < N, got {spec!r}"
+        )
+    return index, count
+
+
+def shard_of(key, count):
+    """
+    Returns the shard of a post ID or relative file path among `count` shards.
+
+    The hash is stable across processes and machines, unlike `hash()`.
+    """
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def in_shard(key, shard):
+    """Returns True if `key` belongs to `shard` (an (i, N) pair, or None for all)."""
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+
+def shard_path(path, shard):
+    """Adds the shard to a file name, e.g. results.jsonl -> results.shard-0-of-4.jsonl."""
+    path = Path(path)
+    if shard is None:
+        return path
+    return path.with_name(f"{path.stem}.shard-{shard[0]}-of-{shard[1]}{path.suffix}")
+
+
+def iter_image_work_items(image_folder, shard=None):
+    """
+    Lazily yields the images under `image_folder` that belong to `shard`.
+
+    Files are assigned to shards by their path relative to `image_folder`,
+    so every worker must see the same folder layout.
+    """
+    image_folder = Path(image_folder)
+    for f in iter_image_files(image_folder):
+        if in_shard(f.relative_to(image_folder).as_posix(), shard):
+            yield f
+
+
+def iter_work_items(
+    index_file, image_folder, groups=None, post_ids=None, done=(), shard=None
+):
+    """
+    Yields the indexed images to analyze, keyed by their post ID.
+
+    Post IDs are unique across group folders, unlike file names, and stable
+    across machines, so work lists can be split by group or ID range without
+    any coordination.
+
+    Args:
+        index_file (str | Path): A `file_index.json` or SQLite index written by
+            `index.py`.
+        image_folder (str | Path): The directory the index was built from.
+        groups (Iterable[str] | None): Only yield these group codes.
+        post_ids (str | None): Only yield a range such as "NEOW-0100..NEOW-0200".
+        done (Container[str]): Post IDs that already have results.
+        shard (tuple[int, int] | None): Only yield the post IDs of shard i of N.
+
+    Yields:
+        tuple[str, Path]: The post ID and path of each image.
+    """
+    image_folder = Path(image_folder)
+    groups = set(groups) if groups else None
+    start = stop = None
+    if post_ids:
+        start, stop = (parse_post_id(p) for p in parse_post_id_range(post_ids))
+        if start is None or stop is None or start[0] != stop[0]:
+            raise ValueError(f"Invalid post ID range {post_ids}")
+
+    skipped = 0
+    for filename, post_id in read_index(index_file).items():
+        group_code, _, number = post_id.partition("-")
+        if groups is not None and group_code not in groups:
+            continue
+        if start is not None and not (
+            group_code == start[0]
+            and number.isdigit()
+            and start[1] <= int(number) <= stop[1]
+        ):
+            continue
+        if not in_shard(post_id, shard):
+            continue
+        if post_id in done:
+            skipped += 1
+            continue
+        yield post_id, image_folder / filename
+    if skipped:
+        logger.info("Skipped %d post IDs that already have results", skipped)
+
+
+def add_work_list_arguments(parser):
+    """Adds the index-driven work list options to an argparse parser."""
+    parser.add_argument(
+        "--index-file",
+        default=None,
+        help=(
+            "Analyze the images listed in this index (written by index.py) "
+            "and key rows by post ID instead of by file."
+        ),
+        type=Path,
+    )
+    parser.add_argument(
+        "--groups",
+        default=None,
+        help="With --index-file, only analyze these group codes.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--post-ids",
+        default=None,
+        help="With --index-file, only analyze a range such as NEOW-0100..NEOW-0200.",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help=(
+            "Only analyze shard i of N (0 <= i < N), assigned by a hash of the "
+            "post ID or relative file path. Each shard writes its own "
+            "checkpoint; combine them with merge.py."
+        ),
+        metavar="i/N",
+        type=parse_shard,
+    )